@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+One entry point for the MKS 974B gauge tools
+
+    hwutils.py report  ...   mksReport.py
+    hwutils.py setup   ...   mksSetup.py
+    hwutils.py read    ...   readPressure.py
+    hwutils.py readall ...   readAllPressure.py
+
+Every subcommand takes the options of its tool, with the port and
+transport options shared through mks974.add_port_arguments(). The tools
+import numpy and the trace/capture modules only on the code paths that
+use them, so a subcommand starts without paying for them.
+"""
+import sys
+import argparse
+import importlib
+import textwrap
+
+# subcommand: (module, entry point taking the parsed options, help)
+COMMANDS = {
+    "report": ("mksReport", "main", "report gauge metadata, settings and pressures"),
+    "setup": ("mksSetup", "main", "change gauge settings or apply a desired state"),
+    "read": ("readPressure", "read_pressure", "read the pressure of one gauge"),
+    "readall": ("readAllPressure", "read_pressure", "read the pressures of a bus"),
+}
+
+
+def parse_args(argv=None):
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Read, report and set up MKS 974B gauges
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: hwutils.py read --port /dev/ttyUSB0 --id 1 --count 10
+                    hwutils.py report --port /dev/ttyUSB0 --id 1
+                               """
+        ),
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (module, entry, summary) in COMMANDS.items():
+        sub = commands.add_parser(
+            name,
+            help=f"{summary} ({module}.py)",
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description=summary,
+        )
+        importlib.import_module(module).add_arguments(sub)
+    return parser.parse_args(argv)
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    module, entry, summary = COMMANDS[optlist.command]
+    getattr(importlib.import_module(module), entry)(optlist)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
@@ -0,0 +1,507 @@
+"""
+MKS 974B RS485 ASCII protocol codec shared by the gauge tools
+
+A query is sent as @{id:03d}{query}?;FF and a command as @{id:03d}{cmd};FF
+(cmd carrying its own "!arg"). The gauge answers @{id:03d}ACK{payload};FF
+or @{id:03d}NAK{code};FF. Request frames are built once per (id, command)
+and replies are parsed in a single pass without regular expressions.
+Replies are read into a reusable buffer and split into frames there, so
+several frames per read and frames split across reads are handled. On a
+half duplex (loopback) bus the echo of each request is dropped there too.
+"""
+import functools
+import logging
+import os
+import select
+import time
+import weakref
+import serial
+from typing import NamedTuple, Optional
+
+TERM = b";FF"
+MAX_RETRIES = 5
+BAUDRATES = (4800, 9600, 19200, 38400, 57600, 115200, 230400)
+
+
+class EchoError(Exception):
+    """the RS485 half duplex echo differs from the request sent"""
+
+
+class Reply(NamedTuple):
+    """decoded gauge reply frame"""
+
+    addr: int
+    ack: bool
+    payload: str
+
+    def value(self):
+        """payload as float, None if it is not numeric"""
+        return parse_value(self.payload)
+
+
+class Transaction(NamedTuple):
+    """outcome of a request/response exchange (unpacks like the old tuples)"""
+
+    result: Optional[str]
+    dt: float
+    retries: int
+    errcnt: int
+
+
+class Sample(NamedTuple):
+    """one timestamped reading from gauge `gid` on `port`"""
+
+    time: float
+    port: str
+    gid: int
+    value: Optional[float]
+    dt: float
+    retries: int
+
+
+def format_sample(sample):
+    """one line text form of a Sample"""
+    value = "None" if sample.value is None else f"{sample.value:.3E}"
+    return (
+        f"{sample.time:.6f} {sample.port}:{sample.gid:03d} {value}"
+        f" dt={sample.dt:.4f} rt={sample.retries}"
+    )
+
+
+def parse_bus(spec):
+    """split PORT:ID,ID... into (port, [ids])"""
+    port, _, ids = spec.rpartition(":")
+    if not port or not ids:
+        raise ValueError(f"bus spec {spec} is not PORT:ID[,ID...]")
+    return port, [int(gid) for gid in ids.split(",")]
+
+
+def parse_value(res):
+    """float value of a reply payload, None if missing or not numeric"""
+    if res is None:
+        return None
+    try:
+        return float(res)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def encode_query(gid, query):
+    """return the request bytes for query `query` to gauge `gid`"""
+    return b"@%03d%s?;FF" % (int(gid), query.encode())
+
+
+@functools.lru_cache(maxsize=None)
+def encode_cmd(gid, cmd):
+    """return the request bytes for command `cmd` (eg. "FD!LOCK") to `gid`"""
+    return b"@%03d%s;FF" % (int(gid), cmd.encode())
+
+
+def frame_addr(frame):
+    """RS485 address of a frame (bytes or memoryview), None if not 3 digits"""
+    d0 = frame[1] - 0x30
+    d1 = frame[2] - 0x30
+    d2 = frame[3] - 0x30
+    if 0 <= d0 <= 9 and 0 <= d1 <= 9 and 0 <= d2 <= 9:
+        return d0 * 100 + d1 * 10 + d2
+    return None
+
+
+def frame_ack(frame):
+    """True if frame is a complete @xxxACK...;FF reply"""
+    # compared byte by byte: no slice objects for memoryview frames
+    return (
+        len(frame) >= 10
+        and frame[0] == 0x40  # @
+        and frame[4] == 0x41  # A
+        and frame[5] == 0x43  # C
+        and frame[6] == 0x4B  # K
+        and frame[-3] == 0x3B  # ;
+        and frame[-2] == 0x46  # F
+        and frame[-1] == 0x46  # F
+    )
+
+
+def frame_value(frame):
+    """float payload of an ACK frame without decoding to str, None if not numeric"""
+    try:
+        return float(frame[7:-3])
+    except ValueError:
+        return None
+
+
+def parse_reply(resp):
+    """parse one @xxxACK...;FF or @xxxNAK...;FF frame, None if malformed"""
+    if len(resp) < 10 or resp[0] != 0x40 or resp[-3:] != TERM:
+        return None
+    status = resp[4:7]
+    if status == b"ACK":
+        ack = True
+    elif status == b"NAK":
+        ack = False
+    else:
+        return None
+    addr = frame_addr(resp)
+    if addr is None:
+        return None
+    return Reply(addr, ack, str(resp[7:-3], "ascii", "replace"))
+
+
+class FrameParser:
+    """incremental splitter of @xxx...;FF frames over one reusable buffer
+
+    Port data is read straight into a preallocated bytearray and complete
+    frames are handed out as memoryview slices of it, valid until the next
+    fill. A partial frame is kept for the next read; bytes outside frames
+    are counted in `dropped`. When `echo` is set to the request just sent,
+    exactly that many bytes are dropped ahead of the next frame and
+    EchoError is raised as soon as a received byte differs.
+    """
+
+    def __init__(self, size=1024):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.head = 0  # first unparsed byte
+        self.tail = 0  # end of received data
+        self.echo = None  # request whose echo is still due
+        self.first_ns = 0  # monotonic ns of the first reply byte, 0 if none yet
+        self.tap = None  # tap(sent, data) sees every byte written and read
+        self.frames = 0
+        self.dropped = 0
+        self.echoes = 0
+
+    def clear(self):
+        """forget buffered data (after the port input buffer was reset)"""
+        self.head = 0
+        self.tail = 0
+
+    def space(self):
+        """writable view of the free buffer, moving a partial frame to the front"""
+        if self.head:
+            size = self.tail - self.head
+            if size:
+                self.view[:size] = self.view[self.head : self.tail]
+            self.head = 0
+            self.tail = size
+        if self.tail == len(self.buf):  # full and no terminator: garbage
+            self.dropped += self.tail
+            self.tail = 0
+        return self.view[self.tail :]
+
+    def commit(self, size):
+        """account for `size` bytes written into space()"""
+        self.tail += size
+
+    def feed(self, data):
+        """copy data read by a port without file descriptor into the buffer"""
+        space = self.space()
+        if len(data) <= len(space):
+            space[: len(data)] = data
+            self.tail += len(data)
+            return
+        data = memoryview(data)
+        while data:
+            space = self.space()
+            size = min(len(space), len(data))
+            space[:size] = data[:size]
+            self.tail += size
+            data = data[size:]
+
+    def _drop_echo(self):
+        """consume the expected echo, False while it is incomplete"""
+        echo = self.echo
+        head = self.head
+        size = min(self.tail - head, len(echo))
+        if self.view[head : head + size] != echo[:size]:
+            self.echo = None
+            got = bytes(self.view[head : head + size])
+            self.clear()
+            raise EchoError(f"echo {got} of request {echo}")
+        if size < len(echo):
+            return False
+        self.head = head + size
+        self.echo = None
+        self.echoes += 1
+        return True
+
+    def next_frame(self):
+        """next complete frame as a memoryview, None if there is none yet"""
+        if self.echo is not None and not self._drop_echo():
+            return None
+        buf = self.buf
+        while True:
+            head = self.head
+            end = buf.find(TERM, head, self.tail)
+            if end < 0:
+                return None
+            end += 3
+            # last "@" before the terminator: skips garbage and truncated frames
+            start = buf.rfind(0x40, head, end)
+            self.head = end
+            if start >= 0:
+                break
+            self.dropped += end - head
+        if start > head:
+            self.dropped += start - head
+        self.frames += 1
+        return self.view[start:end]
+
+    def fill(self, ser, timeout):
+        """read what the port has within timeout, returns the byte count"""
+        fd = getattr(ser, "fd", None)
+        if fd is None:  # server proxy or stand-in: read_until(), port timeout
+            data = ser.read_until(expected=TERM, size=None)
+            if data and self.tap is not None:
+                self.tap(False, data)
+            self.feed(data)
+            self._first_byte()
+            return len(data)
+        if not select.select((fd,), (), (), timeout)[0]:
+            return 0
+        try:
+            size = os.readv(fd, (self.space(),))
+        except BlockingIOError:
+            return 0
+        self.commit(size)
+        if self.tap is not None:
+            self.tap(False, self.view[self.tail - size : self.tail])
+        self._first_byte()
+        return size
+
+    def _first_byte(self):
+        """stamp the arrival of the first byte beyond a pending echo"""
+        if not self.first_ns:
+            echo = 0 if self.echo is None else len(self.echo)
+            if self.tail - self.head > echo:
+                self.first_ns = time.monotonic_ns()
+
+    def next_match(self, prefix=None):
+        """next complete frame starting with `prefix` (eg. b"@001"), or None
+
+        Frames from other addresses, eg. late replies to an earlier
+        request, are skipped and counted in `dropped`.
+        """
+        frame = self.next_frame()
+        while frame is not None:
+            if prefix is None or self.buf.startswith(prefix, self.head - len(frame)):
+                return frame
+            self.dropped += len(frame)
+            frame = self.next_frame()
+        return None
+
+    def read_frame(self, ser, deadline_ns, prefix=None):
+        """next frame starting with `prefix` (eg. b"@001") or None on timeout
+
+        deadline_ns is in time.monotonic_ns(). Frames from other addresses,
+        eg. late replies to an earlier request, are skipped.
+        """
+        while True:
+            frame = self.next_match(prefix)
+            if frame is not None:
+                return frame
+            remaining = (deadline_ns - time.monotonic_ns()) * 1e-9
+            if remaining <= 0 or not self.fill(ser, remaining):
+                return None
+
+
+_parsers = weakref.WeakKeyDictionary()
+
+
+def frame_parser(ser):
+    """the FrameParser reading from port ser"""
+    parser = _parsers.get(ser)
+    if parser is None:
+        parser = _parsers[ser] = FrameParser()
+    return parser
+
+
+def exchange(frame, optlist, ser, timeout, trace=None, retry=0):
+    """one request/reply attempt without retries, returns (reply, dt)
+
+    reply is a memoryview into the port's FrameParser, None on timeout or
+    a bad echo. With optlist.loopback the echo of frame is dropped inline
+    and a mismatch fails at once. The reply deadline runs from the end of
+    transmit and the port timeout is left alone. trace (a
+    mksTrace.PhaseTrace) gets the monotonic ns timestamps of each phase.
+    """
+    parser = frame_parser(ser)
+    t0_ns = time.monotonic_ns()
+    if not optlist.noreset:
+        ser.reset_input_buffer()
+        ser.reset_output_buffer()
+        parser.clear()
+    parser.echo = frame if optlist.loopback else None
+    parser.first_ns = 0
+    if parser.tap is not None:
+        parser.tap(True, frame)
+    start_ns = time.monotonic_ns()
+    ser.write(frame)
+    write_ns = time.monotonic_ns()
+    if optlist.noflush:  # not drained: 10 bits per byte on the wire
+        flush_ns = write_ns
+        baudrate = getattr(ser, "baudrate", None)
+        tx_ns = start_ns + (len(frame) * 10_000_000_000 // baudrate if baudrate else 0)
+    else:
+        ser.flush()
+        tx_ns = flush_ns = time.monotonic_ns()
+    echo_error = False
+    try:
+        resp = parser.read_frame(ser, tx_ns + int(timeout * 1e9), frame[:4])
+    except EchoError as exc:
+        logging.warning("%s", exc)
+        resp = None
+        echo_error = True
+    end_ns = time.monotonic_ns()
+    if trace is not None:
+        stamps = (t0_ns, start_ns, write_ns, flush_ns, parser.first_ns, end_ns)
+        trace.record(frame, resp, retry, stamps, echo_error)
+    return resp, (end_ns - start_ns) * 1e-9
+
+
+def transact(frame, optlist, ser, label=None, adaptive=None, key=None, trace=None):
+    """send request frame and return a Transaction with the ACK payload
+
+    With adaptive (a mksTimeout.AdaptiveTimeout) the read deadline of each
+    attempt comes from the latency learned for `key`. trace (a
+    mksTrace.PhaseTrace) records the phase timing of every attempt.
+    Through the gauge server (--server) the whole transaction runs there,
+    where queries are cached and coalesced, unless adaptive or trace need
+    the single attempts.
+    """
+    remote = getattr(ser, "transact", None)
+    if remote is not None and adaptive is None and trace is None:
+        return remote(frame, label)
+    timeout = float(optlist.timeout)
+    dt0 = 0.0
+    dt = 0.0
+    retries = 0
+    errcnt = 0
+    result = None
+    label = frame if label is None else label
+    debug = logging.root.isEnabledFor(logging.DEBUG)
+    if debug:
+        logging.debug("request=%s", frame)
+
+    while retries < MAX_RETRIES:
+        if adaptive is not None:
+            timeout = adaptive.timeout(key)
+        resp, dt = exchange(frame, optlist, ser, timeout, trace, retries)
+
+        # check the reply is valid
+        reply = None if resp is None else parse_reply(resp)
+        if reply is not None and reply.ack:
+            if adaptive is not None:
+                adaptive.observe(key, dt)
+            dt = dt0 + dt
+            result = reply.payload
+            if debug:
+                logging.debug("resp=%s dt=%.3f", bytes(resp), dt)
+            break
+        elif retries < MAX_RETRIES and resp is None:  # timed out, retry
+            if debug:
+                logging.debug("no reply dt=%.3f", dt)
+            if adaptive is not None:
+                adaptive.expired(key, dt)
+            dt0 = dt
+            retries += 1
+        else:
+            dt = dt0 + dt
+            logging.warning(
+                "failed at trial %d: request=%s  resp=%s, dt=%.3f",
+                retries,
+                label,
+                bytes(resp),
+                dt,
+            )
+            errcnt += 1
+            break
+    return Transaction(result, dt, retries, errcnt)
+
+
+def query_and_response(query, optlist, ser):
+    """send query and return response"""
+    return transact(encode_query(optlist.id, query), optlist, ser, query)
+
+
+def cmd_and_response(cmd, optlist, ser):
+    """send command and return response"""
+    return transact(encode_cmd(optlist.id, cmd), optlist, ser, cmd)
+
+
+def query_gauge(gid, query, optlist, ser):
+    """query_and_response() for gauge gid of a bus instead of optlist.id"""
+    return transact(encode_query(gid, query), optlist, ser, f"{gid:03d}:{query}")
+
+
+def cmd_gauge(gid, cmd, optlist, ser):
+    """cmd_and_response() for gauge gid of a bus instead of optlist.id"""
+    return transact(encode_cmd(gid, cmd), optlist, ser, f"{gid:03d}:{cmd}")
+
+
+def reopen_port(ser, baudrate):
+    """close ser and open it again at baudrate (the FrameParser is kept)"""
+    ser.close()
+    ser.baudrate = baudrate
+    ser.open()
+    frame_parser(ser).clear()
+
+
+def open_port(optlist):
+    """open optlist.port, or reach it through the gauge server (--server)"""
+    if getattr(optlist, "server", None):
+        import mksServer
+
+        optlist.loopback = False  # the server handles the RS485 echo
+        return mksServer.RemotePort(optlist.server, optlist.port, float(optlist.timeout))
+    ser = serial.Serial()
+    ser.port = optlist.port
+    ser.baudrate = optlist.baudrate
+    ser.timeout = float(optlist.timeout)
+    ser.open()
+    return ser
+
+
+def add_port_arguments(parser):
+    """argparse options of the port and transport used by open_port() and transact()"""
+    parser.add_argument(
+        "--port",
+        nargs="?",
+        default="/dev/ttyS0",
+        const="/dev/ttyS0",
+        help="serial port to open",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
+    )
+    parser.add_argument(
+        "--timeout",
+        nargs="?",
+        type=float,
+        default=0.1,
+        const=0.1,
+        help="timeout for read()",
+    )
+    parser.add_argument(
+        "--server",
+        nargs="?",
+        const="/tmp/mks974.sock",
+        help="use the mksServer.py listening on this socket instead of --port",
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="connection is RS485 half duplex"
+    )
+    parser.add_argument(
+        "--noflush", action="store_true", help="no flush after write() call"
+    )
+    parser.add_argument(
+        "--noreset", action="store_true", help="no reset after write() call"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Poll MKS 974B gauges on many serial ports concurrently with asyncio
+
+Each RS485 bus has at most one transaction in flight while all buses run
+concurrently in one event loop; samples are merged into a single
+timestamped stream.
+"""
+import os
+import sys
+import serial
+import argparse
+import textwrap
+import time
+import logging
+import asyncio
+
+import mks974
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Poll gauges on several RS485 buses at once and print a merged
+           timestamped sample stream
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksAsync.py --bus /dev/ttyS0:1,2,3 /dev/ttyS1:4,5
+                               """
+        ),
+    )
+    parser.add_argument(
+        "--bus",
+        nargs="+",
+        required=True,
+        metavar="PORT:ID[,ID...]",
+        help="serial port and the RS485 ids:{1..253} polled on it",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
+    )
+    parser.add_argument(
+        "--query",
+        nargs="?",
+        default="PR4",
+        const="PR4",
+        help="query to poll (default PR4)",
+    )
+    parser.add_argument(
+        "--count",
+        nargs="?",
+        type=int,
+        default=1,
+        help="number of polling cycles",
+    )
+    parser.add_argument(
+        "--delay",
+        nargs="?",
+        type=float,
+        default=1.0,
+        const=1.0,
+        help="delay between polling cycles",
+    )
+    parser.add_argument(
+        "--timeout",
+        nargs="?",
+        type=float,
+        default=0.1,
+        const=0.1,
+        help="timeout for each reply",
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="connection is RS485 half duplex"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="print only the summary"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+class AsyncGaugeBus:
+    """one RS485 bus driven from the asyncio event loop"""
+
+    def __init__(self, port, baudrate=9600, timeout=0.1, loopback=False):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.loopback = loopback
+        self.max_retries = mks974.MAX_RETRIES
+        self.ser = None
+        self.lock = asyncio.Lock()
+        self.parser = mks974.FrameParser()
+        self.waiter = None
+        self.reads = 0
+        self.retries = 0
+        self.errors = 0
+
+    def open(self):
+        """open the port non-blocking and register it with the event loop"""
+        self.ser = serial.Serial(self.port, self.baudrate, timeout=0)
+        asyncio.get_running_loop().add_reader(self.ser.fileno(), self._on_readable)
+
+    def close(self):
+        if self.ser is not None:
+            asyncio.get_running_loop().remove_reader(self.ser.fileno())
+            self.ser.close()
+            self.ser = None
+
+    def _on_readable(self):
+        """read incoming bytes into the parser and wake the waiter"""
+        try:
+            size = os.readv(self.ser.fileno(), (self.parser.space(),))
+        except BlockingIOError:
+            return
+        self.parser.commit(size)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def _reply(self, frame):
+        """reply frame from the address of `frame`, its echo dropped
+
+        Raises mks974.EchoError when the loopback echo does not match.
+        """
+        while True:
+            resp = self.parser.next_match(frame[:4])
+            if resp is not None:
+                return bytes(resp)
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+    async def transact(self, frame, label=None):
+        """send request frame and return a mks974.Transaction"""
+        async with self.lock:
+            dt0 = 0.0
+            dt = 0.0
+            retries = 0
+            errcnt = 0
+            result = None
+            while retries < self.max_retries:
+                self.ser.reset_input_buffer()
+                self.parser.clear()
+                self.parser.echo = frame if self.loopback else None
+                start_ns = time.monotonic_ns()
+                self.ser.write(frame)
+                try:
+                    resp = await asyncio.wait_for(self._reply(frame), self.timeout)
+                except asyncio.TimeoutError:
+                    resp = None
+                except mks974.EchoError as exc:  # collision: retry without waiting
+                    logging.warning("%s: %s", self.port, exc)
+                    resp = None
+                if resp is None:
+                    dt0 += (time.monotonic_ns() - start_ns) * 1e-9
+                    retries += 1
+                    continue
+                dt = dt0 + (time.monotonic_ns() - start_ns) * 1e-9
+                reply = mks974.parse_reply(resp)
+                if reply is not None and reply.ack:
+                    result = reply.payload
+                else:
+                    logging.warning(
+                        "failed at trial %d: %s request=%s  resp=%s, dt=%.3f",
+                        retries,
+                        self.port,
+                        frame if label is None else label,
+                        resp,
+                        dt,
+                    )
+                    errcnt += 1
+                break
+            else:
+                dt = dt0
+            self.reads += result is not None
+            self.retries += retries
+            self.errors += errcnt
+            return mks974.Transaction(result, dt, retries, errcnt)
+
+    async def query(self, gid, query):
+        return await self.transact(mks974.encode_query(gid, query), query)
+
+    async def poll(self, ids, query, count, delay, samples):
+        """poll `query` of every id `count` times, putting Samples on a queue"""
+        for nn in range(count):
+            t0 = time.monotonic()
+            for gid in ids:
+                res, dt, retries, errcnt = await self.query(gid, query)
+                value = mks974.parse_value(res)
+                await samples.put(
+                    mks974.Sample(time.time(), self.port, gid, value, dt, retries)
+                )
+            elapsed = time.monotonic() - t0
+            if nn < count - 1 and delay > elapsed:
+                await asyncio.sleep(delay - elapsed)
+
+
+async def poll_buses(buses, query, count, delay, consumer):
+    """run one poll task per bus and feed the merged stream to consumer()"""
+    samples = asyncio.Queue()
+
+    async def run_all():
+        try:
+            await asyncio.gather(
+                *(bus.poll(ids, query, count, delay, samples) for bus, ids in buses)
+            )
+        finally:
+            await samples.put(None)
+
+    for bus, ids in buses:
+        bus.open()
+    try:
+        runner = asyncio.create_task(run_all())
+        while (sample := await samples.get()) is not None:
+            consumer(sample)
+        await runner
+    finally:
+        for bus, ids in buses:
+            bus.close()
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    buses = []
+    for spec in optlist.bus:
+        port, ids = mks974.parse_bus(spec)
+        bus = AsyncGaugeBus(port, optlist.baudrate, optlist.timeout, optlist.loopback)
+        buses.append((bus, ids))
+
+    def consumer(sample):
+        if not optlist.quiet:
+            print(mks974.format_sample(sample))
+
+    t0 = time.monotonic()
+    asyncio.run(poll_buses(buses, optlist.query, optlist.count, optlist.delay, consumer))
+    elapsed = time.monotonic() - t0
+
+    print("===================================================================")
+    total = 0
+    for bus, ids in buses:
+        total += bus.reads
+        print(
+            f"{bus.port} ids {ids}: reads: {bus.reads} retries: {bus.retries}"
+            f" errors: {bus.errors} rate: {(bus.reads / elapsed):>.1f} reads/sec"
+        )
+    print(f"aggregate: {total} reads in {elapsed:.3f}s {(total / elapsed):>.1f} reads/sec")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
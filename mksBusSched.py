@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+"""
+Multi-rate, priority-aware scheduler for one shared RS485 bus
+
+A table of (address, command, period, priority) entries is run on one
+port, each entry on its own fixed cadence (see mksCadence). Whenever the
+bus is free the most urgent due entry (lowest priority number, then
+earliest due) goes next, so transactions are packed back to back. A
+transaction cannot be interrupted once on the wire, so a less urgent
+entry is only started if its expected duration (a running average of its
+own transactions) ends before the next more urgent entry falls due;
+otherwise a shorter due entry may fill the gap or the bus waits for the
+urgent one. Such a gap filler gets a single attempt whose read deadline
+ends when the urgent entry falls due, so a dead gauge cannot hold the
+bus through its retries; it is tried again at its next slot. Slots missed
+by a whole period are skipped. Bus utilization and per-entry achieved
+rates, lateness and misses are reported.
+
+table file, one entry per line ("#" starts a comment), priority 0 most urgent:
+    # id command period priority
+    1  PR4   0.2   0
+    2  PR4   1.0   1
+    2  SS1   30    5
+"""
+import sys
+import argparse
+import textwrap
+import time
+import logging
+
+import mks974
+import mksCadence
+import mksStats
+
+EST_WEIGHT = 0.2  # weight of the latest transaction in the duration estimate
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Poll a bus from a table of (id, command, period, priority)
+           entries; urgent reads preempt less urgent ones between
+           transactions
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksBusSched.py --port /dev/ttyUSB0 --entry 1:PR4:0.2:0 \\
+                        --entry 2:PR4:1:1 --entry 2:TEM:30:5 --duration 60
+                               """
+        ),
+    )
+    parser.add_argument(
+        "--port",
+        nargs="?",
+        default="/dev/ttyS0",
+        const="/dev/ttyS0",
+        help="serial port to open",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
+    )
+    parser.add_argument(
+        "--table",
+        nargs="?",
+        help="file of 'id command period priority' lines",
+    )
+    parser.add_argument(
+        "--entry",
+        action="append",
+        default=[],
+        help="ID:COMMAND:PERIOD[:PRIORITY] schedule entry, repeatable",
+    )
+    parser.add_argument(
+        "--duration",
+        nargs="?",
+        type=float,
+        default=10.0,
+        const=10.0,
+        help="seconds to run [10]",
+    )
+    parser.add_argument(
+        "--timeout",
+        nargs="?",
+        type=float,
+        default=0.1,
+        const=0.1,
+        help="timeout for response",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="print only the summary"
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="connection is RS485 half duplex"
+    )
+    parser.add_argument(
+        "--noflush", action="store_true", help="no flush after write() call"
+    )
+    parser.add_argument(
+        "--noreset", action="store_true", help="no reset after write() call"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+class ScheduleEntry:
+    """one (id, command, period, priority) row and its statistics"""
+
+    def __init__(self, gid, command, period, priority=0, baudrate=9600):
+        self.gid = int(gid)
+        self.command = command
+        self.period = float(period)
+        self.priority = int(priority)
+        if not self.period > 0:
+            raise ValueError(f"{self.gid:03d}:{command} period {period} is not > 0")
+        if "!" in command:
+            self.frame = mks974.encode_cmd(self.gid, command)
+        else:
+            self.frame = mks974.encode_query(self.gid, command)
+        self.label = f"{self.gid:03d}:{command}"
+        self.cadence = None
+        self.slot = 0
+        self.due = 0.0
+        # until measured: request and a ~20 byte reply on the wire, 10 ms turnaround
+        self.estimate = (len(self.frame) + 20) * 10.0 / baudrate + 0.010
+        self.reads = 0
+        self.errors = 0
+        self.retries = 0
+        self.busy = 0.0
+        self.late = mksStats.RunningStats()  # s from due to start
+        self.result = None
+
+    def start(self, t0):
+        self.cadence = mksCadence.Cadence(self.period, t0)
+        self.slot = 0
+        self.due = t0
+
+    def skip_missed(self, now):
+        """skip slots whose whole period has passed"""
+        while now - self.due >= self.period:
+            self.cadence.missed += 1
+            self.slot += 1
+            self.due = self.cadence.due(self.slot)
+
+    def done(self, started, txn):
+        """account one transaction started at monotonic time `started`"""
+        self.late.add(started - self.due)
+        self.busy += txn.dt
+        self.retries += txn.retries
+        if txn.result is None:
+            self.errors += 1
+        else:
+            self.reads += 1
+        if not txn.retries:  # a timed out attempt says nothing about the gauge
+            self.estimate += EST_WEIGHT * (txn.dt - self.estimate)
+        self.result = txn.result
+        self.slot += 1
+        self.due = self.cadence.due(self.slot)
+
+    def report(self, elapsed):
+        p50, high = 0.0, 0.0
+        if self.late.count:
+            p50, high = self.late.median() * 1e3, self.late.max * 1e3
+        return (
+            f"{self.label:<10s} period {self.period:>7.3f} prio {self.priority}:"
+            f" target {1 / self.period:>6.2f} Hz achieved {self.reads / elapsed:>6.2f} Hz"
+            f" reads {self.reads} errors {self.errors} retries {self.retries}"
+            f" missed {self.cadence.missed} bus {self.busy / elapsed * 100:.1f}%"
+            f" late p50 {p50:.1f} max {high:.1f} ms"
+        )
+
+
+def parse_entry(spec, baudrate=9600):
+    """ScheduleEntry of ID:COMMAND:PERIOD[:PRIORITY]"""
+    fields = spec.split(":")
+    if len(fields) not in (3, 4):
+        raise ValueError(f"entry {spec} is not ID:COMMAND:PERIOD[:PRIORITY]")
+    return ScheduleEntry(*fields, baudrate=baudrate)
+
+
+def load_table(path, baudrate=9600):
+    """ScheduleEntries of a table file"""
+    entries = []
+    with open(path) as fh:
+        for line in fh:
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) not in (3, 4):
+                raise ValueError(f"{path}: bad entry '{line.strip()}'")
+            try:
+                entries.append(ScheduleEntry(*fields, baudrate=baudrate))
+            except ValueError as exc:
+                raise ValueError(f"{path}: {exc}") from None
+    return entries
+
+
+class BusScheduler:
+    """runs ScheduleEntries on one open port"""
+
+    def __init__(self, entries, optlist, ser):
+        self.entries = entries
+        self.optlist = optlist
+        self.ser = ser
+        self.busy = 0.0
+        self.elapsed = 0.0
+
+    def pick(self, now):
+        """(entry to run now, due time of the next more urgent entry or None)
+
+        The entry is None to wait; lower priority must fit before urgent.
+        """
+        due = sorted(
+            (entry for entry in self.entries if entry.due <= now),
+            key=lambda entry: (entry.priority, entry.due),
+        )
+        for entry in due:
+            urgent = [
+                other.due
+                for other in self.entries
+                if other.priority < entry.priority and other.due > now
+            ]
+            if not urgent:
+                return entry, None
+            if now + entry.estimate <= min(urgent):
+                return entry, min(urgent)
+        return None, None
+
+    def fill(self, entry, until):
+        """single attempt of a gap filler whose reply must be in by `until`"""
+        wire = len(entry.frame) * 10.0 / self.optlist.baudrate
+        timeout = min(float(self.optlist.timeout), until - time.monotonic() - wire)
+        timeout = max(timeout, 0.0)
+        resp, dt = mks974.exchange(entry.frame, self.optlist, self.ser, timeout)
+        reply = None if resp is None else mks974.parse_reply(resp)
+        if reply is not None and reply.ack:
+            return mks974.Transaction(reply.payload, dt, 0, 0)
+        if resp is None:  # timed out: counted as a retry like transact() does
+            return mks974.Transaction(None, dt, 1, 0)
+        logging.warning("failed: request=%s resp=%s", entry.label, bytes(resp))
+        return mks974.Transaction(None, dt, 0, 1)
+
+    def run(self, duration, consumer=None):
+        """schedule for `duration` seconds, consumer(entry, Transaction) per read"""
+        t0 = time.monotonic()
+        for entry in self.entries:
+            entry.start(t0)
+        end = t0 + duration
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            for entry in self.entries:
+                entry.skip_missed(now)
+            entry, until = self.pick(now)
+            if entry is None:
+                wake = min(e.due for e in self.entries if e.due > now)
+                time.sleep(max(0.0, min(wake, end) - now))
+                continue
+            if until is None:
+                txn = mks974.transact(entry.frame, self.optlist, self.ser, entry.label)
+            else:
+                txn = self.fill(entry, until)
+            self.busy += time.monotonic() - now
+            entry.done(now, txn)
+            if consumer is not None:
+                consumer(entry, txn)
+        self.elapsed = time.monotonic() - t0
+
+    def report(self):
+        lines = [
+            f"bus utilization: {self.busy / self.elapsed * 100:.1f}%"
+            f" ({self.busy:.3f}s busy of {self.elapsed:.3f}s)"
+        ]
+        for entry in sorted(self.entries, key=lambda entry: (entry.priority, entry.gid)):
+            lines.append(entry.report(self.elapsed))
+        return lines
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    entries = []
+    try:
+        if optlist.table:
+            entries.extend(load_table(optlist.table, optlist.baudrate))
+        entries.extend(parse_entry(spec, optlist.baudrate) for spec in optlist.entry)
+    except (OSError, ValueError) as exc:
+        logging.error(f"schedule: {exc}")
+        sys.exit(1)
+    if not entries:
+        logging.error("no schedule entries, use --table or --entry")
+        sys.exit(1)
+    ser = mks974.open_port(optlist)
+
+    def consumer(entry, txn):
+        if not optlist.quiet:
+            print(
+                f"{time.time():.6f} {optlist.port}:{entry.label} {txn.result}"
+                f" dt={txn.dt:.4f} rt={txn.retries}"
+            )
+
+    sched = BusScheduler(entries, optlist, ser)
+    try:
+        sched.run(optlist.duration, consumer)
+    finally:
+        ser.close()
+    print("===================================================================")
+    for line in sched.report():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
@@ -0,0 +1,119 @@
+"""
+Freshness-window cache and request coalescing for MKS 974B queries
+
+Results are kept for a per-query freshness window: live readings for a
+few hundred ms, identity strings for a minute so that a gauge swapped at
+an address is noticed. Concurrent requests for the same key share one bus
+transaction.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+IDENTITY_FRESHNESS = 60.0  # SN, model, firmware: change only with the gauge
+# seconds a reply stays fresh, by query name
+FRESHNESS = {
+    "PR1": 0.2,
+    "PR2": 0.2,
+    "PR3": 0.2,
+    "PR4": 0.2,
+    "PR5": 0.2,
+    "T": 0.2,
+    "SS1": 0.2,
+    "SS2": 0.2,
+    "SS3": 0.2,
+    "TEM": 1.0,
+    "SN": IDENTITY_FRESHNESS,
+    "PN": IDENTITY_FRESHNESS,
+    "MD": IDENTITY_FRESHNESS,
+    "DT": IDENTITY_FRESHNESS,
+    "FV": IDENTITY_FRESHNESS,
+    "HV": IDENTITY_FRESHNESS,
+}
+
+
+def query_name(frame):
+    """query name of a @xxxNAME?;FF request frame, None for commands"""
+    if frame[-4:] != b"?;FF" or len(frame) < 9:
+        return None
+    return frame[4:-4].decode("ascii", "replace")
+
+
+def command_name(frame):
+    """setting name of a @xxxNAME!ARG;FF command frame, None for queries"""
+    name, sep, arg = frame[4:-3].partition(b"!")
+    if not sep:
+        return None
+    return name.decode("ascii", "replace")
+
+
+class QueryCache:
+    """thread safe cache of query results with coalescing of misses"""
+
+    def __init__(self, freshness=None, default=0.0):
+        self.freshness = FRESHNESS if freshness is None else freshness
+        self.default = default
+        self.lock = threading.Lock()
+        self.entries = dict()  # key -> (monotonic time, value)
+        self.inflight = dict()  # key -> Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def ttl(self, query):
+        return self.freshness.get(query, self.default)
+
+    def get(self, key, ttl, fetch, keep=None):
+        """cached value of key if younger than ttl, else fetch() it once
+
+        Callers asking for a key that is already being fetched wait for
+        that fetch instead of starting another. keep(value) decides if a
+        fetched value may be cached (eg. not a timeout).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= ttl:
+                self.hits += 1
+                return entry[1]
+            future = self.inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self.inflight[key] = future
+                self.misses += 1
+                leader = True
+        if not leader:
+            return future.result()
+        try:
+            value = fetch()
+        except BaseException as exc:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(exc)
+            raise
+        with self.lock:
+            del self.inflight[key]
+            if ttl > 0 and (keep is None or keep(value)):
+                self.entries[key] = (time.monotonic(), value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, match=None):
+        """drop entries whose key satisfies match(key), all if None"""
+        with self.lock:
+            if match is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if match(key)]:
+                del self.entries[key]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "entries": len(self.entries),
+            }
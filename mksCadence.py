@@ -0,0 +1,85 @@
+"""
+Fixed-cadence sampling on the monotonic clock
+
+Slot k of a Cadence is due at the absolute time start + k * period, so
+time spent reading does not push later samples back and the rate does
+not depend on the number of gauges in a cycle. A slot still unstarted a
+whole period after it was due is skipped (counted as missed) rather
+than run late, so an overrun never turns into a burst of catch-up reads.
+CadenceStats records per gauge when each sample really started relative
+to its slot and reports the achieved period, jitter and missed deadlines,
+in constant memory per gauge.
+"""
+import time
+
+import mksStats
+
+
+class Cadence:
+    """absolute deadlines every `period` seconds"""
+
+    def __init__(self, period, start=None):
+        self.period = max(float(period), 0.0)
+        self.start = time.monotonic() if start is None else start
+        self.missed = 0
+
+    def due(self, slot):
+        return self.start + slot * self.period
+
+    def slots(self, count):
+        """yield (slot, due time) of `count` slots, sleeping until each is due
+
+        Slots whose period has entirely passed are skipped and counted in
+        `missed`. A zero period runs the slots back to back.
+        """
+        for slot in range(count):
+            due = self.due(slot)
+            now = time.monotonic()
+            if self.period and now - due >= self.period:
+                self.missed += 1
+                continue
+            if due > now:
+                time.sleep(due - now)
+            yield slot, due
+
+
+class CadenceStats:
+    """per gauge lateness of samples against their slots"""
+
+    def __init__(self, period):
+        self.period = period
+        self.starts = dict()  # key: [first start, last start]
+        self.late = dict()  # key: mksStats.RunningStats of lateness
+        self.missed = dict()
+
+    def record(self, key, due, now=None):
+        """a sample of `key` scheduled at due started at now"""
+        now = time.monotonic() if now is None else now
+        self.starts.setdefault(key, [now, now])[1] = now
+        if key not in self.late:
+            self.late[key] = mksStats.RunningStats()
+        self.late[key].add(now - due)
+
+    def miss(self, key, count=1):
+        self.missed[key] = self.missed.get(key, 0) + count
+
+    def report(self, key):
+        """one line: achieved period, offset in the cycle, jitter and misses
+
+        The offset is the median lateness (gauges later in a cycle start
+        later), jitter the std and largest deviation of lateness from it.
+        """
+        late = self.late.get(key, mksStats.RunningStats())
+        missed = self.missed.get(key, 0)
+        if late.count < 2:
+            return f"cadence: {late.count} samples, missed: {missed}"
+        first, last = self.starts[key]
+        period = (last - first) / (late.count - 1)
+        line = f"cadence: period {self.period:.4f} achieved {period:.4f} s"
+        if self.period:
+            offset = late.median()
+            line += (
+                f" offset {offset * 1e3:.3f} ms jitter {late.std() * 1e3:.3f} ms"
+                f" (max {max(late.max - offset, offset - late.min) * 1e3:.3f} ms)"
+            )
+        return f"{line} missed: {missed}/{late.count + missed}"
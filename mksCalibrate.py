@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Calibrate the receive/send delay (RSD) and read timeout of MKS 974B gauges
+
+For every gauge on a bus and for RSD OFF and ON, single-attempt PR4
+transactions are timed across a sweep of read timeouts. The setting with
+the highest throughput whose error rate stays under --maxerror is
+recommended (and applied with --apply); the latency percentiles of all
+settings are printed and optionally written to a report file.
+"""
+import sys
+import argparse
+import textwrap
+import time
+import logging
+import numpy as np
+
+import mks974
+import mksMeta
+
+RSD_SETTINGS = ("OFF", "ON")
+PERCENTILES = (50, 90, 99)
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Measure latency and error rate of every gauge with RSD OFF/ON
+           across a sweep of read timeouts and pick the fastest reliable
+           setting
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksCalibrate.py --port /dev/ttyUSB0 --ids 1 2 3 --apply
+                               """
+        ),
+    )
+    mks974.add_port_arguments(parser)
+    parser.add_argument(
+        "--ids",
+        nargs="+",
+        type=int,
+        required=True,
+        help="RS485 ids:{1..253}",
+    )
+    parser.add_argument(
+        "--timeouts",
+        nargs="+",
+        type=float,
+        default=[0.02, 0.04, 0.06, 0.1, 0.2],
+        help="read timeouts (s) to sweep [0.02 0.04 0.06 0.1 0.2]",
+    )
+    parser.add_argument(
+        "--count",
+        nargs="?",
+        type=int,
+        default=100,
+        help="transactions per gauge and setting [100]",
+    )
+    parser.add_argument(
+        "--maxerror",
+        nargs="?",
+        type=float,
+        default=0.01,
+        const=0.01,
+        help="highest error rate a setting may have to be chosen [0.01]",
+    )
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="leave each gauge at its best RSD (else the original is restored)",
+    )
+    parser.add_argument(
+        "--report",
+        nargs="?",
+        help="also write the report to this file",
+    )
+    parser.add_argument(
+        "--nocache",
+        action="store_true",
+        help="leave the gauge metadata cache alone",
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+def set_rsd(gid, rsd, optlist, ser, cache=None):
+    """unlock, set RSD and lock gauge gid, True if the gauge took it"""
+    mks974.cmd_gauge(gid, "FD!UNLOCK", optlist, ser)
+    res = mks974.cmd_gauge(gid, f"RSD!{rsd}", optlist, ser)
+    mks974.cmd_gauge(gid, "FD!LOCK", optlist, ser)
+    if cache is not None:
+        cache.invalidate(optlist.port, gid, ["RSD"])
+    return res.result == rsd
+
+
+def measure(gid, timeout, count, optlist, ser):
+    """time `count` single-attempt PR4 transactions, returns a result dict"""
+    frame = mks974.encode_query(gid, "PR4")
+    dts = []
+    errors = 0
+    t0 = time.monotonic()
+    for _ in range(count):
+        resp, dt = mks974.exchange(frame, optlist, ser, timeout)
+        if resp is not None and mks974.frame_ack(resp):
+            dts.append(dt)
+        else:
+            # a late reply would pass for the next one: let the line go
+            # quiet first, the time lost counts against this setting
+            errors += 1
+            time.sleep(optlist.timeout)
+            ser.reset_input_buffer()
+    elapsed = time.monotonic() - t0
+    return {
+        "timeout": timeout,
+        "dt": np.array(dts),
+        "errors": errors,
+        "error_rate": errors / count,
+        "rate": len(dts) / elapsed,
+    }
+
+
+def format_result(rsd, res):
+    """one report line of a measured setting"""
+    dt = res["dt"]
+    if len(dt):
+        pct = " ".join(f"{val * 1e3:>7.2f}" for val in np.percentile(dt, PERCENTILES))
+        pct += f" {np.max(dt) * 1e3:>7.2f}"
+    else:
+        pct = " ".join(f"{'-':>7s}" for _ in range(len(PERCENTILES) + 1))
+    return (
+        f"  RSD {rsd:<3s} timeout {res['timeout']:>6.3f} {pct}"
+        f" {res['error_rate']:>7.3f} {res['rate']:>8.1f}"
+    )
+
+
+def calibrate(gid, optlist, ser, out, cache=None):
+    """sweep RSD and timeouts of gauge gid, returns the best (rsd, result)"""
+    sn = mks974.query_gauge(gid, "SN", optlist, ser).result
+    original = current = mks974.query_gauge(gid, "RSD", optlist, ser).result
+    if sn is None or current not in RSD_SETTINGS:
+        logging.error(f"gauge {gid:03d} does not answer, skipped")
+        return None
+    header = " ".join(f"{f'p{pct}':>7s}" for pct in PERCENTILES)
+    out(f"gauge {optlist.port}:{gid:03d} SN:{sn} RSD:{current}")
+    out(f"  {'setting (ms)':<22s} {header} {'max':>7s} {'err':>7s} {'reads/s':>8s}")
+    best = None
+    for rsd in RSD_SETTINGS:
+        if rsd != current and not set_rsd(gid, rsd, optlist, ser, cache):
+            logging.error(f"gauge {gid:03d} did not accept RSD!{rsd}")
+            continue
+        for timeout in optlist.timeouts:
+            res = measure(gid, timeout, optlist.count, optlist, ser)
+            out(format_result(rsd, res))
+            if res["error_rate"] <= optlist.maxerror and (
+                best is None or res["rate"] > best[1]["rate"]
+            ):
+                best = (rsd, res)
+        current = rsd
+    if best is None:
+        out("  no setting met --maxerror")
+    else:
+        out(
+            f"  best: RSD {best[0]} --timeout {best[1]['timeout']:g}"
+            f" {best[1]['rate']:.1f} reads/s"
+        )
+    # leave the gauge at the best RSD with --apply, else as it was
+    final = best[0] if best is not None and optlist.apply else original
+    if final != current and not set_rsd(gid, final, optlist, ser, cache):
+        logging.error(f"gauge {gid:03d} could not be set to RSD {final}")
+    else:
+        out(f"  RSD left {final}")
+    return best
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    if optlist.server:
+        logging.warning("--server: reads use the server's --timeout, not the swept ones")
+    ser = mks974.open_port(optlist)
+    cache = None if optlist.nocache else mksMeta.MetadataCache()
+    lines = []
+
+    def out(line):
+        print(line)
+        lines.append(line)
+
+    out(f"# RSD calibration {optlist.port} {optlist.baudrate} baud")
+    for gid in optlist.ids:
+        calibrate(gid, optlist, ser, out, cache)
+    ser.close()
+    if cache is not None:
+        cache.close()
+    if optlist.report:
+        with open(optlist.report, "w") as fh:
+            fh.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
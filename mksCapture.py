@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+"""
+Raw serial traffic capture of the gauge tools and timed replay
+
+A Capture taps the mks974.FrameParser of each port and appends every
+frame written and every chunk read, with its monotonic ns timestamp and
+port, to a compact binary file. Replay feeds a capture back through a
+FrameParser, rebuilds the transactions (retries, timeouts, NAKs) as
+mks974.Samples and reports readAllPressure-style statistics, either at
+the original pace or as fast as possible, without any hardware.
+"""
+import sys
+import struct
+import argparse
+import textwrap
+import time
+import logging
+
+import mks974
+import mksCache
+import mksStats
+
+MAGIC = b"MKSCAP01"
+RECORD = struct.Struct("<qBBH")  # monotonic ns, kind, port index, data length
+SESSION = struct.Struct("<dqB")  # wall time, monotonic ns, flags
+LOOPBACK = 0x01
+
+# record kinds
+READ = 0  # bytes received
+WRITE = 1  # frame sent
+PORT = 2  # data is the name of port index
+START = 3  # new session (run of a tool), data is SESSION
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Replay serial traffic captured with
+           readPressure.py/readAllPressure.py --capture FILE
+           through the frame parser and report gauge statistics
+                                    """
+        ),
+    )
+    parser.add_argument("files", nargs="+", help="capture files, replayed in order")
+    parser.add_argument(
+        "--speed",
+        nargs="?",
+        type=float,
+        default=0.0,
+        const=1.0,
+        help="1 replays at the original pace, 2 twice as fast, [0] as fast as possible",
+    )
+    parser.add_argument(
+        "--query",
+        nargs="?",
+        default="PR4",
+        const="PR4",
+        help="query whose transactions are reported (default PR4)",
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="print only the summary"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+class Capture:
+    """append-only binary log of the traffic of one or more ports"""
+
+    def __init__(self, path, loopback=False):
+        self.fh = open(path, "ab")
+        if self.fh.tell() == 0:
+            self.fh.write(MAGIC)
+        self.ports = dict()
+        self.records = 0
+        self.bytes = 0
+        flags = LOOPBACK if loopback else 0
+        now_ns = time.monotonic_ns()
+        self._write(START, 0, SESSION.pack(time.time(), now_ns, flags), now_ns)
+
+    def _write(self, kind, index, data, now_ns):
+        self.fh.write(RECORD.pack(now_ns, kind, index, len(data)))
+        self.fh.write(data)
+        self.records += 1
+        self.bytes += RECORD.size + len(data)
+
+    def tap(self, port):
+        """tap(sent, data) callable for the FrameParser of `port`"""
+        index = self.ports.get(port)
+        if index is None:
+            index = self.ports[port] = len(self.ports)
+            self._write(PORT, index, port.encode(), time.monotonic_ns())
+
+        def record(sent, data):
+            self._write(WRITE if sent else READ, index, data, time.monotonic_ns())
+
+        return record
+
+    def attach(self, ser, port):
+        """capture everything exchanged on serial port ser named `port`"""
+        mks974.frame_parser(ser).tap = self.tap(port)
+
+    def close(self):
+        self.fh.close()
+
+
+def read_records(path):
+    """yield (monotonic ns, kind, port name, data) of a capture file
+
+    START records carry the unpacked SESSION tuple as data.
+    """
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an mks974 capture")
+        ports = dict()
+        while True:
+            head = fh.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break  # end, or a record cut short by a killed writer
+            t_ns, kind, index, size = RECORD.unpack(head)
+            data = fh.read(size)
+            if len(data) < size:
+                break
+            if kind == START:
+                ports.clear()
+                yield t_ns, kind, None, SESSION.unpack(data)
+            elif kind == PORT:
+                ports[index] = data.decode()
+            else:
+                yield t_ns, kind, ports.get(index, f"port{index}"), data
+
+
+class PortReplay:
+    """rebuilds the transactions of one port from its captured bytes"""
+
+    def __init__(self, port, loopback):
+        self.port = port
+        self.loopback = loopback
+        self.parser = mks974.FrameParser()
+        self.request = None
+        self.sent_ns = 0
+        self.retries = 0
+        self.echo_errors = 0
+        self.stray = 0
+
+    def sent(self, t_ns, frame, wall):
+        """request written: (request, Sample) of one left unanswered or None"""
+        sample = None
+        if self.request is not None:
+            if frame == self.request:  # the tool timed out and retried
+                self.retries += 1
+            else:
+                sample = self._sample(t_ns, None, wall)
+        self.request = frame
+        self.sent_ns = t_ns
+        self.parser.clear()
+        self.parser.echo = frame if self.loopback else None
+        return sample
+
+    def received(self, t_ns, data, wall):
+        """bytes read: (request, Sample) of each reply they complete"""
+        samples = []
+        self.parser.feed(data)
+        while True:
+            try:
+                frame = self.parser.next_frame()
+            except mks974.EchoError:
+                self.echo_errors += 1
+                continue
+            if frame is None:
+                return samples
+            if self.request is None or frame[:4] != self.request[:4]:
+                self.stray += 1
+                continue
+            value = mks974.frame_value(frame) if mks974.frame_ack(frame) else None
+            samples.append(self._sample(t_ns, value, wall))
+
+    def finish(self, t_ns, wall):
+        """(request, Sample) of a request still unanswered at the end, or None"""
+        if self.request is None:
+            return None
+        return self._sample(t_ns, None, wall)
+
+    def _sample(self, t_ns, value, wall):
+        request = self.request
+        sample = mks974.Sample(
+            wall(t_ns),
+            self.port,
+            mks974.frame_addr(request),
+            value,
+            (t_ns - self.sent_ns) * 1e-9,
+            self.retries,
+        )
+        self.request = None
+        self.retries = 0
+        return request, sample
+
+
+def replay(paths, consumer, speed=0.0):
+    """feed captures through PortReplays, consumer(request, sample) per reply
+
+    With speed > 0 records are paced to their captured timestamps
+    (divided by speed). Returns the number of records replayed.
+    """
+    count = 0
+    for path in paths:
+        replays = dict()
+        wall0 = mono0 = 0
+        base_ns = None
+        last_ns = 0
+        loopback = False
+
+        def wall(t_ns):
+            return wall0 + (t_ns - mono0) * 1e-9
+
+        for t_ns, kind, port, data in read_records(path):
+            count += 1
+            if kind == START:
+                for rep in replays.values():
+                    res = rep.finish(last_ns, wall)
+                    if res is not None:
+                        consumer(*res)
+                replays.clear()
+                wall0, mono0, flags = data
+                loopback = bool(flags & LOOPBACK)
+                base_ns = None
+                continue
+            last_ns = t_ns
+            if speed > 0:
+                if base_ns is None:
+                    base_ns = t_ns
+                    base = time.monotonic()
+                delay = (t_ns - base_ns) * 1e-9 / speed - (time.monotonic() - base)
+                if delay > 0:
+                    time.sleep(delay)
+            rep = replays.get(port)
+            if rep is None:
+                rep = replays[port] = PortReplay(port, loopback)
+            if kind == WRITE:
+                res = rep.sent(t_ns, data, wall)
+                if res is not None:
+                    consumer(*res)
+            else:
+                for res in rep.received(t_ns, data, wall):
+                    consumer(*res)
+        for rep in replays.values():
+            res = rep.finish(last_ns, wall)
+            if res is not None:
+                consumer(*res)
+    return count
+
+
+class ReplayStats:
+    """per gauge dt/pressure statistics of replayed samples, in constant memory"""
+
+    def __init__(self):
+        self.gauges = dict()
+
+    def add(self, sample):
+        key = (sample.port, sample.gid)
+        gauge = self.gauges.get(key)
+        if gauge is None:
+            gauge = self.gauges[key] = {
+                "dt": mksStats.RunningStats(),
+                "value": mksStats.RunningStats(),
+                "retries": 0,
+                "errors": 0,
+                "first": sample.time,
+                "last": sample.time,
+            }
+        gauge["retries"] += sample.retries
+        gauge["last"] = sample.time
+        if sample.value is None:
+            gauge["errors"] += 1
+        else:
+            gauge["dt"].add(sample.dt)
+            gauge["value"].add(sample.value)
+
+    def report(self):
+        for (port, gid), gauge in sorted(self.gauges.items()):
+            print("===================================")
+            print(f"Gauge ID: {port}:{gid:>03d}")
+            dts = gauge["dt"]
+            if dts.count:
+                print(f"dt stats:  avg: {dts.mean:>.4f}")
+                print(f"           med: {dts.median():>.3f}")
+                print(f"           std: {dts.std():>.4f}")
+                print(f"           min: {dts.min:>.4f}")
+                print(f"           max: {dts.max:>.4f}")
+                print(f"  Pressure avg: {gauge['value'].mean:>.4f}")
+            print(f" nominal count: {dts.count}")
+            print(f"   retry count: {gauge['retries']}")
+            print(f"   error count: {gauge['errors']}")
+            span = gauge["last"] - gauge["first"]
+            if span > 0:
+                print(f" rate: {(dts.count / span):>.1f} reads/sec (captured)")
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    stats = ReplayStats()
+    frames = 0
+
+    def consumer(request, sample):
+        nonlocal frames
+        frames += 1
+        if mksCache.query_name(request) != optlist.query:
+            return
+        stats.add(sample)
+        if not optlist.quiet:
+            print(mks974.format_sample(sample))
+
+    t0 = time.monotonic()
+    c0 = time.process_time()
+    records = replay(optlist.files, consumer, optlist.speed)
+    elapsed = time.monotonic() - t0
+    cpu = time.process_time() - c0
+    stats.report()
+    print("===================================================================")
+    print(
+        f"replayed {records} records, {frames} transactions in {elapsed:.3f}s"
+        f" ({(frames / max(elapsed, 1e-9)):.0f} transactions/sec, cpu {cpu:.3f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of per-transaction CPU cost of the MKS 974B codec
+
+Runs the old inline frame build + regex parse against mks974.transact()
+using an in-memory serial stand-in so only the Python side is measured.
+Also reports transient memory per transaction (tracemalloc peak) and the
+frame splitting throughput of mks974.FrameParser on multi-frame reads.
+"""
+import argparse
+import logging
+import os
+import re
+import textwrap
+import time
+import tracemalloc
+import types
+
+import mks974
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Compare per-transaction CPU cost of legacy and mks974 parsing
+                                    """
+        ),
+    )
+    parser.add_argument(
+        "--count",
+        nargs="?",
+        type=int,
+        default=100000,
+        help="transactions per run",
+    )
+    parser.add_argument(
+        "--repeat",
+        nargs="?",
+        type=int,
+        default=5,
+        help="runs per method (best is reported)",
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="simulate RS485 half duplex echo"
+    )
+    return parser.parse_args()
+
+
+class CannedSerial:
+    """serial stand-in that answers every request with a fixed reply"""
+
+    def __init__(self, reply, loopback=False):
+        self.reply = reply
+        self.loopback = loopback
+        self.timeout = 0.1
+        self.pending = []
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    def write(self, data):
+        if self.loopback:
+            self.pending.append(bytes(data))
+        self.pending.append(self.reply)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def read_until(self, expected=b"\n", size=None):
+        return self.pending.pop(0) if self.pending else b""
+
+
+class PipeSerial(CannedSerial):
+    """stand-in with a pipe fd so mks974 reads straight into its buffer"""
+
+    def __init__(self, reply, loopback=False):
+        super().__init__(reply, loopback)
+        self.fd, self.wfd = os.pipe()
+
+    def reset_input_buffer(self):
+        pass
+
+    def write(self, data):
+        if self.loopback:
+            os.write(self.wfd, data)
+        os.write(self.wfd, self.reply)
+        return len(data)
+
+    def read_until(self, expected=b"\n", size=None):
+        data = bytearray()
+        while not data.endswith(expected):
+            data += os.read(self.fd, 1)
+        return bytes(data)
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.wfd)
+
+
+def legacy_transaction(gid, query, optlist, ser):
+    """request/response as done inline by the tools before mks974"""
+    query_str = f"@{gid:03d}{query}?;FF"
+    query_bts = bytes(query_str, "utf-8")
+    if not optlist.noreset:
+        ser.reset_input_buffer()
+        ser.reset_output_buffer()
+    start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
+    ser.write(query_bts)
+    if not optlist.noflush:
+        ser.flush()
+    resp = ser.read_until(expected=b";FF", size=None)
+    end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
+    dt = (end_ns - start_ns) * 1e-9
+    if optlist.loopback:
+        if re.match(f"@{gid:03d}{query}\\?;FF", resp.decode()):
+            resp = ser.read_until(expected=b";FF", size=None)
+    result = None
+    if re.match(r"@...ACK.*;FF", resp.decode()):
+        result = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
+        logging.debug(f"resp={resp} dt={dt:>.3f}")
+    return result, dt
+
+
+def codec_transaction(gid, query, optlist, ser):
+    """request/response through the shared codec"""
+    return mks974.transact(mks974.encode_query(gid, query), optlist, ser, query)
+
+
+def legacy_parse(gid, query, optlist, resp):
+    """frame build and reply parse only, as done before mks974"""
+    query_bts = bytes(f"@{gid:03d}{query}?;FF", "utf-8")
+    if re.match(r"@...ACK.*;FF", resp.decode()):
+        return re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0], query_bts
+    return None, query_bts
+
+
+def codec_parse(gid, query, optlist, resp):
+    """frame build and reply parse only, through mks974"""
+    query_bts = mks974.encode_query(gid, query)
+    reply = mks974.parse_reply(resp)
+    if reply is not None and reply.ack:
+        return reply.payload, query_bts
+    return None, query_bts
+
+
+def legacy_split(chunk):
+    """frames of one read split and parsed as the tools did before mks974"""
+    buf = bytearray(chunk)
+    values = []
+    while True:
+        end = buf.find(b";FF")
+        if end < 0:
+            break
+        resp = bytes(buf[: end + 3])
+        del buf[: end + 3]
+        match = re.match(r"@...ACK(.*);FF", resp.decode())
+        if match:
+            values.append(float(match.groups()[0]))
+    return values
+
+
+def bytes_split(chunk):
+    """frames split with bytearray slicing and parsed with parse_reply()"""
+    buf = bytearray(chunk)
+    values = []
+    while True:
+        end = buf.find(mks974.TERM)
+        if end < 0:
+            break
+        resp = bytes(buf[: end + 3])
+        del buf[: end + 3]
+        reply = mks974.parse_reply(resp)
+        if reply is not None and reply.ack:
+            values.append(mks974.parse_value(reply.payload))
+    return values
+
+
+PARSER = mks974.FrameParser(8192)
+
+
+def parser_split(chunk):
+    """frames split in place by FrameParser and parsed without str"""
+    space = PARSER.space()
+    space[: len(chunk)] = chunk  # what os.readv() does for a real port
+    PARSER.commit(len(chunk))
+    values = []
+    frame = PARSER.next_frame()
+    while frame is not None:
+        if mks974.frame_ack(frame):
+            values.append(mks974.frame_value(frame))
+        frame = PARSER.next_frame()
+    return values
+
+
+def transient(method, count, *args):
+    """mean tracemalloc peak (bytes) of one call above the memory in use"""
+    total = 0
+    tracemalloc.start()
+    for nn in range(count):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        method(*args)
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total / count
+
+
+def run_frames(method, chunk, nframes, count, repeat):
+    """return best frames/sec splitting `chunk` (nframes replies) count times"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.process_time_ns()
+        for nn in range(count):
+            values = method(chunk)
+        t1 = time.process_time_ns()
+        rate = nframes * count / ((t1 - t0) * 1e-9)
+        best = rate if best is None else max(best, rate)
+    assert len(values) == nframes and values[-1] == 7.53e-6
+    return best
+
+
+def run(method, count, repeat, optlist, target):
+    """return best per-transaction CPU time in ns over `repeat` runs"""
+    best = None
+    for _ in range(repeat):
+        t0 = time.process_time_ns()
+        for nn in range(count):
+            res = method(1, "PR4", optlist, target)
+        t1 = time.process_time_ns()
+        per = (t1 - t0) / count
+        best = per if best is None else min(best, per)
+    assert float(res[0]) == 7.53e-6
+    return best
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    opts = types.SimpleNamespace(
+        id=1,
+        timeout=0.1,
+        loopback=optlist.loopback,
+        noflush=False,
+        noreset=False,
+    )
+    reply = b"@001ACK7.53E-6;FF"
+    ser = CannedSerial(reply, optlist.loopback)
+    for title, legacy_fn, codec_fn, arg in (
+        ("frame build + parse", legacy_parse, codec_parse, reply),
+        ("read_until() stand-in transaction", legacy_transaction, codec_transaction, ser),
+    ):
+        legacy = run(legacy_fn, optlist.count, optlist.repeat, opts, arg)
+        codec = run(codec_fn, optlist.count, optlist.repeat, opts, arg)
+        print(f"{title} CPU per transaction (loopback={optlist.loopback}):")
+        print(f"    legacy: {legacy / 1e3:>7.2f} us")
+        print(f"    mks974: {codec / 1e3:>7.2f} us")
+        print(f"   speedup: {legacy / codec:>7.2f}x")
+
+    # the stand-in fd lets transact() read the way it does from a serial port
+    pipe = PipeSerial(reply, optlist.loopback)
+    count = min(optlist.count, 1000)
+    legacy = run(legacy_transaction, count, optlist.repeat, opts, pipe)
+    codec = run(codec_transaction, count, optlist.repeat, opts, pipe)
+    print(f"transaction through a file descriptor (loopback={optlist.loopback}):")
+    print(f"    legacy: {legacy / 1e3:>7.2f} us")
+    print(f"    mks974: {codec / 1e3:>7.2f} us")
+    print(f"   speedup: {legacy / codec:>7.2f}x")
+    print(f"transient memory per transaction (loopback={optlist.loopback}):")
+    for title, method, target in (
+        ("legacy", legacy_transaction, pipe),
+        ("mks974", codec_transaction, pipe),
+    ):
+        peak = transient(method, count, 1, "PR4", opts, target)
+        print(f"    {title}: {peak:>7.0f} bytes")
+    pipe.close()
+
+    nframes = 64
+    echo = mks974.encode_query(1, "PR4")
+    chunk = (echo + reply if optlist.loopback else reply) * nframes
+    count = max(1, optlist.count // nframes)
+    print(f"split + parse of {nframes} frames per read (loopback={optlist.loopback}):")
+    for title, method in (
+        ("legacy", legacy_split),
+        ("bytes", bytes_split),
+        ("parser", parser_split),
+    ):
+        rate = run_frames(method, chunk, nframes, count, optlist.repeat)
+        peak = transient(method, 100, chunk) / nframes
+        print(f"    {title}: {rate:>10.0f} frames/sec {peak:>6.0f} bytes/frame peak")
+
+
+if __name__ == "__main__":
+    main()
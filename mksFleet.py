@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Configure a fleet of MKS 974B gauges spread over several RS485 buses
+
+Gauges come from an inventory written by mksScan.py --output (a json list
+of {"port", "id", "SN", ...}). Each gauge is brought to its desired state
+with mksSetup.apply_desired(): the state named by the entry's "desired"
+key (a file path or an inline state) or else the --desired file. Buses
+are configured concurrently, one thread per port, while the gauges of a
+bus are strictly one after the other, so commissioning takes about as long
+as the largest bus. An entry whose "SN" differs from the gauge found at its
+address is skipped. A consolidated per-gauge report of success, diff and
+timing is printed and can be written as json. The port options are those
+of the other tools, but the ports themselves come from the inventory and
+--port is not used.
+"""
+import sys
+import json
+import argparse
+import textwrap
+import time
+import logging
+import concurrent.futures
+
+import mks974
+import mksMeta
+import mksSetup
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Apply desired states to every gauge of an inventory, buses in
+           parallel and gauges of one bus in series
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksFleet.py --inventory gauges.json --desired default.json
+                               """
+        ),
+    )
+    mks974.add_port_arguments(parser)
+    parser.add_argument(
+        "--inventory",
+        required=True,
+        help="json inventory of the gauges (mksScan.py --output)",
+    )
+    parser.add_argument(
+        "--desired",
+        metavar="file",
+        help="desired state of gauges whose inventory entry has none",
+    )
+    parser.add_argument(
+        "--report",
+        nargs="?",
+        help="also write the consolidated report as json to this file",
+    )
+    parser.add_argument(
+        "--settle",
+        nargs="?",
+        type=float,
+        default=1.0,
+        const=1.0,
+        help="longest wait (s) for changed settings to read back [1.0]",
+    )
+    parser.add_argument(
+        "--nocache",
+        action="store_true",
+        help="leave the gauge metadata cache alone",
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+def load_plan(optlist):
+    """{port: [(inventory entry, settings)]} in inventory order"""
+    with open(optlist.inventory) as fh:
+        entries = json.load(fh)
+    default = None
+    if optlist.desired:
+        default = mksSetup.load_desired(optlist.desired)
+    states = dict()  # desired files are read once
+    plan = dict()
+    for entry in entries:
+        state = entry.get("desired", default)
+        if isinstance(state, str):
+            if state not in states:
+                states[state] = mksSetup.load_desired(state)
+            state = states[state]
+        if state is None:
+            raise ValueError(f"{entry['port']}:{entry['id']} has no desired state")
+        settings = mksSetup.desired_settings(state)
+        plan.setdefault(entry["port"], []).append((entry, settings))
+    return plan
+
+
+def failed_result(exc):
+    """result of a gauge whose configuration raised exc"""
+    return {
+        "ok": False,
+        "diff": [],
+        "failed": [],
+        "commands": 0,
+        "elapsed": 0.0,
+        "SN": None,
+        "error": str(exc),
+    }
+
+
+def configure_bus(port, gauges, optlist, results):
+    """configure the gauges of one bus in turn, appending (entry, result) to results"""
+    optlist = argparse.Namespace(**vars(optlist))
+    optlist.port = port
+    ser = mks974.open_port(optlist)
+    try:
+        for entry, settings in gauges:
+            optlist.id = int(entry["id"])
+            t0 = time.monotonic()
+            sn = mks974.query_and_response("SN", optlist, ser).result
+            if entry.get("SN") is not None and sn != entry["SN"]:
+                logging.error(
+                    f"{port}:{optlist.id:03d} SN {sn} is not {entry['SN']}, skipped"
+                )
+                result = {"ok": False, "diff": [], "failed": ["SN"], "commands": 0}
+                result["elapsed"] = time.monotonic() - t0
+            else:
+                # the metadata cache is updated by the main thread afterwards
+                meta = mksMeta.GaugeMetadata(optlist, ser, None)
+                result = mksSetup.apply_desired(settings, optlist, ser, meta)
+                result["elapsed"] = time.monotonic() - t0
+            result["SN"] = sn
+            results.append((entry, result))
+    finally:
+        ser.close()
+
+
+def configure_fleet(plan, optlist, results, times):
+    """run configure_bus() for every port concurrently
+
+    Fills results {port: [(entry, result)]} and times {port: elapsed}. A
+    bus that fails (eg. its port cannot be opened) gets a failed result
+    with the error for each gauge it did not get to; the other buses go on.
+    """
+
+    def timed(port, gauges):
+        t0 = time.monotonic()
+        try:
+            configure_bus(port, gauges, optlist, results[port])
+        finally:
+            times[port] = time.monotonic() - t0
+
+    with concurrent.futures.ThreadPoolExecutor(len(plan)) as pool:
+        futures = {port: pool.submit(timed, port, gauges) for port, gauges in plan.items()}
+        for port, future in futures.items():
+            try:
+                future.result()
+            except Exception as exc:
+                logging.error(f"{port}: {exc}")
+                # the gauge in progress may have been changed in part
+                for entry, settings in plan[port][len(results[port]) :]:
+                    results[port].append((entry, failed_result(exc)))
+
+
+def report_fleet(results, times, elapsed, optlist):
+    """invalidate changed cache entries, print and write the report, returns failures"""
+    cache = None if optlist.nocache else mksMeta.MetadataCache()
+    report = []
+    failed = 0
+    for port, bus in results.items():
+        for entry, result in bus:
+            gid = int(entry["id"])
+            if cache is not None and "error" in result:
+                cache.invalidate(port, gid)
+            elif cache is not None and result["diff"]:
+                names = [name for name, have, want in result["diff"]]
+                cache.invalidate(port, gid, names)
+            if "error" in result:
+                print(f"{port}:{gid:03d} FAILED: {result['error']}")
+            else:
+                for line in mksSetup.format_apply(f"{port}:{gid:03d}", result):
+                    print(line)
+            failed += not result["ok"]
+            report.append(dict(port=port, id=gid, **result))
+    if cache is not None:
+        cache.close()
+    print("===================================================================")
+    for port, bus in results.items():
+        changed = sum(bool(result["diff"]) for entry, result in bus)
+        print(
+            f"{port}: {len(bus)} gauges, {changed} changed,"
+            f" in {times.get(port, 0.0):.3f}s"
+        )
+    serial_time = sum(times.values())
+    print(
+        f"fleet: {len(report)} gauges on {len(results)} buses, {failed} failed,"
+        f" {elapsed:.3f}s ({serial_time:.3f}s bus by bus)"
+    )
+    if optlist.report:
+        with open(optlist.report, "w") as fh:
+            json.dump(report, fh, indent=1)
+    return failed
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    try:
+        plan = load_plan(optlist)
+    except (OSError, ValueError, KeyError) as exc:
+        logging.error(f"fleet plan: {exc}")
+        sys.exit(1)
+    if not plan:
+        logging.error(f"no gauges in {optlist.inventory}")
+        sys.exit(1)
+
+    results = {port: [] for port in plan}
+    times = dict()
+    t0 = time.monotonic()
+    try:
+        configure_fleet(plan, optlist, results, times)
+    finally:
+        # whatever happened, report and forget what was changed
+        elapsed = time.monotonic() - t0
+        failed = report_fleet(results, times, elapsed, optlist)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
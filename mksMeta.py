@@ -0,0 +1,179 @@
+"""
+Persistent on-disk cache of MKS 974B identity and configuration values
+
+Entries are keyed by port and RS485 address and tied to the gauge serial
+number: the SN is always read from the gauge and a different SN discards
+everything cached for that address. Cached values expire after a TTL and
+are invalidated when a command writes them. Changes are kept in memory
+and written once, atomically, by close() or at interpreter exit.
+"""
+import os
+import json
+import atexit
+import time
+import logging
+
+import mks974
+
+DEFAULT_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "mks974",
+    "metadata.json",
+)
+DEFAULT_TTL = 24 * 3600.0
+
+# values that only change when written with a command
+CACHED = {
+    "PN",
+    "MD",
+    "DT",
+    "FV",
+    "HV",
+    "AD",
+    "BR",
+    "RSD",
+    "UT",
+    "ENC",
+    "SLC",
+    "SHC",
+    "SLP",
+    "PRO",
+}
+CACHED.update(f"{name}{rid}" for name in ("EN", "SP", "SD", "SH") for rid in (1, 2, 3))
+
+
+class MetadataCache:
+    """json file of {port:id: {"SN": sn, "fields": {name: [value, time]}}}"""
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.gauges = dict()
+        self.dirty = False
+        try:
+            with open(path) as fh:
+                self.gauges = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as exc:
+            logging.warning(f"ignoring unreadable metadata cache {path}: {exc}")
+        atexit.register(self.close)
+
+    @staticmethod
+    def key(port, gid):
+        return f"{port}:{int(gid):03d}"
+
+    def save(self):
+        """atomically rewrite the cache file"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, "w") as fh:
+            json.dump(self.gauges, fh, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def close(self):
+        """write pending changes, if any; the cache stays usable"""
+        if not self.dirty:
+            return
+        try:
+            self.save()
+        except OSError as exc:
+            logging.warning(f"cannot write metadata cache {self.path}: {exc}")
+
+    def bind(self, port, gid, sn):
+        """confirm the gauge at port:gid is `sn`, dropping stale entries"""
+        key = self.key(port, gid)
+        entry = self.gauges.get(key)
+        if entry is not None and entry.get("SN") == sn:
+            return
+        if entry is not None:
+            logging.debug(f"{key} SN changed {entry.get('SN')} -> {sn}")
+        self.gauges[key] = {"SN": sn, "fields": {}}
+        self.dirty = True
+
+    def get(self, port, gid, name):
+        """cached value or None if missing or expired"""
+        entry = self.gauges.get(self.key(port, gid))
+        if entry is None or name not in entry["fields"]:
+            return None
+        value, stamp = entry["fields"][name]
+        if time.time() - stamp > self.ttl:
+            return None
+        return value
+
+    def put(self, port, gid, name, value):
+        entry = self.gauges.get(self.key(port, gid))
+        if entry is None:
+            return
+        entry["fields"][name] = [value, time.time()]
+        self.dirty = True
+
+    def invalidate(self, port, gid, names=None):
+        """forget `names` (all if None) of gauge port:gid"""
+        key = self.key(port, gid)
+        if key not in self.gauges:
+            return
+        if names is None:
+            del self.gauges[key]
+        else:
+            for name in names:
+                self.gauges[key]["fields"].pop(name, None)
+        self.dirty = True
+
+
+class GaugeMetadata:
+    """query_and_response/cmd_and_response backed by a MetadataCache
+
+    The first SN query (issued implicitly if needed) validates the cache
+    entry; afterwards values in CACHED are answered from disk when fresh.
+    Commands invalidate the setting they write. With cache=None every
+    call goes to the gauge.
+    """
+
+    def __init__(self, optlist, ser, cache=None):
+        self.optlist = optlist
+        self.ser = ser
+        self.cache = cache
+        self.bound = False
+        self.transactions = 0
+        self.hits = 0
+
+    def _bind(self):
+        res = mks974.query_and_response("SN", self.optlist, self.ser)
+        self.transactions += 1
+        if res.result is not None and self.cache is not None:
+            self.cache.bind(self.optlist.port, self.optlist.id, res.result)
+            self.bound = True
+        return res
+
+    def query_and_response(self, query, optlist, ser):
+        """send query and return response, cached values when valid"""
+        if query == "SN":
+            return self._bind()
+        if self.cache is None or query not in CACHED:
+            self.transactions += 1
+            return mks974.query_and_response(query, optlist, ser)
+        if not self.bound:
+            self._bind()
+        value = self.cache.get(optlist.port, optlist.id, query)
+        if value is not None:
+            self.hits += 1
+            return mks974.Transaction(value, 0.0, 0, 0)
+        res = mks974.query_and_response(query, optlist, ser)
+        self.transactions += 1
+        if res.result is not None and self.bound:
+            self.cache.put(optlist.port, optlist.id, query, res.result)
+        return res
+
+    def cmd_and_response(self, cmd, optlist, ser):
+        """send command and return response, invalidating what it writes"""
+        res = mks974.cmd_and_response(cmd, optlist, ser)
+        self.transactions += 1
+        if self.cache is not None:
+            name = cmd.partition("!")[0]
+            if name in ("AD", "BR"):  # gauge leaves this port:id
+                self.cache.invalidate(optlist.port, optlist.id)
+            elif name in CACHED:
+                self.cache.invalidate(optlist.port, optlist.id, [name])
+        return res
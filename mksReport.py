@@ -13,12 +13,16 @@ import time
 import logging
 import warnings
 import re
-import numpy as np
-from astropy import stats
-from astropy.utils.exceptions import AstropyWarning
+import json
+import mks974
+import mksCadence
+import mksMeta
 
+# pressures, status and relays read by --readpressures
+STATUS_QUERIES = ("PR4", "PR5", "T", "SS1", "SS2", "SS3")
 
-def parse_args():
+
+def parse_args(argv=None):
     """handle command line"""
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -32,21 +36,13 @@ def parse_args():
                                """
         ),
     )
-    parser.add_argument(
-        "--port",
-        nargs="?",
-        default="/dev/ttyS0",
-        const="/dev/ttyS0",
-        help="serial port to open",
-    )
-    parser.add_argument(
-        "--baudrate",
-        nargs="?",
-        type=int,
-        default=9600,
-        const=9600,
-        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
-    )
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_arguments(parser):
+    """options of the tool, also those of its hwutils subcommand"""
+    mks974.add_port_arguments(parser)
     parser.add_argument(
         "--id",
         nargs="?",
@@ -75,15 +71,7 @@ def parse_args():
         type=float,
         default=1.0,
         const=1.0,
-        help="delay between queries",
-    )
-    parser.add_argument(
-        "--timeout",
-        nargs="?",
-        type=float,
-        default=0.1,
-        const=0.1,
-        help="timeout for read()",
+        help="period (s) of the --readpressures snapshots",
     )
     parser.add_argument(
         "--serialonly", action="store_true", help="print serial number and exit"
@@ -91,21 +79,18 @@ def parse_args():
     parser.add_argument(
         "--readpressures",
         action="store_true",
-        help="print pressure and relay status using count and delay",
-    )
-    parser.add_argument(
-        "--loopback", action="store_true", help="connection is RS485 half duplex"
+        help="print a pressure and relay status snapshot count times, every delay s",
     )
     parser.add_argument(
-        "--noflush", action="store_true", help="no flush after write() call"
-    )
-    parser.add_argument(
-        "--noreset", action="store_true", help="no reset after write() call"
+        "--json",
+        action="store_true",
+        help="with --readpressures emit one json record per snapshot",
     )
     parser.add_argument(
-        "--debug", action="store_true", help="print additional debugging messages"
+        "--nocache",
+        action="store_true",
+        help="do not use the persistent gauge metadata cache",
     )
-    return parser.parse_args()
 
 
 def init_logging(debug):
@@ -121,271 +106,166 @@ def init_logging(debug):
 
 def init_warnings():
     """Block warnings from Astropy"""
+    from astropy.utils.exceptions import AstropyWarning
+
     warnings.simplefilter("ignore", category=AstropyWarning)
 
 
-def query_and_response(query, optlist, ser):
-    """send command and return response"""
-    dt0 = 0.0
-    retries = 0
-    max_retries = 5
-    query_str = f"@{optlist.id:03d}{query}?;FF"
-    query_bts = bytes(query_str, "utf-8")
-    errcnt = 0
-    result = None
-    nn = 0
-    if optlist.debug:
-        logging.debug(f"query={query_bts}")
-
-    while retries < max_retries:
-        if not optlist.noreset:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-        start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        ser.write(query_bts)
-        if not optlist.noflush:
-            ser.flush()
-        resp = ser.read_until(expected=b";FF", size=None)
-        end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        dt = (end_ns - start_ns) * 1e-9
-
-        if optlist.loopback:  # RS485 query echo -> read again
-            query_echo = resp
-            query_dt = dt
-            if re.match(f"@{optlist.id:03d}{query}\?;FF", resp.decode()):
-                ser.timeout = float(optlist.timeout) - query_dt
-                resp = ser.read_until(expected=b";FF", size=None)
-                end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                dt = (end_ns - start_ns) * 1e-9
-                logging.debug(f"query echo={query_echo} dt={query_dt:>.3f}")
-            else:
-                logging.warning(f"echo failed: {query_echo} dt={query_dt:>.3f}")
-
-        # check the reply is valid
-        if re.match(r"@...ACK.*;FF", resp.decode()):
-            dt = dt0 + dt
-            result = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
-            logging.debug(f"resp={resp} dt={dt:>.3f}")
-            break
-        elif retries < max_retries and dt >= ser.timeout:  # retry
-            # print(f"{resp}")
-            logging.debug(f"resp={resp} dt={dt:>.3f}")
-            dt0 = dt
-            retries += 1
-        else:
-            dt = dt0 + dt
-            logging.warning(
-                "failed at trial %d: query=%s  resp=%s, dt=%.3f",
-                retries,
-                query,
-                resp,
-                dt,
-            )
-            errcnt += 1
-            break
-    return result, dt, retries, errcnt
-
-
-def cmd_and_response(cmd, optlist, ser):
-    """send command and return response"""
-    dt0 = 0.0
-    retries = 0
-    max_retries = 5
-    cmd_str = f"@{optlist.id:03d}{cmd};FF"
-    cmd_bts = bytes(cmd_str, "utf-8")
-    errcnt = 0
-    result = None
-    nn = 0
-    if optlist.debug:
-        logging.debug(f"cmd={cmd_bts}")
-
-    while retries < max_retries:
-        if not optlist.noreset:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-        start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        ser.write(cmd_bts)
-        if not optlist.noflush:
-            ser.flush()
-        resp = ser.read_until(expected=b";FF", size=None)
-        end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        dt = (end_ns - start_ns) * 1e-9
-
-        if optlist.loopback:  # RS485 cmd echo -> read again
-            cmd_echo = resp
-            cmd_dt = dt
-            if re.match(f"@{optlist.id:03d}{cmd};FF", resp.decode()):
-                ser.timeout = float(optlist.timeout) - cmd_dt
-                resp = ser.read_until(expected=b";FF", size=None)
-                end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                dt = (end_ns - start_ns) * 1e-9
-                logging.debug(f"cmd echo={cmd_echo} dt={cmd_dt:>.3f}")
-            else:
-                logging.warning(f"echo failed: {cmd_echo} dt={cmd_dt:>.3f}")
-
-        # check the reply is valid
-        if re.match(r"@...ACK.*;FF", resp.decode()):
-            dt = dt0 + dt
-            result = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
-            logging.debug(f"resp={resp} dt={dt:>.3f}")
-            break
-        elif retries < max_retries and dt >= ser.timeout:  # retry
-            # print(f"{resp}")
-            dt0 = dt
-            retries += 1
-        else:
-            dt = dt0 + dt
-            logging.warning(
-                "failed at trial %d: cmd=%s  resp=%s, dt=%.3f",
-                retries,
-                cmd,
-                resp,
-                dt,
-            )
-            errcnt += 1
-            break
-    return result, dt, retries, errcnt
-
-
-def main():
+def read_snapshot(meta, optlist, ser):
+    """read STATUS_QUERIES back to back, returns (time, {query: result}, dt)"""
+    stamp = time.time()
+    t0 = time.monotonic()
+    values = {
+        qry: meta.query_and_response(qry, optlist, ser).result for qry in STATUS_QUERIES
+    }
+    return stamp, values, time.monotonic() - t0
+
+
+def format_snapshot(stamp, values, dt):
+    """one line text form of a read_snapshot()"""
+    line = f"{stamp:.6f} "
+    for qry in ("PR4", "PR5"):
+        prs = mks974.parse_value(values[qry])
+        line += f"{qry}: {'None' if prs is None else f'{prs:8.2E}':>8s} "
+    line += f"status: {values['T']} "
+    for a in range(1, 4):
+        line += f"R{a}:{values[f'SS{a}']} "
+    return line + f"dt={dt:.3f}"
+
+
+def main(optlist=None):
     """main logic"""
-    optlist = parse_args()
+    if optlist is None:
+        optlist = parse_args()
     init_logging(optlist.debug)
     # init_warnings()
 
-    ser = serial.Serial()
-    # ser = serial.rs485.RS485(optlist.port)
-    ser.port = optlist.port
-    ser.baudrate = optlist.baudrate
-    ser.timeout = float(optlist.timeout)
-    ser.open()
+    ser = mks974.open_port(optlist)
+    cache = None if optlist.nocache else mksMeta.MetadataCache()
+    meta = mksMeta.GaugeMetadata(optlist, ser, cache)
 
     # -- exclusive options
     if optlist.serialonly:
         qry = "SN"  # serial number
-        res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
         print(f"SerialNumber: {res}")
         exit()
     elif optlist.readpressures:
-        print("#---------- MKS Gauge Report ----")
         qry = "SN"  # serial number
-        res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
-        print(f"SerialNumber: {res}")
+        res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
+        if not optlist.json:
+            print("#---------- MKS Gauge Report ----")
+            print(f"SerialNumber: {res}")
         if optlist.count:
-            for nn in range(int(optlist.count)):
-                res, dt, retries, errcnt = query_and_response("PR4", optlist, ser)
-                prs = float(res)
-                print(f"PR4: {float(prs):8.2E} ", end="")
-                time.sleep(0.1)
-                et = 0.1 + dt
-                res, dt, retries, errcnt = query_and_response("PR5", optlist, ser)
-                prs = float(res)
-                print(f"PR5: {float(prs):8.2E} ", end="")
-                time.sleep(0.1)
-                et = 0.1 + dt
-                res, dt, rt, ercnt = query_and_response("T", optlist, ser)
-                print(f"status: {res} ", end="")
-                time.sleep(0.1)
-                et = 0.1 + dt
-                for a in range(1, 4):
-                    query = "SS{}".format(a)  # trans status
-                    res, dt, rt, ercnt = query_and_response(query, optlist, ser)
-                    print(f"R{a}:{res} ", end="")
-                    time.sleep(0.1)
-                    et += 0.1 + dt
-                print("")
-                if float(optlist.delay) > et:
-                    time.sleep(float(optlist.delay) - dt)
+            cadence = mksCadence.Cadence(optlist.delay)
+            cstats = mksCadence.CadenceStats(cadence.period)
+            for nn, due in cadence.slots(int(optlist.count)):
+                cstats.record(optlist.id, due)
+                stamp, values, et = read_snapshot(meta, optlist, ser)
+                if optlist.json:
+                    record = dict(time=stamp, port=optlist.port, id=optlist.id, SN=res)
+                    record.update(values)
+                    record.update(
+                        PR4=mks974.parse_value(values["PR4"]),
+                        PR5=mks974.parse_value(values["PR5"]),
+                        dt=round(et, 6),
+                    )
+                    print(json.dumps(record), flush=True)
+                else:
+                    print(format_snapshot(stamp, values, et), flush=True)
+            cstats.miss(optlist.id, cadence.missed)
+            if not optlist.json:
+                print(f"# {cstats.report(optlist.id)}")
         exit()
 
     # -- prepare meta data
     print("#---------- MKS Gauge Report ----")
     qry = "SN"  # serial number
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"SerialNumber: {res}")
 
     qry = "PN"  # part number
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"PartNum: {res}")
 
     qry = "MD"  # model number
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Model: {res}")
 
     qry = "DT"  # device type
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"DeviceType: {res}")
 
     qry = "FV"  # firmware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Firmware: {res}")
 
     qry = "HV"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Hardware: {res}")
 
     qry = "AD"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Address: {res}")
 
     qry = "BR"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"BaudRate: {res}")
 
     qry = "RSD"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"RecieveSendDelay: {res}")
 
     # cmd = "ENC!ON"   # enable AutoCC
-    # res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+    # res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
     # print(f"enable AutoCC, ")
 
     qry = "ENC"  # CC Auto enable
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"AutoCC: {res}")
 
     qry = "SLC"  # CCOn
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCOnSetpoint: {res}")
 
     qry = "SHC"  # CCOff
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCOffSetpoint: {res}")
 
     qry = "SLP"  # CC/MP smoothing
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CC/MP smoothing: {res}")
 
     qry = "PRO"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CC Protection delay: {res}")
 
     qry = "TIM"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"TimeOn: {res}")
 
     qry = "TIM2"  # Cold Cathode time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCTimeOn: {res}")
 
     qry = "TIM3"  # Cold Cathode dose
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCDose: {res}")
 
     qry = "PR4"  # comb pressure reading
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Combined Pressure: {res}")
 
     qry = "PR5"  # comb pressure reading
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Cold Cathode Reading: {res}")
 
     qry = "TEM"  # trans status
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"temp: {float(res):.1f} C")
 
     qry = "T"  # trans status
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"status: {res}")
 
     print("")
@@ -394,31 +274,35 @@ def main():
     for a in range(1, 4):
 
         # cmd = "EN{}!ON".format(a)    # enable relay
-        # res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        # res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         # print(f"    enable relay{a}, ", end="")
         # cmd = "SD{}!BELOW".format(a)    # trans status
-        # res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        # res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         # print(f"set direction to BELOW")
         query = "EN{}".format(a)  # trans status
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f"    R{a} enable: {res}", end="")
         query = "SP{}".format(a)  # trans status
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f"    R{a} setPoint: {res}", end="")
         query = "SD{}".format(a)  # trans status
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f" R{a} direction: {res}", end="")
         query = "SS{}".format(a)  # trans status
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f" R{a} status: {res}")
 
+    logging.debug(
+        f"report used {meta.transactions} transactions, {meta.hits} cached values"
+    )
+
     t0 = time.time()
     rstats = dict()
     dtlist = []
     retrytot = 0
     errtot = 0
     for nn in range(int(optlist.count)):
-        prStr, dt, retries, errcnt = query_and_response("PR4", optlist, ser)
+        prStr, dt, retries, errcnt = meta.query_and_response("PR4", optlist, ser)
         dtlist.append(dt)
         prVal = float(prStr)
         if retries in rstats:
@@ -433,7 +317,11 @@ def main():
     t1 = time.time()
     elapsed = t1 - t0
     ser.close()
+    if cache is not None:
+        cache.close()
     print("")
+    import numpy as np
+
     if len(dtlist):
         dtarray = np.array(dtlist)
         dtavg = np.mean(dtarray)
@@ -0,0 +1,113 @@
+"""
+Retry policy and per-gauge circuit breaker for RS485 polling loops
+
+A RetryPolicy bounds the attempts of one read and spaces them with
+exponential backoff and jitter. A CircuitBreaker stops polling a gauge
+after `threshold` consecutive failed reads and then only lets a single
+probe attempt through every `probe` seconds until the gauge answers.
+"""
+import logging
+import random
+
+CLOSED = "CLOSED"
+OPEN = "OPEN"
+HALF_OPEN = "HALF_OPEN"
+
+
+class RetryPolicy:
+    """attempt count and backoff between attempts"""
+
+    def __init__(self, retries=5, backoff=0.0, factor=2.0, jitter=0.0, rng=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.jitter = jitter
+        self.rng = rng if rng is not None else random.Random()
+
+    def delay(self, retry):
+        """seconds to wait before retry number `retry` (1, 2, ...)"""
+        if self.backoff <= 0.0:
+            return 0.0
+        delay = self.backoff * self.factor ** (retry - 1)
+        if self.jitter:
+            delay *= 1.0 + self.jitter * self.rng.uniform(-1.0, 1.0)
+        return max(0.0, delay)
+
+
+class GaugeBreaker:
+    """breaker state of one gauge"""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0  # consecutive failed reads
+        self.next_probe = 0.0
+        self.opens = 0
+        self.probes = 0
+        self.skipped = 0
+        self.changes = []  # (time, old state, new state)
+
+
+class CircuitBreaker:
+    """per key breaker: CLOSED -> OPEN after threshold failures -> probing"""
+
+    def __init__(self, threshold=3, probe=10.0):
+        self.threshold = threshold
+        self.probe = probe
+        self.gauges = dict()
+
+    def _gauge(self, key):
+        gauge = self.gauges.get(key)
+        if gauge is None:
+            gauge = self.gauges[key] = GaugeBreaker()
+        return gauge
+
+    def _change(self, key, gauge, state, now):
+        logging.warning(
+            "%s breaker %s -> %s after %d failures", key, gauge.state, state, gauge.failures
+        )
+        gauge.changes.append((now, gauge.state, state))
+        gauge.state = state
+
+    def allow(self, key, now):
+        """True if key may be read now; an OPEN breaker lets one probe through"""
+        gauge = self._gauge(key)
+        if gauge.state == OPEN:
+            if now < gauge.next_probe:
+                gauge.skipped += 1
+                return False
+            self._change(key, gauge, HALF_OPEN, now)
+        if gauge.state == HALF_OPEN:
+            gauge.probes += 1
+        return True
+
+    def attempts(self, key, policy):
+        """attempts allowed for the next read of key"""
+        if self._gauge(key).state == HALF_OPEN:
+            return 1
+        return policy.retries
+
+    def success(self, key, now):
+        gauge = self._gauge(key)
+        if gauge.state != CLOSED:
+            self._change(key, gauge, CLOSED, now)
+        gauge.failures = 0
+
+    def failure(self, key, now):
+        gauge = self._gauge(key)
+        gauge.failures += 1
+        if gauge.state == HALF_OPEN or (
+            gauge.state == CLOSED and gauge.failures >= self.threshold
+        ):
+            if gauge.state == CLOSED:
+                gauge.opens += 1
+            self._change(key, gauge, OPEN, now)
+        if gauge.state == OPEN:
+            gauge.next_probe = now + self.probe
+
+    def report(self, key):
+        """one line summary of the breaker of key"""
+        gauge = self._gauge(key)
+        return (
+            f"breaker: {gauge.state} opens: {gauge.opens} probes: {gauge.probes}"
+            f" skipped: {gauge.skipped} changes: {len(gauge.changes)}"
+        )
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+"""
+Memory-mapped ring file of recent pressure samples
+
+readAllPressure.py --ring FILE appends every read (time, port, id,
+pressure, dt, retries) to a fixed-size numpy structured array in a
+memory-mapped file, overwriting the oldest samples once it is full, so
+the last hours of every gauge are available to any other process at once.
+
+There is a single writer and no lock. The header holds two sample
+counters: `claimed` is advanced before a slot is written and `head` after
+it, so samples [max(claimed - capacity, 0), head) are complete. A reader
+takes numpy views of the file without copying them; since the writer may
+overwrite the oldest of those samples meanwhile, the reader checks
+overrun(first) once done with them (or uses copy(), which retries).
+"""
+import os
+import sys
+import argparse
+import textwrap
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+MAGIC = b"MKSRING2"  # 2: 64 byte port names
+HEADER_SIZE = 64  # header padded to a cache line
+HEADER_DTYPE = np.dtype(
+    [("magic", "S8"), ("capacity", "u8"), ("claimed", "u8"), ("head", "u8")]
+)
+RING_DTYPE = np.dtype(
+    [
+        ("time", "f8"),
+        ("pressure", "f8"),
+        ("dt", "f8"),
+        ("port", "S64"),
+        ("gid", "i4"),
+        ("retries", "i4"),
+    ]
+)
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Summarize the recent samples of every gauge in a ring file
+           written by readAllPressure.py --ring FILE
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksRing.py mks974.ring --since 3600
+                               """
+        ),
+    )
+    parser.add_argument("path", help="ring file")
+    parser.add_argument(
+        "--since",
+        nargs="?",
+        type=float,
+        default=3600.0,
+        const=3600.0,
+        help="window (s) before now to summarize [3600]",
+    )
+    parser.add_argument(
+        "--dump", action="store_true", help="print every sample of the window"
+    )
+    return parser.parse_args()
+
+
+class RingWindow(NamedTuple):
+    """views of a time window, oldest first, valid while not overrun(first)"""
+
+    first: int
+    views: List[np.ndarray]
+
+
+class PressureRing:
+    """fixed-size ring of RING_DTYPE samples in a memory-mapped file"""
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mm = np.memmap(path, dtype=np.uint8, mode=mode)
+        self.header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self.mm)[0]
+        if self.header["magic"] != MAGIC:
+            raise ValueError(f"{path} is not a pressure ring file")
+        self.capacity = int(self.header["capacity"])
+        self.ring = np.ndarray(
+            (self.capacity,), dtype=RING_DTYPE, buffer=self.mm, offset=HEADER_SIZE
+        )
+
+    @classmethod
+    def open(cls, path, capacity):
+        """ring for writing, kept from an earlier run if its capacity matches"""
+        size = HEADER_SIZE + capacity * RING_DTYPE.itemsize
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            try:
+                return cls(path, mode="r+")
+            except ValueError:
+                pass
+        with open(path, "wb") as fh:
+            fh.truncate(size)
+        mm = np.memmap(path, dtype=np.uint8, mode="r+")
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=mm)
+        header["capacity"] = capacity
+        header["magic"] = MAGIC  # last: the file is complete
+        mm.flush()
+        del header, mm
+        return cls(path, mode="r+")
+
+    def append(self, now, port, gid, pressure, dt, retries):
+        """single writer: store one sample, overwriting the oldest when full"""
+        seq = int(self.header["head"])
+        self.header["claimed"] = seq + 1
+        self.ring[seq % self.capacity] = (
+            now, pressure, dt, port.encode(), gid, retries
+        )
+        self.header["head"] = seq + 1
+
+    def span(self):
+        """(first, head): sequence numbers of the complete samples"""
+        head = int(self.header["head"])
+        claimed = int(self.header["claimed"])
+        # a writer lapping the reader in between leaves an empty span
+        return min(max(claimed - self.capacity, 0), head), head
+
+    def overrun(self, first):
+        """True once sample `first` may have been overwritten"""
+        return int(self.header["claimed"]) - self.capacity > first
+
+    def window(self, t0=-np.inf, t1=np.inf):
+        """RingWindow of the samples with t0 <= time <= t1, no copy
+
+        The views are one slice of the file, or two where the window wraps
+        around its end.
+        """
+        first, head = self.span()
+        start = first % self.capacity
+        count = head - first
+        if start + count <= self.capacity:
+            parts = [self.ring[start : start + count]]
+        else:
+            parts = [self.ring[start:], self.ring[: start + count - self.capacity]]
+        views = []
+        for part in parts:
+            times = part["time"]
+            lo = np.searchsorted(times, t0, side="left")
+            hi = np.searchsorted(times, t1, side="right")
+            if hi > lo:
+                views.append(part[lo:hi])
+        return RingWindow(first, views)
+
+    def copy(self, t0=-np.inf, t1=np.inf):
+        """consistent copy of window(t0, t1) as one array"""
+        while True:
+            first, views = self.window(t0, t1)
+            snap = np.concatenate(views) if views else np.empty(0, RING_DTYPE)
+            if not self.overrun(first):
+                return snap
+            time.sleep(0)
+
+    def close(self):
+        self.mm.flush()
+        del self.header, self.ring, self.mm
+
+
+def print_window(snap):
+    """one summary line per gauge"""
+    keys = sorted(set(zip(snap["port"], snap["gid"])))
+    for port, gid in keys:
+        rows = snap[(snap["port"] == port) & (snap["gid"] == gid)]
+        good = rows[~np.isnan(rows["pressure"])]
+        line = (
+            f"{port.decode()}:{gid:03d} samples {len(rows)}"
+            f" failed {len(rows) - len(good)} retries {int(np.sum(rows['retries']))}"
+        )
+        if len(good):
+            line += (
+                f" pressure last {good['pressure'][-1]:.3E}"
+                f" min {np.min(good['pressure']):.3E}"
+                f" max {np.max(good['pressure']):.3E}"
+                f" dt avg {np.mean(good['dt']):.4f} max {np.max(good['dt']):.4f}"
+            )
+        print(line)
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    ring = PressureRing(optlist.path)
+    try:
+        snap = ring.copy(time.time() - optlist.since)
+        first, head = ring.span()
+    finally:
+        ring.close()
+    print(
+        f"{optlist.path}: {head - first} of {head} samples kept, {len(snap)} in window"
+    )
+    if optlist.dump:
+        for rec in snap:
+            print(
+                f"{rec['time']:.6f} {rec['port'].decode()}:{rec['gid']:03d}"
+                f" {rec['pressure']:.3E} dt={rec['dt']:.4f} retries={rec['retries']}"
+            )
+    print_window(snap)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
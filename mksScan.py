@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+Discover MKS 974B gauges on RS485 buses
+
+Every address 1..253 of each port gets one SN? probe with a short reply
+timeout. Any answer, even a NAK, a truncated frame or a lone byte, marks
+the address as a candidate that is then confirmed with the normal timeout
+and retries, reading serial number, model and firmware. Ports are
+scanned concurrently, one thread per port. The inventory is printed as
+--bus specs and can be written as json for the other tools (load_inventory).
+"""
+import sys
+import json
+import argparse
+import textwrap
+import time
+import logging
+import concurrent.futures
+
+import mks974
+
+ADDRESSES = range(1, 254)
+INVENTORY_FIELDS = ("SN", "MD", "FV")  # serial number, model, firmware version
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Probe RS485 addresses 1..253 of one or more ports for gauges
+           and write an inventory of port, address, SN, model and firmware
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksScan.py --ports /dev/ttyUSB0 /dev/ttyUSB1 --output gauges.json
+                               """
+        ),
+    )
+    parser.add_argument(
+        "--ports",
+        nargs="+",
+        default=["/dev/ttyS0"],
+        help="serial ports to scan",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
+    )
+    parser.add_argument(
+        "--ids",
+        nargs="+",
+        type=int,
+        default=list(ADDRESSES),
+        help="RS485 ids to probe [1..253]",
+    )
+    parser.add_argument(
+        "--probetimeout",
+        nargs="?",
+        type=float,
+        default=0.02,
+        const=0.02,
+        help="time (s) a probe waits for the first reply byte [0.02]",
+    )
+    parser.add_argument(
+        "--timeout",
+        nargs="?",
+        type=float,
+        default=0.1,
+        const=0.1,
+        help="timeout for confirming a candidate",
+    )
+    parser.add_argument(
+        "--output",
+        nargs="?",
+        help="write the inventory as json to this file",
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="connection is RS485 half duplex"
+    )
+    parser.add_argument(
+        "--noflush", action="store_true", help="no flush after write() call"
+    )
+    parser.add_argument(
+        "--noreset", action="store_true", help="no reset after write() call"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+def note_reply(resp, found):
+    """add the address of an ACK or NAK frame to found"""
+    if bytes(resp[4:7]) in (b"ACK", b"NAK"):
+        addr = mks974.frame_addr(resp)
+        if addr is not None:
+            found.add(addr)
+            return True
+    return False
+
+
+def drain(optlist, ser, found):
+    """take in frames until the line has been quiet for the normal timeout
+
+    After a garbled echo the rest of that echo and any reply to the probe
+    are still on their way; sending the next probe over them would garble
+    its echo too.
+    """
+    parser = mks974.frame_parser(ser)
+    parser.echo = None
+    quiet_ns = int(optlist.timeout * 1e9)
+    while True:
+        parser.first_ns = 0
+        resp = parser.read_frame(ser, time.monotonic_ns() + quiet_ns)
+        if resp is not None:
+            note_reply(resp, found)
+        elif not parser.first_ns:
+            break
+    parser.clear()
+
+
+def probe(gid, prev, optlist, ser, found):
+    """one short SN? probe of gid, adds the addresses heard from to found
+
+    The input is not reset between probes: a reply too slow for the probe
+    timeout is still parsed during a later probe and counted for the
+    address it carries. Once a first reply byte is in, the probe waits up
+    to the normal timeout for the frame so the next probe does not talk
+    over it. Bytes that do not make up a reply mark gid; a half duplex
+    echo garbled by a late reply marks gid and the previous address prev
+    and the line is drained before the next probe.
+    """
+    parser = mks974.frame_parser(ser)
+    frame = mks974.encode_query(gid, "SN")
+    parser.echo = frame if optlist.loopback else None
+    parser.first_ns = 0
+    if parser.tap is not None:
+        parser.tap(True, frame)
+    ser.write(frame)
+    if not optlist.noflush:
+        ser.flush()
+    deadline_ns = time.monotonic_ns() + int(optlist.probetimeout * 1e9)
+    if optlist.loopback:  # the window opens once the echo is back
+        deadline_ns += len(frame) * 10_000_000_000 // optlist.baudrate
+    extended = False
+    heard = False
+    while True:
+        try:
+            resp = parser.read_frame(ser, deadline_ns)
+        except mks974.EchoError as exc:
+            logging.debug("%s", exc)
+            found.update(addr for addr in (gid, prev) if addr is not None)
+            drain(optlist, ser, found)
+            return
+        if resp is not None:
+            heard |= note_reply(resp, found)
+            continue
+        if not parser.first_ns or heard or extended:
+            break
+        extended = True  # a reply is coming in: let it finish
+        deadline_ns = parser.first_ns + int(optlist.timeout * 1e9)
+    if parser.first_ns and not heard:
+        found.add(gid)
+
+
+def confirm(gid, optlist, ser):
+    """inventory entry of gauge gid read with normal timeout, None if absent"""
+    entry = {"port": optlist.port, "id": gid}
+    for name in INVENTORY_FIELDS:
+        res = mks974.query_gauge(gid, name, optlist, ser).result
+        if res is None:
+            if name == "SN":
+                return None
+            logging.warning(f"{optlist.port}:{gid:03d} no reply to {name}?")
+        entry[name] = res
+    return entry
+
+
+def scan_port(port, optlist):
+    """scan one port, returns (inventory entries, probes sent, candidates)"""
+    optlist = argparse.Namespace(**vars(optlist))
+    optlist.port = port
+    ser = mks974.open_port(optlist)
+    found = set()
+    try:
+        ser.reset_input_buffer()
+        mks974.frame_parser(ser).clear()
+        prev = None
+        for gid in optlist.ids:
+            probe(gid, prev, optlist, ser, found)
+            prev = gid
+        # collect replies still on their way to the last probes
+        parser = mks974.frame_parser(ser)
+        deadline_ns = time.monotonic_ns() + int(optlist.timeout * 1e9)
+        while (resp := parser.read_frame(ser, deadline_ns)) is not None:
+            note_reply(resp, found)
+        candidates = sorted(found)
+        logging.debug(f"{port} candidates {candidates}")
+        entries = [confirm(gid, optlist, ser) for gid in candidates]
+    finally:
+        ser.close()
+    return [entry for entry in entries if entry is not None], len(optlist.ids), candidates
+
+
+def scan(optlist):
+    """scan all optlist.ports concurrently, returns {port: scan_port() result}"""
+    with concurrent.futures.ThreadPoolExecutor(len(optlist.ports)) as pool:
+        futures = {port: pool.submit(scan_port, port, optlist) for port in optlist.ports}
+    return {port: future.result() for port, future in futures.items()}
+
+
+def load_inventory(path):
+    """inventory entries written by --output, grouped as [(port, [ids])]"""
+    with open(path) as fh:
+        entries = json.load(fh)
+    buses = dict()
+    for entry in entries:
+        buses.setdefault(entry["port"], []).append(int(entry["id"]))
+    return list(buses.items())
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    t0 = time.monotonic()
+    results = scan(optlist)
+    elapsed = time.monotonic() - t0
+
+    inventory = []
+    print(f"{'port':<16s} {'id':>3s} {'SN':>10s} {'model':>8s} {'firmware':>8s}")
+    for port, (entries, probes, candidates) in results.items():
+        for entry in entries:
+            print(
+                f"{port:<16s} {entry['id']:>03d} {entry['SN']:>10s}"
+                f" {entry['MD'] or '-':>8s} {entry['FV'] or '-':>8s}"
+            )
+        inventory.extend(entries)
+    print("===================================================================")
+    for port, (entries, probes, candidates) in results.items():
+        ids = ",".join(str(entry["id"]) for entry in entries)
+        print(
+            f"{port}: {len(entries)} gauges ({len(candidates)} candidates,"
+            f" {probes} probes) --bus {port}:{ids}"
+        )
+    print(f"scanned {len(results)} ports in {elapsed:.2f}s")
+    if optlist.output:
+        with open(optlist.output, "w") as fh:
+            json.dump(inventory, fh, indent=1)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+"""
+Poll MKS 974B gauges on dozens of serial ports from one thread
+
+Port fds are put in non-blocking mode and multiplexed with selectors
+(epoll on Linux). Each port runs a small request/reply state machine and
+reads into a mks974.FrameParser, so no thread blocks in read_until().
+"""
+import os
+import sys
+import serial
+import argparse
+import textwrap
+import time
+import logging
+import selectors
+import termios
+
+import mks974
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Poll gauges on many RS485 buses from a single thread using
+           non-blocking fds and epoll
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksSelect.py --bus /dev/ttyS0:1,2,3 /dev/ttyS1:4,5
+                               """
+        ),
+    )
+    parser.add_argument(
+        "--bus",
+        nargs="+",
+        required=True,
+        metavar="PORT:ID[,ID...]",
+        help="serial port and the RS485 ids:{1..253} polled on it",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
+    )
+    parser.add_argument(
+        "--query",
+        nargs="?",
+        default="PR4",
+        const="PR4",
+        help="query to poll (default PR4)",
+    )
+    parser.add_argument(
+        "--count",
+        nargs="?",
+        type=int,
+        default=1,
+        help="number of polling cycles",
+    )
+    parser.add_argument(
+        "--delay",
+        nargs="?",
+        type=float,
+        default=1.0,
+        const=1.0,
+        help="delay between polling cycles",
+    )
+    parser.add_argument(
+        "--timeout",
+        nargs="?",
+        type=float,
+        default=0.1,
+        const=0.1,
+        help="timeout for each reply",
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="connection is RS485 half duplex"
+    )
+    parser.add_argument(
+        "--quiet", action="store_true", help="print only the summary"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+class PortPoller:
+    """request/reply state machine of one non-blocking RS485 port"""
+
+    def __init__(self, port, ids, query, count, delay, optlist):
+        self.port = port
+        self.ids = ids
+        self.count = count
+        self.delay = delay
+        self.timeout = optlist.timeout
+        self.loopback = optlist.loopback
+        self.frames = [mks974.encode_query(gid, query) for gid in ids]
+        # configure termios via pyserial, then drive the raw fd
+        self.ser = serial.Serial(port, optlist.baudrate, timeout=0)
+        self.fd = self.ser.fileno()
+        os.set_blocking(self.fd, False)
+        self.parser = mks974.FrameParser()
+        self.cycle = 0
+        self.index = 0
+        self.retries = 0
+        self.start_ns = 0
+        self.dt0 = 0.0
+        self.deadline = None  # monotonic time of reply timeout or next cycle
+        self.waiting = False
+        self.done = False
+        self.cycle_t0 = 0.0
+        # stats
+        self.reads = 0
+        self.retrytot = 0
+        self.errors = 0
+        self.wakeups = 0
+        self.cpu_ns = 0
+
+    def close(self):
+        self.ser.close()
+
+    def send(self, now):
+        """write the current request and arm the reply deadline"""
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+        self.parser.clear()
+        frame = self.frames[self.index]
+        self.parser.echo = frame if self.loopback else None
+        self.start_ns = time.monotonic_ns()
+        os.write(self.fd, frame)
+        self.waiting = True
+        # the reply deadline runs from the end of transmit, 10 bits per byte
+        self.deadline = now + len(frame) * 10 / self.ser.baudrate + self.timeout
+
+    def advance(self, now):
+        """move to the next id/cycle and send, or wait out the cycle delay"""
+        self.retries = 0
+        self.dt0 = 0.0
+        self.index += 1
+        if self.index == len(self.ids):
+            self.index = 0
+            self.cycle += 1
+            if self.cycle == self.count:
+                self.done = True
+                self.waiting = False
+                self.deadline = None
+                return
+            next_cycle = self.cycle_t0 + self.delay
+            if next_cycle > now:
+                self.waiting = False
+                self.deadline = next_cycle
+                return
+        self.start_cycle(now)
+
+    def start_cycle(self, now):
+        if self.index == 0:
+            self.cycle_t0 = now
+        self.send(now)
+
+    def finish(self, resp, now):
+        """handle a complete reply frame, returns its Sample"""
+        dt = self.dt0 + (time.monotonic_ns() - self.start_ns) * 1e-9
+        value = None
+        gid = self.ids[self.index]
+        if mks974.frame_ack(resp):
+            value = mks974.frame_value(resp)
+            self.reads += 1
+        else:
+            logging.warning(
+                "failed at trial %d: %s:%03d resp=%s, dt=%.3f",
+                self.retries,
+                self.port,
+                gid,
+                bytes(resp),
+                dt,
+            )
+            self.errors += 1
+        sample = mks974.Sample(time.time(), self.port, gid, value, dt, self.retries)
+        self.advance(now)
+        return sample
+
+    def on_readable(self, now):
+        """read what is available and return the Samples it completed"""
+        samples = []
+        try:
+            size = os.readv(self.fd, (self.parser.space(),))
+        except BlockingIOError:
+            return samples
+        self.parser.commit(size)
+        while self.waiting:
+            try:
+                resp = self.parser.next_frame()
+            except mks974.EchoError as exc:  # collision: retry without waiting
+                logging.warning("%s: %s", self.port, exc)
+                sample = self.on_deadline(now)
+                if sample is not None:
+                    samples.append(sample)
+                break
+            if resp is None:
+                break
+            if resp[:4] != self.frames[self.index][:4]:
+                # a late reply to an earlier request: not this gauge's reading
+                logging.debug("%s: dropped %s", self.port, bytes(resp))
+                self.parser.dropped += len(resp)
+                continue
+            samples.append(self.finish(resp, now))
+        return samples
+
+    def on_deadline(self, now):
+        """reply timeout (retry or give up) or start of the next cycle"""
+        if not self.waiting:
+            self.start_cycle(now)
+            return None
+        self.dt0 += (time.monotonic_ns() - self.start_ns) * 1e-9
+        self.retries += 1
+        self.retrytot += 1
+        if self.retries < mks974.MAX_RETRIES:
+            self.send(now)
+            return None
+        gid = self.ids[self.index]
+        sample = mks974.Sample(time.time(), self.port, gid, None, self.dt0, self.retries)
+        self.advance(now)
+        return sample
+
+
+def poll_ports(pollers, consumer):
+    """run every poller to completion from one selector loop"""
+    sel = selectors.DefaultSelector()
+    now = time.monotonic()
+    for poller in pollers:
+        sel.register(poller.fd, selectors.EVENT_READ, poller)
+        poller.start_cycle(now)
+    active = len(pollers)
+    while active:
+        deadlines = [p.deadline for p in pollers if p.deadline is not None]
+        timeout = None
+        if deadlines:
+            timeout = max(0.0, min(deadlines) - time.monotonic())
+        events = sel.select(timeout)
+        now = time.monotonic()
+        for key, mask in events:
+            poller = key.data
+            c0 = time.thread_time_ns()
+            poller.wakeups += 1
+            for sample in poller.on_readable(now):
+                consumer(sample)
+            poller.cpu_ns += time.thread_time_ns() - c0
+        for poller in pollers:
+            if poller.deadline is not None and poller.deadline <= now:
+                c0 = time.thread_time_ns()
+                poller.wakeups += 1
+                sample = poller.on_deadline(now)
+                if sample is not None:
+                    consumer(sample)
+                poller.cpu_ns += time.thread_time_ns() - c0
+        active = sum(not poller.done for poller in pollers)
+    for poller in pollers:
+        sel.unregister(poller.fd)
+    sel.close()
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    pollers = []
+    for spec in optlist.bus:
+        port, ids = mks974.parse_bus(spec)
+        pollers.append(
+            PortPoller(port, ids, optlist.query, optlist.count, optlist.delay, optlist)
+        )
+
+    def consumer(sample):
+        if not optlist.quiet:
+            print(mks974.format_sample(sample))
+
+    t0 = time.monotonic()
+    c0 = time.process_time()
+    try:
+        poll_ports(pollers, consumer)
+    finally:
+        for poller in pollers:
+            poller.close()
+    elapsed = time.monotonic() - t0
+    cpu = time.process_time() - c0
+
+    print("===================================================================")
+    total = 0
+    for poller in pollers:
+        total += poller.reads
+        print(
+            f"{poller.port} ids {poller.ids}: reads: {poller.reads}"
+            f" retries: {poller.retrytot} errors: {poller.errors}"
+            f" rate: {(poller.reads / elapsed):>.1f} reads/sec"
+            f" wakeups: {poller.wakeups} cpu: {poller.cpu_ns * 1e-6:.1f} ms"
+        )
+    print(f"aggregate: {total} reads in {elapsed:.3f}s {(total / elapsed):>.1f} reads/sec")
+    print(f"process cpu: {cpu:.3f}s ({(100.0 * cpu / elapsed):.1f}% of one core)")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+"""
+Gauge server owning MKS 974B serial ports, serving clients on a Unix socket
+
+Every port is opened once and driven by its own thread, so transactions
+from any number of clients are serialized per RS485 bus. Messages in both
+directions are a 4 byte big-endian length followed by a JSON object:
+
+  {"op": "xfer", "port": P, "frame": F}        one raw exchange -> "resp"
+  {"op": "transact", "port": P, "frame": F}    -> Transaction fields
+  {"op": "query", "port": P, "id": N, "query": Q}  -> Transaction fields
+  {"op": "cmd", "port": P, "id": N, "cmd": C}      -> Transaction fields
+  {"op": "subscribe", "port": P, "ids": [...], "query": Q,
+   "period": S, "count": N}                    stream of Sample fields
+  {"op": "ports"}                              -> {"ports": [...]}
+  {"op": "stats"}                              -> cache hit/miss counters
+
+Query replies are served from a mksCache.QueryCache within each query's
+freshness window and identical concurrent queries share one transaction;
+commands invalidate the cached values they change and a failed query
+those of its gauge (--nocache disables). The tools' --server transactions
+(mks974.transact() on a RemotePort) use the transact op and share the
+cache; raw xfer exchanges, which readPressure and readAllPressure time
+attempt by attempt, always go to the bus.
+
+Frames travel as latin-1 strings. Errors are answered with {"error": msg}.
+"""
+import os
+import sys
+import serial
+import argparse
+import textwrap
+import time
+import logging
+import json
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import threading
+from concurrent.futures import Future
+
+import mks974
+import mksCache
+
+DEFAULT_SOCKET = "/tmp/mks974.sock"
+HEADER = struct.Struct("!I")
+
+
+class ServerError(Exception):
+    """error reported by the gauge server"""
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Own MKS 974B serial ports and serve gauge transactions to
+           clients (mksReport, mksSetup, readPressure, ... --server)
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksServer.py --port /dev/ttyS0 /dev/ttyS1 --loopback
+                               """
+        ),
+    )
+    parser.add_argument(
+        "--port",
+        nargs="+",
+        default=["/dev/ttyS0"],
+        help="serial ports to own",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
+    )
+    parser.add_argument(
+        "--timeout",
+        nargs="?",
+        type=float,
+        default=0.1,
+        const=0.1,
+        help="timeout for read()",
+    )
+    parser.add_argument(
+        "--socket",
+        nargs="?",
+        default=DEFAULT_SOCKET,
+        const=DEFAULT_SOCKET,
+        help=f"unix socket to listen on [{DEFAULT_SOCKET}]",
+    )
+    parser.add_argument(
+        "--nocache", action="store_true", help="no caching/coalescing of queries"
+    )
+    parser.add_argument(
+        "--loopback", action="store_true", help="connection is RS485 half duplex"
+    )
+    parser.add_argument(
+        "--noflush", action="store_true", help="no flush after write() call"
+    )
+    parser.add_argument(
+        "--noreset", action="store_true", help="no reset after write() call"
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+def send_msg(wfile, msg):
+    """write one length prefixed JSON message"""
+    body = json.dumps(msg, separators=(",", ":")).encode()
+    wfile.write(HEADER.pack(len(body)) + body)
+    wfile.flush()
+
+
+def recv_msg(rfile):
+    """read one length prefixed JSON message, None on end of stream"""
+    head = rfile.read(HEADER.size)
+    if len(head) < HEADER.size:
+        return None
+    (size,) = HEADER.unpack(head)
+    body = rfile.read(size)
+    if len(body) < size:
+        return None
+    return json.loads(body)
+
+
+class BusOwner(threading.Thread):
+    """thread owning one serial port; runs submitted calls one at a time"""
+
+    def __init__(self, port, optlist):
+        super().__init__(name=f"bus {port}", daemon=True)
+        self.port = port
+        self.optlist = optlist
+        self.ser = serial.Serial()
+        self.ser.port = port
+        self.ser.baudrate = optlist.baudrate
+        self.ser.timeout = float(optlist.timeout)
+        self.ser.open()
+        self.calls = queue.Queue()
+
+    def submit(self, fn, *args):
+        """queue fn(*args) for the bus thread, returns a Future"""
+        future = Future()
+        self.calls.put((future, fn, args))
+        return future
+
+    def run(self):
+        while True:
+            future, fn, args = self.calls.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as exc:
+                future.set_exception(exc)
+        self.ser.close()
+
+    def stop(self):
+        self.calls.put((None, None, None))
+
+    def xfer(self, frame):
+        """one request/reply exchange without retries, returns (resp, dt)"""
+        resp, dt = mks974.exchange(
+            frame, self.optlist, self.ser, float(self.optlist.timeout)
+        )
+        return (b"" if resp is None else bytes(resp)), dt
+
+    def transact(self, frame, label):
+        """full transaction with retries"""
+        return mks974.transact(frame, self.optlist, self.ser, label)
+
+
+class GaugeRequestHandler(socketserver.StreamRequestHandler):
+    """serve the requests of one client connection"""
+
+    def handle(self):
+        while True:
+            msg = recv_msg(self.rfile)
+            if msg is None:
+                return
+            try:
+                self.dispatch(msg)
+            except (KeyError, ValueError, TypeError) as exc:
+                send_msg(self.wfile, {"error": f"bad request {msg}: {exc!r}"})
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+    def bus(self, msg):
+        bus = self.server.buses.get(msg["port"])
+        if bus is None:
+            raise KeyError(f"port {msg['port']} is not served")
+        return bus
+
+    def dispatch(self, msg):
+        op = msg["op"]
+        if op == "xfer":
+            bus = self.bus(msg)
+            frame = msg["frame"].encode("latin-1")
+            resp, dt = self.server.exchange(bus, frame)
+            send_msg(self.wfile, {"resp": resp.decode("latin-1"), "dt": dt})
+        elif op in ("query", "cmd", "transact"):
+            bus = self.bus(msg)
+            if op == "query":
+                frame = mks974.encode_query(msg["id"], msg["query"])
+            elif op == "cmd":
+                frame = mks974.encode_cmd(msg["id"], msg["cmd"])
+            else:
+                frame = msg["frame"].encode("latin-1")
+            res = self.server.transact(bus, frame, msg.get(op, msg.get("label")))
+            send_msg(self.wfile, res._asdict())
+        elif op == "subscribe":
+            self.subscribe(msg)
+        elif op == "ports":
+            send_msg(self.wfile, {"ports": list(self.server.buses)})
+        elif op == "stats":
+            cache = self.server.cache
+            send_msg(self.wfile, {} if cache is None else cache.stats())
+        else:
+            raise ValueError(f"unknown op {op}")
+
+    def subscribe(self, msg):
+        """poll msg["ids"] every period and stream samples, then {"end": true}"""
+        bus = self.bus(msg)
+        frames = [(gid, mks974.encode_query(gid, msg["query"])) for gid in msg["ids"]]
+        period = float(msg.get("period", 1.0))
+        count = msg.get("count")
+        nn = 0
+        while count is None or nn < count:
+            t0 = time.monotonic()
+            for gid, frame in frames:
+                res, dt, retries, errcnt = self.server.transact(
+                    bus, frame, msg["query"]
+                )
+                sample = mks974.Sample(
+                    time.time(), bus.port, gid, mks974.parse_value(res), dt, retries
+                )
+                send_msg(self.wfile, sample._asdict())
+            nn += 1
+            elapsed = time.monotonic() - t0
+            if period > elapsed:
+                time.sleep(period - elapsed)
+        send_msg(self.wfile, {"end": True})
+
+
+class GaugeServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, buses, cache=None):
+        self.buses = buses
+        self.cache = cache
+        super().__init__(path, GaugeRequestHandler)
+
+    def exchange(self, bus, frame):
+        """raw exchange on bus, never cached: its caller times the bus"""
+        self.invalidate(bus.port, frame)
+        return bus.submit(bus.xfer, frame).result()
+
+    def transact(self, bus, frame, label):
+        """transaction with retries, query results may come from the cache"""
+        name = mksCache.query_name(frame)
+        if self.cache is None or name is None:
+            self.invalidate(bus.port, frame)
+            return bus.submit(bus.transact, frame, label).result()
+        res = self.cache.get(
+            ("query", bus.port, frame),
+            self.cache.ttl(name),
+            lambda: bus.submit(bus.transact, frame, label).result(),
+            keep=lambda res: res.result is not None,
+        )
+        if res.result is None:
+            # the gauge at this address may have been swapped: ask SN again
+            self.cache.invalidate(
+                lambda key: key[1] == bus.port and key[2][1:4] == frame[1:4]
+            )
+        return res
+
+    def invalidate(self, port, frame):
+        """drop cached queries a command frame may change"""
+        name = mksCache.command_name(frame)
+        if self.cache is None or name is None:
+            return
+        if name in ("AD", "BR"):  # the gauge moves, forget the whole bus
+            self.cache.invalidate(lambda key: key[1] == port)
+        else:
+            self.cache.invalidate(
+                lambda key: key[1] == port
+                and key[2][1:4] == frame[1:4]
+                and mksCache.query_name(key[2]) == name
+            )
+
+
+class GaugeClient:
+    """connection to a gauge server"""
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile("rb")
+        self.wfile = self.sock.makefile("wb")
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+    def request(self, msg):
+        send_msg(self.wfile, msg)
+        resp = recv_msg(self.rfile)
+        if resp is None:
+            raise ServerError("connection closed by server")
+        if "error" in resp:
+            raise ServerError(resp["error"])
+        return resp
+
+    def ports(self):
+        return self.request({"op": "ports"})["ports"]
+
+    def stats(self):
+        return self.request({"op": "stats"})
+
+    def xfer(self, port, frame):
+        """one raw exchange, returns (resp bytes, dt)"""
+        msg = {"op": "xfer", "port": port, "frame": frame.decode("latin-1")}
+        resp = self.request(msg)
+        return resp["resp"].encode("latin-1"), resp["dt"]
+
+    def transact(self, port, frame, label=None):
+        """transaction with retries of a raw request frame, returns a Transaction"""
+        msg = {"op": "transact", "port": port, "frame": frame.decode("latin-1")}
+        if label is not None:
+            msg["label"] = label
+        return mks974.Transaction(**self.request(msg))
+
+    def query(self, port, gid, query):
+        msg = {"op": "query", "port": port, "id": gid, "query": query}
+        return mks974.Transaction(**self.request(msg))
+
+    def cmd(self, port, gid, cmd):
+        msg = {"op": "cmd", "port": port, "id": gid, "cmd": cmd}
+        return mks974.Transaction(**self.request(msg))
+
+    def subscribe(self, port, ids, query="PR4", period=1.0, count=None):
+        """generator of Samples polled by the server"""
+        msg = {
+            "op": "subscribe",
+            "port": port,
+            "ids": list(ids),
+            "query": query,
+            "period": period,
+            "count": count,
+        }
+        send_msg(self.wfile, msg)
+        while True:
+            resp = recv_msg(self.rfile)
+            if resp is None:
+                raise ServerError("connection closed by server")
+            if "error" in resp:
+                raise ServerError(resp["error"])
+            if resp.get("end"):
+                return
+            yield mks974.Sample(**resp)
+
+
+class RemotePort:
+    """serial.Serial look-alike forwarding each write/read pair to the server
+
+    Lets the tools keep their own request/retry loops; the server performs
+    the exchange (including any RS485 echo handling) on the real port.
+    mks974.transact() hands whole transactions to transact() instead, so
+    the server can answer queries from its cache.
+    """
+
+    def __init__(self, path, port, timeout):
+        self.client = GaugeClient(path)
+        self.port = port
+        self.timeout = timeout
+        self.pending = None
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self.pending = bytes(data)
+        return len(data)
+
+    def read_until(self, expected=mks974.TERM, size=None):
+        if self.pending is None:
+            return b""
+        frame, self.pending = self.pending, None
+        resp, dt = self.client.xfer(self.port, frame)
+        return resp
+
+    def transact(self, frame, label=None):
+        label = None if label is None else str(label)
+        return self.client.transact(self.port, bytes(frame), label)
+
+    def close(self):
+        self.client.close()
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    buses = {port: BusOwner(port, optlist) for port in optlist.port}
+    for bus in buses.values():
+        bus.start()
+    if os.path.exists(optlist.socket):
+        os.unlink(optlist.socket)
+    cache = None if optlist.nocache else mksCache.QueryCache()
+    server = GaugeServer(optlist.socket, buses, cache)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"serving {list(buses)} on {optlist.socket}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(optlist.socket)
+        for bus in buses.values():
+            bus.stop()
+            bus.join()
+    if cache is not None:
+        print(f"cache: {cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
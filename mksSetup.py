@@ -13,12 +13,15 @@ import time
 import logging
 import warnings
 import re
-import numpy as np
-from astropy import stats
-from astropy.utils.exceptions import AstropyWarning
+import json
+import math
+import mks974
+import mksMeta
 
+SETTLE_POLL = 0.05  # s between read backs while settings settle
 
-def parse_args():
+
+def parse_args(argv=None):
     """handle command line"""
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -32,21 +35,13 @@ def parse_args():
                                """
         ),
     )
-    parser.add_argument(
-        "--port",
-        nargs="?",
-        default="/dev/ttyS0",
-        const="/dev/ttyS0",
-        help="serial port to open",
-    )
-    parser.add_argument(
-        "--baudrate",
-        nargs="?",
-        type=int,
-        default=9600,
-        const=9600,
-        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
-    )
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_arguments(parser):
+    """options of the tool, also those of its hwutils subcommand"""
+    mks974.add_port_arguments(parser)
     parser.add_argument(
         "--id",
         nargs="?",
@@ -55,6 +50,12 @@ def parse_args():
         const=1,
         help="RS485 id:{1..253}",
     )
+    parser.add_argument(
+        "--ids",
+        nargs="+",
+        type=int,
+        help="RS485 ids:{1..253} of every gauge on the bus (bus-wide modes)",
+    )
     parser.add_argument(
         "--count",
         nargs="?",
@@ -70,14 +71,6 @@ def parse_args():
         const=1.0,
         help="delay between queries",
     )
-    parser.add_argument(
-        "--timeout",
-        nargs="?",
-        type=float,
-        default=0.1,
-        const=0.1,
-        help="timeout for read()",
-    )
     # commands
     parser.add_argument(
         "--setid",
@@ -123,21 +116,40 @@ def parse_args():
         help="set the CC/MP smoothing boundary (>1e-4)",
     )
     parser.add_argument(
-        "--serialonly", action="store_true", help="print serial number and exit"
+        "--desired",
+        metavar="file",
+        help="bring the gauge to the json desired state in file (diff and apply) and exit",
     )
     parser.add_argument(
-        "--loopback", action="store_true", help="connection is RS485 half duplex"
+        "--settle",
+        nargs="?",
+        type=float,
+        default=1.0,
+        const=1.0,
+        help="longest wait (s) for changed settings to read back [1.0]",
     )
     parser.add_argument(
-        "--noflush", action="store_true", help="no flush after write() call"
+        "--upgradebus",
+        metavar="baudrate",
+        type=int,
+        help="move every --ids gauge from --baudrate to this rate and exit",
+    )
+    parser.add_argument(
+        "--ratecount",
+        nargs="?",
+        type=int,
+        default=20,
+        const=20,
+        help="PR4 polls of every gauge to measure reads/sec [20]",
     )
     parser.add_argument(
-        "--noreset", action="store_true", help="no reset after write() call"
+        "--serialonly", action="store_true", help="print serial number and exit"
     )
     parser.add_argument(
-        "--debug", action="store_true", help="print additional debugging messages"
+        "--nocache",
+        action="store_true",
+        help="do not use the persistent gauge metadata cache",
     )
-    return parser.parse_args()
 
 
 def init_logging(debug):
@@ -153,147 +165,302 @@ def init_logging(debug):
 
 def init_warnings():
     """Block warnings from Astropy"""
+    from astropy.utils.exceptions import AstropyWarning
+
     warnings.simplefilter("ignore", category=AstropyWarning)
 
 
-def query_and_response(query, optlist, ser):
-    """send command and return response"""
-    dt0 = 0.0
-    retries = 0
-    max_retries = 5
-    query_str = f"@{optlist.id:03d}{query}?;FF"
-    query_bts = bytes(query_str, "utf-8")
-    errcnt = 0
-    result = None
-    # nn = 0
-    if optlist.debug:
-        logging.debug(f"query_bts={query_bts}")
-
-    while retries < max_retries:
-        if not optlist.noreset:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-        start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        ser.write(query_bts)
-        if not optlist.noflush:
-            ser.flush()
-        resp = ser.read_until(expected=b";FF", size=None)
-        end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        dt = (end_ns - start_ns) * 1e-9
-
-        if optlist.loopback:  # RS485 query echo -> read again
-            query_echo = resp
-            query_dt = dt
-            if re.match(f"@{optlist.id:03d}{query}\?;FF", resp.decode()):
-                ser.timeout = float(optlist.timeout) - query_dt
-                resp = ser.read_until(expected=b";FF", size=None)
-                end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                dt = (end_ns - start_ns) * 1e-9
-                logging.debug(f"query echo={query_echo} dt={query_dt:>.3f}")
-            else:
-                logging.warning(f"echo failed: {query_echo} dt={query_dt:>.3f}")
-
-        # check the reply is valid
-        if re.match(r"@...ACK.*;FF", resp.decode()):
-            dt = dt0 + dt
-            result = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
-            logging.debug(f"resp={resp} dt={dt:>.3f}")
-            break
-        elif retries < max_retries and dt >= ser.timeout:  # retry
-            # print(f"{resp}")
-            dt0 = dt
-            retries += 1
-        else:
-            dt = dt0 + dt
-            logging.warning(
-                "failed at trial %d: query=%s  resp=%s, dt=%.3f",
-                retries,
-                query,
-                resp,
-                dt,
-            )
-            errcnt += 1
-            break
-    return result, dt, retries, errcnt
-
-
-def cmd_and_response(cmd, optlist, ser):
-    """send command and return response"""
-    dt0 = 0.0
-    retries = 0
-    max_retries = 5
-    cmd_str = f"@{optlist.id:03d}{cmd};FF"
-    cmd_bts = bytes(cmd_str, "utf-8")
-    errcnt = 0
-    result = None
-    if optlist.debug:
-        logging.debug(f"cmd_bts={cmd_bts}")
-
-    while retries < max_retries:
-        if not optlist.noreset:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-        start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        ser.write(cmd_bts)
-        if not optlist.noflush:
-            ser.flush()
-        resp = ser.read_until(expected=b";FF", size=None)
-        end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-        dt = (end_ns - start_ns) * 1e-9
-
-        if optlist.loopback:  # RS485 cmd echo -> read again
-            cmd_echo = resp
-            cmd_dt = dt
-            if re.match(f"@{optlist.id:03d}{cmd};FF", resp.decode()):
-                ser.timeout = float(optlist.timeout) - cmd_dt
-                resp = ser.read_until(expected=b";FF", size=None)
-                end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                dt = (end_ns - start_ns) * 1e-9
-                logging.debug(f"cmd echo={cmd_echo} dt={cmd_dt:>.3f}")
-            else:
-                logging.warning(f"echo failed: {cmd_echo} dt={cmd_dt:>.3f}")
-
-        # check the reply is valid
-        if re.match(r"@...ACK.*;FF", resp.decode()):
-            dt = dt0 + dt
-            result = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
-            logging.debug(f"resp={resp} dt={dt:>.3f}")
-            break
-        elif retries < max_retries and dt >= ser.timeout:  # retry
-            # print(f"{resp}")
-            dt0 = dt
-            retries += 1
+def load_desired(path):
+    """desired state of a gauge from a json file
+
+    {"relays": {"1": {"enable": "ON", "setpoint": 1e-5, "direction": "BELOW"}},
+     "usertag": "CHAMBER", "ccenable": "ON", "ccon": 2e-4, "ccoff": 6e-4,
+     "ccprotection": 60, "ccsmoothing": 1e-3}
+    Every key is optional.
+    """
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def desired_settings(state):
+    """[(setting, value)] of a desired state in the order they are applied
+
+    Values are validated like the command line options and formatted as the
+    gauge reports them. A relay gets its setpoint and direction before it is
+    enabled so it never switches on a stale setpoint.
+    """
+    settings = []
+    for rid, relay in sorted(state.get("relays", {}).items()):
+        rid = int(rid)
+        if rid not in {1, 2, 3}:
+            raise ValueError(f"relayid {rid} not in allowed set {1,2,3}")
+        if "setpoint" in relay:
+            rsp = float(relay["setpoint"])
+            if rsp < 1e-8 or rsp > 500:
+                raise ValueError(f"relay setpoint:{rsp} must be in range (2E-8, 500)")
+            settings.append((f"SP{rid}", f"{rsp:.2E}"))
+        if "direction" in relay:
+            rdir = relay["direction"].upper()
+            if rdir not in ("BELOW", "ABOVE"):
+                raise ValueError(f"relay direction ({rdir}) must be BELOW or ABOVE")
+            settings.append((f"SD{rid}", rdir))
+        if "enable" in relay:
+            ren = relay["enable"].upper()
+            if ren not in ("OFF", "ON"):
+                raise ValueError(f"relay enable ({ren}) must be OFF OR ON")
+            settings.append((f"EN{rid}", ren))
+    if "usertag" in state:
+        settings.append(("UT", str(state["usertag"]).upper()))
+    if "ccenable" in state:
+        cen = state["ccenable"].upper()
+        if cen not in ("OFF", "ON"):
+            raise ValueError(f"ccenable ({cen}) must be OFF OR ON")
+        settings.append(("ENC", cen))
+    if "ccon" in state:
+        ccn = float(state["ccon"])
+        if ccn < 1e-4 or ccn > 5e-4:
+            raise ValueError(f"CCAuto On setpoint:{ccn} must be in range (1e-4, 5e-4)")
+        settings.append(("SLC", f"{ccn:.2E}"))
+    if "ccoff" in state:
+        ccf = float(state["ccoff"])
+        if ccf < 5e-4 or ccf > 8e-4:
+            raise ValueError(f"CCAuto Off setpoint:{ccf} must be in range (5e-4, 8e-4)")
+        settings.append(("SHC", f"{ccf:.2E}"))
+    if "ccprotection" in state:
+        pro = int(state["ccprotection"])
+        if pro < 10 or pro > 120:
+            raise ValueError(f"CC protection setpoint:{pro} must be in range (10, 120)")
+        settings.append(("PRO", f"{pro}"))
+    if "ccsmoothing" in state:
+        ccs = float(state["ccsmoothing"])
+        if ccs <= 1e-4:
+            raise ValueError(f"CC/MP smoothing boundary:{ccs} must be > 1e-4")
+        settings.append(("SLP", f"{ccs:.2E}"))
+    return settings
+
+
+def same_setting(want, have):
+    """True if the gauge value have matches want (numbers to 3 digits)"""
+    if have is None:
+        return False
+    want_value = mks974.parse_value(want)
+    have_value = mks974.parse_value(have)
+    if want_value is not None and have_value is not None:
+        return math.isclose(want_value, have_value, rel_tol=5e-3)
+    return want.upper() == have.upper()
+
+
+def read_settings(names, optlist, ser):
+    """{name: value} read from the gauge itself, never from the cache"""
+    return {name: mks974.query_and_response(name, optlist, ser).result for name in names}
+
+
+def apply_desired(settings, optlist, ser, meta):
+    """read, diff and apply settings, returns a result dict
+
+    Only the settings that differ are sent, all inside one FD!UNLOCK /
+    FD!LOCK window. Instead of a fixed settling delay the changed settings
+    are read back every SETTLE_POLL seconds until they match or --settle
+    seconds have passed. An already correct gauge costs only the read pass.
+    The result holds ok, diff [(name, before, wanted)], failed [names],
+    commands and elapsed.
+    """
+    t0 = time.monotonic()
+    label = f"{optlist.port}:{optlist.id:03d}"
+    current = read_settings([name for name, want in settings], optlist, ser)
+    unread = [name for name, want in settings if current[name] is None]
+    result = {"ok": not unread, "diff": [], "failed": unread, "commands": 0}
+    if unread:
+        logging.error(f"{label} cannot read {unread}, nothing changed")
+        result["elapsed"] = time.monotonic() - t0
+        return result
+    diff = [
+        (name, current[name], want)
+        for name, want in settings
+        if not same_setting(want, current[name])
+    ]
+    result["diff"] = diff
+    if diff:
+        res = meta.cmd_and_response("FD!UNLOCK", optlist, ser)
+        if res.result is None:
+            logging.error(f"{label} refused FD!UNLOCK, nothing changed")
+            result.update(ok=False, failed=[name for name, have, want in diff])
+            result["elapsed"] = time.monotonic() - t0
+            return result
+        for name, have, want in diff:
+            res = meta.cmd_and_response(f"{name}!{want}", optlist, ser)
+            result["commands"] += 1
+            if res.result is None:
+                logging.error(f"{label} did not accept {name}!{want}")
+        meta.cmd_and_response("FD!LOCK", optlist, ser)
+        # settle: read back what changed until it matches
+        pending = {name: want for name, have, want in diff}
+        deadline = time.monotonic() + optlist.settle
+        while pending:
+            readback = read_settings(pending, optlist, ser)
+            for name, value in readback.items():
+                if same_setting(pending[name], value):
+                    del pending[name]
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            time.sleep(min(SETTLE_POLL, remaining))
+        result["failed"] = sorted(pending)
+        result["ok"] = not pending
+    result["elapsed"] = time.monotonic() - t0
+    return result
+
+
+def format_apply(label, result):
+    """text lines of an apply_desired() result"""
+    lines = []
+    for name, have, want in result["diff"]:
+        state = "FAILED" if name in result["failed"] else "ok"
+        lines.append(f"{label} {name}: {have} -> {want} {state}")
+    if not result["diff"] and result["ok"]:
+        lines.append(f"{label} already in the desired state")
+    lines.append(
+        f"{label} {'ok' if result['ok'] else 'FAILED'}: {len(result['diff'])} changed,"
+        f" {result['commands']} commands in {result['elapsed']:.3f}s"
+    )
+    return lines
+
+
+def bus_rate(ids, optlist, ser, count):
+    """PR4 reads/sec measured over `count` polls of every gauge in ids"""
+    reads = 0
+    t0 = time.monotonic()
+    for nn in range(count):
+        for gid in ids:
+            res = mks974.query_gauge(gid, "PR4", optlist, ser)
+            reads += res.result is not None
+    return reads / (time.monotonic() - t0)
+
+
+def bus_serials(ids, optlist, ser):
+    """{id: SN} of the gauges answering at the current rate"""
+    sns = dict()
+    for gid in ids:
+        res = mks974.query_gauge(gid, "SN", optlist, ser)
+        if res.result is not None:
+            sns[gid] = res.result
+    return sns
+
+
+def rollback_bus(ids, sns, attempted, old, new, optlist, ser):
+    """put the gauges in attempted back to the old rate, True if all answer"""
+    logging.warning(f"rolling back {len(attempted)} gauges to {old} baud")
+    mks974.reopen_port(ser, new)
+    for gid in attempted:
+        mks974.cmd_gauge(gid, "FD!UNLOCK", optlist, ser)
+        mks974.cmd_gauge(gid, f"BR!{old}", optlist, ser)
+    time.sleep(float(0.2))
+    mks974.reopen_port(ser, old)
+    found = bus_serials(ids, optlist, ser)
+    ok = True
+    for gid in ids:
+        if found.get(gid) != sns[gid]:
+            logging.error(f"gauge {gid:03d} SN:{sns[gid]} lost, rate unknown")
+            ok = False
         else:
-            dt = dt0 + dt
-            logging.warning(
-                "failed at trial %d: cmd=%s  resp=%s, dt=%.3f",
-                retries,
-                cmd,
-                resp,
-                dt,
-            )
-            errcnt += 1
-            break
-    return result, dt, retries, errcnt
-
-
-def main():
+            mks974.cmd_gauge(gid, "FD!LOCK", optlist, ser)
+    return ok
+
+
+def upgrade_bus(optlist, ser, cache):
+    """move every gauge on the bus to a new baud rate, rolling back on failure
+
+    All gauges must answer at the current rate first. Each one is unlocked
+    and sent BR!rate (it acknowledges at the old rate), then the port is
+    reopened at the new rate and every SN is verified before locking.
+    """
+    old = optlist.baudrate
+    new = optlist.upgradebus
+    ids = optlist.ids or [optlist.id]
+    if new not in mks974.BAUDRATES:
+        logging.error(f"baud rate {new} not in {mks974.BAUDRATES}")
+        return False
+    if optlist.server:
+        logging.error("--upgradebus needs direct access to the port, not --server")
+        return False
+
+    sns = bus_serials(ids, optlist, ser)
+    missing = [gid for gid in ids if gid not in sns]
+    if missing:
+        logging.error(f"gauges {missing} do not answer at {old} baud, nothing changed")
+        return False
+    before = bus_rate(ids, optlist, ser, optlist.ratecount)
+    print(f"{optlist.port} gauges {ids} at {old} baud: {before:.1f} reads/sec")
+
+    attempted = []
+    for gid in ids:
+        if cache is not None:
+            cache.invalidate(optlist.port, gid)
+        res = mks974.cmd_gauge(gid, "FD!UNLOCK", optlist, ser)
+        if res.result is None:
+            logging.error(f"gauge {gid:03d} SN:{sns[gid]} refused FD!UNLOCK")
+            rollback_bus(ids, sns, attempted, old, new, optlist, ser)
+            return False
+        attempted.append(gid)
+        res = mks974.cmd_gauge(gid, f"BR!{new}", optlist, ser)
+        if res.result is None:
+            logging.error(f"gauge {gid:03d} SN:{sns[gid]} did not accept BR!{new}")
+            rollback_bus(ids, sns, attempted, old, new, optlist, ser)
+            return False
+        print(f"gauge {gid:03d} SN:{sns[gid]} BaudRate set to {res.result}")
+    time.sleep(float(0.2))
+
+    mks974.reopen_port(ser, new)
+    found = bus_serials(ids, optlist, ser)
+    bad = [gid for gid in ids if found.get(gid) != sns[gid]]
+    if bad:
+        logging.error(f"gauges {bad} do not answer with their SN at {new} baud")
+        rollback_bus(ids, sns, attempted, old, new, optlist, ser)
+        return False
+    for gid in ids:
+        mks974.cmd_gauge(gid, "FD!LOCK", optlist, ser)
+    optlist.baudrate = new
+    after = bus_rate(ids, optlist, ser, optlist.ratecount)
+    print(f"{optlist.port} gauges {ids} at {new} baud: {after:.1f} reads/sec")
+    print(f"speedup: {after / before:.2f}x, use --baudrate {new} from now on")
+    return True
+
+
+def main(optlist=None):
     """main logic"""
-    optlist = parse_args()
+    if optlist is None:
+        optlist = parse_args()
     init_logging(optlist.debug)
     # init_warnings()
 
-    ser = serial.Serial()
-    ser.port = optlist.port
-    ser.baudrate = optlist.baudrate
-    ser.timeout = float(optlist.timeout)
-    ser.open()
+    ser = mks974.open_port(optlist)
+    cache = None if optlist.nocache else mksMeta.MetadataCache()
+    if optlist.upgradebus:
+        ok = upgrade_bus(optlist, ser, cache)
+        ser.close()
+        if cache is not None:
+            cache.close()
+        sys.exit(0 if ok else 1)
+    meta = mksMeta.GaugeMetadata(optlist, ser, cache)
+    if optlist.desired:
+        try:
+            settings = desired_settings(load_desired(optlist.desired))
+        except (OSError, ValueError) as exc:
+            logging.error(f"desired state {optlist.desired}: {exc}")
+            sys.exit(1)
+        result = apply_desired(settings, optlist, ser, meta)
+        ser.close()
+        if cache is not None:
+            cache.close()
+        for line in format_apply(f"{optlist.port}:{optlist.id:03d}", result):
+            print(line)
+        sys.exit(0 if result["ok"] else 1)
     relayid = None
 
     # -- prepare meta data
     print("#---------- MKS Gauge Report ----")
     qry = "SN"  # serial number
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"SerialNumber: {res}")
     if optlist.serialonly:
         exit()
@@ -301,11 +468,11 @@ def main():
     # run commands
     # unlock the system
     cmd = f"FD!UNLOCK"
-    res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+    res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
     cmdcnt = 0
     if optlist.setid:
         cmd = f"AD!{int(optlist.setid):03d}"  # set the RS485 address
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"SetID result: {res}", end="")
         cmdcnt += 1
         exit()  # cmd fails after the change
@@ -331,19 +498,19 @@ def main():
                 logging.error(f"relay setpoint:{rsp} must be in range (2E-8, 500)")
                 return
             cmd = f"EN{rid:d}!{ren}"  # set the relay1 setpoint
-            res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+            res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
             print(f"relay {rid} enable is set to {res}")
             cmdcnt += 1
             time.sleep(float(0.2))
             #
             cmd = f"SP{rid:d}!{rsp:.2E}"  # set the relay1 setpoint
-            res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+            res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
             print(f"relay {rid} setpoint is set to {res}")
             cmdcnt += 1
             time.sleep(float(0.2))
             #
             cmd = f"SD{rid:d}!{rdir}"  # set the relay1 direction
-            res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+            res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
             print(f"relay {rid} direction set to {res}")
             cmdcnt += 1
             time.sleep(float(0.2))
@@ -351,7 +518,7 @@ def main():
     if optlist.setusertag:
         uval = optlist.setusertag[0].upper()
         cmd = f"UT!{uval}"  # set the relay1 direction
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"usertag:{res} is set")
         cmdcnt += 1
         time.sleep(float(0.2))
@@ -362,7 +529,7 @@ def main():
             logging.error(f"ccenable ({cen}) must be OFF OR ON")
             return
         cmd = f"ENC!{cen}"  # set Auto CC
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"CCenable is set to {res}")
         cmdcnt += 1
         time.sleep(float(0.2))
@@ -373,7 +540,7 @@ def main():
             logging.error(f"CCAuto On setpoint:{ccn} must be in range (1e-4, 5e-4)")
             return
         cmd = f"SLC!{ccn:.2E}"  # set the CCAuto On
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"CCAuto On setpoint is set to {res}")
         cmdcnt += 1
         time.sleep(float(0.2))
@@ -384,7 +551,7 @@ def main():
             logging.error(f"CCAuto Off setpoint:{ccf} must be in range (5e-4, 8e-4)")
             return
         cmd = f"SHC!{ccf:.2E}"  # set the CCAuto On
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"CCAuto Off setpoint is set to {res}")
         cmdcnt += 1
         time.sleep(float(0.2))
@@ -395,7 +562,7 @@ def main():
             logging.error(f"CC protection setpoint:{pro} must be in range (10, 120)")
             return
         cmd = f"PRO!{pro}"  # set the CC protection set point (seconds)
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"CC protection setpoint is set to {res}")
         cmdcnt += 1
         time.sleep(float(0.2))
@@ -406,101 +573,101 @@ def main():
             logging.error(f"CCAuto On setpoint:{ccs} must be in range (1e-4, 5e-4)")
             return
         cmd = f"SLP!{ccs:.2E}"  # set the CC/MP smoothing boundary
-        res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+        res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
         print(f"CC smoothing setpoint is set to {res}")
         cmdcnt += 1
         time.sleep(float(0.2))
 
     # lock the system
     cmd = f"FD!LOCK"
-    res, dt, rt, ercnt = cmd_and_response(cmd, optlist, ser)
+    res, dt, rt, ercnt = meta.cmd_and_response(cmd, optlist, ser)
 
     if cmdcnt:
         print(f"{cmdcnt} commands were executed")
 
     print("")
     qry = "PN"  # part number
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"PartNum: {res}")
 
     qry = "UT"  # user tag
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"UserTag: {res}")
 
     qry = "MD"  # model number
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Model: {res}")
 
     qry = "DT"  # device type
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"DeviceType: {res}")
 
     qry = "FV"  # firmware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Firmware: {res}")
 
     qry = "HV"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Hardware: {res}")
 
     qry = "AD"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Address: {res}")
 
     qry = "BR"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"BaudRate: {res}")
 
     qry = "RSD"  # hardware version
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"RecieveSendDelay: {res}")
 
     qry = "ENC"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"AutoCC: {res}")
 
     qry = "SLC"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCOnSetpoint: {res}")
 
     qry = "SHC"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCOffSetpoint: {res}")
 
     qry = "SLP"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CC/MP smoothing setpoint: {res}")
 
     qry = "PRO"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CC protection setpoint: {res} (sec > 5E-3)")
 
     qry = "TIM"  # time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"TimeOn: {res}")
 
     qry = "TIM2"  # Cold Cathode time on
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCTimeOn: {res}")
 
     qry = "TIM3"  # Cold Cathode dose
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"CCDose: {res}")
 
     qry = "PR4"  # comb pressure reading
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Combined Pressure: {res}")
 
     qry = "PR5"  # comb pressure reading
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"Cold Cathode Reading: {res}")
 
     qry = "TEM"  # trans status
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"temp: {float(res):.1f} C")
 
     qry = "T"  # trans status
-    res, dt, rt, ercnt = query_and_response(qry, optlist, ser)
+    res, dt, rt, ercnt = meta.query_and_response(qry, optlist, ser)
     print(f"status: {res}")
 
     print("")
@@ -509,25 +676,30 @@ def main():
     for a in range(1, 4):
 
         query = "EN{}".format(a)  # relay enabled?
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f"    R{a} enable: {res}", end="")
         #
         query = "SH{}".format(a)  # setpoint switch value
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f"    R{a} hysteresis: {res}", end="")
         #
         query = "SP{}".format(a)  # setpoint switch value
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f"    R{a} setPoint: {res}", end="")
         #
         query = "SD{}".format(a)  # setpoint direction value
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f" R{a} direction: {res}", end="")
         #
         query = "SS{}".format(a)  # status SET|CLEAR
-        res, dt, rt, ercnt = query_and_response(query, optlist, ser)
+        res, dt, rt, ercnt = meta.query_and_response(query, optlist, ser)
         print(f" R{a} status: {res}")
+    logging.debug(
+        f"setup used {meta.transactions} transactions, {meta.hits} cached values"
+    )
     ser.close()
+    if cache is not None:
+        cache.close()
 
 
 # cmd                   response        description
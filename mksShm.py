@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+"""
+Shared memory table of the latest reading of every (port, id) gauge
+
+One worker process per RS485 bus does the blocking serial I/O and writes
+its rows of a numpy structured array held in multiprocessing.shared_memory.
+Each row is guarded by a sequence counter (odd while being written) so any
+process attached to the table can take a consistent snapshot without
+asking the workers for anything.
+"""
+import sys
+import argparse
+import textwrap
+import time
+import logging
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+import mks974
+import mksCadence
+import mksRetry
+import mksTimeout
+
+HEADER_SIZE = 64  # int64 row count, padded to a cache line
+TABLE_DTYPE = np.dtype(
+    [
+        ("seq", "u8"),
+        ("port", "S64"),
+        ("gid", "i4"),
+        ("time", "f8"),
+        ("pressure", "f8"),
+        ("dt", "f8"),
+        ("dtsum", "f8"),
+        ("reads", "i8"),
+        ("retries", "i8"),
+        ("errors", "i8"),
+    ]
+)
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Print a snapshot of a gauge table published by
+           readAllPressure.py --bus ... --shmname NAME
+                                    """
+        ),
+    )
+    parser.add_argument("name", help="shared memory table name")
+    parser.add_argument(
+        "--count",
+        nargs="?",
+        type=int,
+        default=1,
+        help="number of snapshots",
+    )
+    parser.add_argument(
+        "--delay",
+        nargs="?",
+        type=float,
+        default=1.0,
+        const=1.0,
+        help="delay between snapshots",
+    )
+    return parser.parse_args()
+
+
+class GaugeTable:
+    """(port, id) rows of latest readings in shared memory"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        nrows = int(np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0])
+        self.table = np.ndarray(
+            (nrows,), dtype=TABLE_DTYPE, buffer=shm.buf, offset=HEADER_SIZE
+        )
+        self._seq = self.table["seq"]
+
+    @classmethod
+    def create(cls, gauges, name=None):
+        """new table with one row per (port, gid) in `gauges`"""
+        size = HEADER_SIZE + len(gauges) * TABLE_DTYPE.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        np.ndarray((1,), dtype=np.int64, buffer=shm.buf)[0] = len(gauges)
+        table = cls(shm, owner=True)
+        table.table[:] = 0
+        for row, (port, gid) in enumerate(gauges):
+            table.table["port"][row] = port.encode()
+            table.table["gid"][row] = gid
+            table.table["pressure"][row] = np.nan
+        return table
+
+    @classmethod
+    def attach(cls, name, untrack=True):
+        """attach to an existing table without taking ownership of it
+
+        Processes with their own resource tracker must untrack the segment
+        or it is unlinked when they exit; multiprocessing children share
+        the creator's tracker and pass untrack=False.
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def update(self, row, now, pressure, dt, retries, errors):
+        """single writer update of one row"""
+        tab = self.table
+        self._seq[row] += 1  # odd: write in progress
+        tab["time"][row] = now
+        if pressure is not None:
+            tab["pressure"][row] = pressure
+            tab["dt"][row] = dt
+            tab["dtsum"][row] += dt
+            tab["reads"][row] += 1
+        tab["retries"][row] += retries
+        tab["errors"][row] += errors
+        self._seq[row] += 1
+
+    def snapshot(self):
+        """consistent copy of every row"""
+        snap = self.table.copy()
+        while True:
+            seq = self._seq.copy()
+            stale = (snap["seq"] & 1).astype(bool) | (snap["seq"] != seq)
+            if not stale.any():
+                return snap
+            time.sleep(0)
+            snap[stale] = self.table[stale]
+
+    def close(self):
+        del self.table, self._seq
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def read_gauge(frame, gid, attempts, policy, optlist, ser, adaptive=None):
+    """one PR4 read of up to `attempts` tries spaced by policy
+
+    Returns (value or None, dt, retries, errors) like the single bus loop of
+    readAllPressure.py.
+    """
+    timeout = float(optlist.timeout)
+    dt0 = 0.0
+    retries = 0
+    while retries < attempts:
+        if retries:
+            backoff = policy.delay(retries)
+            if backoff > 0.0:
+                time.sleep(backoff)
+        if adaptive is not None:
+            timeout = adaptive.timeout(gid)
+        resp, dt = mks974.exchange(frame, optlist, ser, timeout)
+        reply = None if resp is None else mks974.parse_reply(resp)
+        if reply is not None and reply.ack:
+            if adaptive is not None:
+                adaptive.observe(gid, dt)
+            return mks974.parse_value(reply.payload), dt0 + dt, retries, 0
+        if resp is not None:
+            logging.warning(
+                "failed at trial %d: %s:%03d resp=%s, dt=%.3f",
+                retries,
+                optlist.port,
+                gid,
+                bytes(resp),
+                dt0 + dt,
+            )
+            return None, dt0 + dt, retries, 1
+        if adaptive is not None:
+            adaptive.expired(gid, dt)
+        dt0 = dt
+        retries += 1
+    return None, dt0, retries, 0
+
+
+def bus_worker(name, rows, port, ids, optlist):
+    """poll `ids` on `port` and publish each result to its table row
+
+    --retries, --backoff, --jitter, --breaker and --adaptive apply per bus
+    as in the single bus loop of readAllPressure.py.
+    """
+    table = GaugeTable.attach(name, untrack=False)
+    optlist.port = port  # the worker's own copy of the options
+    ser = mks974.open_port(optlist)
+    frames = [mks974.encode_query(gid, "PR4") for gid in ids]
+    adaptive = None
+    if getattr(optlist, "adaptive", False):
+        adaptive = mksTimeout.AdaptiveTimeout(float(optlist.timeout))
+    policy = mksRetry.RetryPolicy(optlist.retries, optlist.backoff, jitter=optlist.jitter)
+    breaker = None
+    if optlist.breaker:
+        breaker = mksRetry.CircuitBreaker(optlist.breaker, optlist.probe)
+    try:
+        cadence = mksCadence.Cadence(optlist.delay)
+        for nn, due in cadence.slots(int(optlist.count)):
+            for row, gid, frame in zip(rows, ids, frames):
+                if breaker is not None and not breaker.allow(gid, time.monotonic()):
+                    continue
+                attempts = policy.retries
+                if breaker is not None:
+                    attempts = breaker.attempts(gid, policy)
+                value, dt, retries, errcnt = read_gauge(
+                    frame, gid, attempts, policy, optlist, ser, adaptive
+                )
+                table.update(row, time.time(), value, dt, retries, errcnt)
+                if breaker is not None:
+                    if value is not None:
+                        breaker.success(gid, time.monotonic())
+                    else:
+                        breaker.failure(gid, time.monotonic())
+    finally:
+        ser.close()
+        table.close()
+
+
+def run_workers(buses, optlist, name=None):
+    """start one worker per (port, ids) bus, returns (table, processes)"""
+    gauges = [(port, gid) for port, ids in buses for gid in ids]
+    table = GaugeTable.create(gauges, name)
+    procs = []
+    row = 0
+    for port, ids in buses:
+        rows = list(range(row, row + len(ids)))
+        row += len(ids)
+        proc = multiprocessing.Process(
+            target=bus_worker,
+            args=(table.name, rows, port, ids, optlist),
+            name=f"bus {port}",
+        )
+        proc.start()
+        procs.append(proc)
+    return table, procs
+
+
+def print_snapshot(snap):
+    """one line per gauge"""
+    for rec in snap:
+        print(
+            f"{rec['port'].decode()}:{rec['gid']:03d} {rec['time']:.6f}"
+            f" {rec['pressure']:.3E} dt={rec['dt']:.4f} reads={rec['reads']}"
+            f" retries={rec['retries']} errors={rec['errors']}"
+        )
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    table = GaugeTable.attach(optlist.name)
+    try:
+        for nn in range(int(optlist.count)):
+            if nn:
+                time.sleep(float(optlist.delay))
+                print("")
+            print_snapshot(table.snapshot())
+    finally:
+        table.close()
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
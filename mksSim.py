@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+"""
+Simulate MKS 974B gauges on a pseudo-terminal RS485 bus
+
+Opens a pty pair and answers the 974B ASCII protocol on the slave side so
+readPressure.py, readAllPressure.py, mksReport.py and mksSetup.py can be run
+unchanged with --port pointing at the printed device.
+"""
+import os
+import sys
+import argparse
+import textwrap
+import time
+import logging
+import random
+import select
+import signal
+import termios
+import threading
+import tty
+
+import mks974
+
+# termios speed constant -> baud rate
+TERMIOS_BAUD = {
+    getattr(termios, f"B{br}"): br
+    for br in mks974.BAUDRATES
+    if hasattr(termios, f"B{br}")
+}
+
+PACE_CHUNK = 0.001  # s of wire time written at once, bytes go out at 10 bits/baud
+# NAK codes used by the 974B
+NAK_UNKNOWN = "160"  # unrecognized message
+NAK_ARGUMENT = "169"  # invalid argument
+NAK_RANGE = "172"  # value out of range
+NAK_LOCKED = "180"  # setup is locked (FD!LOCK)
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Serve simulated MKS 974B gauges on a pty, run the tools with
+           --port set to the printed device (or --link)
+                                    """
+        ),
+        epilog=textwrap.dedent(
+            """\
+           example: mksSim.py --ids 1 2 3 --link /tmp/ttyMKS0 --drop 0.01
+                               """
+        ),
+    )
+    parser.add_argument(
+        "--ids",
+        nargs="+",
+        type=int,
+        default=[1],
+        help="RS485 ids:{1..253} present on the bus",
+    )
+    parser.add_argument(
+        "--baudrate",
+        nargs="?",
+        type=int,
+        default=9600,
+        const=9600,
+        help="initial gauge baud rate 4800, [9600], ..., 230400",
+    )
+    parser.add_argument(
+        "--turnaround",
+        nargs="?",
+        type=float,
+        default=0.005,
+        const=0.005,
+        help="gauge turnaround delay (s) between request and reply",
+    )
+    parser.add_argument(
+        "--rsddelay",
+        nargs="?",
+        type=float,
+        default=0.010,
+        const=0.010,
+        help="extra turnaround (s) while the gauge RSD setting is ON",
+    )
+    parser.add_argument(
+        "--echo", action="store_true", help="echo requests (RS485 half duplex)"
+    )
+    parser.add_argument(
+        "--drop",
+        nargs="?",
+        type=float,
+        default=0.0,
+        help="probability a reply is dropped",
+    )
+    parser.add_argument(
+        "--truncate",
+        nargs="?",
+        type=float,
+        default=0.0,
+        help="probability a reply is truncated",
+    )
+    parser.add_argument(
+        "--nak",
+        nargs="?",
+        type=float,
+        default=0.0,
+        help="probability a valid request is answered with NAK",
+    )
+    parser.add_argument(
+        "--seed",
+        nargs="?",
+        type=int,
+        help="random seed for pressure noise and fault injection",
+    )
+    parser.add_argument(
+        "--link",
+        nargs="?",
+        help="create a symlink to the pty slave at this path",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="print additional debugging messages"
+    )
+    return parser.parse_args()
+
+
+def init_logging(debug):
+    """Set up debug and info level logging"""
+    if debug:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.DEBUG)
+    else:
+        logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+
+class SimGauge:
+    """state and protocol handling of one simulated 974B transducer"""
+
+    def __init__(self, gid, baudrate=9600, rng=None):
+        self.rng = rng if rng is not None else random.Random()
+        self.locked = True
+        self.pressure = 7.5e-6 * (1.0 + 0.1 * gid)
+        self.t_on = time.monotonic()
+        self.settings = {
+            "SN": f"{1900000 + gid:d}",
+            "PN": "974B-11330",
+            "MD": "974B",
+            "DT": "974",
+            "FV": "1.12",
+            "HV": "B",
+            "AD": f"{gid:03d}",
+            "BR": f"{baudrate:d}",
+            "RSD": "OFF",
+            "UT": "SIM",
+            "ENC": "ON",
+            "SLC": "2.00E-4",
+            "SHC": "6.00E-4",
+            "SLP": "1.00E-3",
+            "PRO": "60",
+        }
+        for rid in range(1, 4):
+            self.settings[f"EN{rid}"] = "OFF"
+            self.settings[f"SP{rid}"] = "1.00E-5"
+            self.settings[f"SD{rid}"] = "BELOW"
+            self.settings[f"SH{rid}"] = "1.10E-5"
+
+    @property
+    def gid(self):
+        return int(self.settings["AD"])
+
+    @property
+    def baudrate(self):
+        return int(self.settings["BR"])
+
+    @property
+    def rsd(self):
+        return self.settings["RSD"] == "ON"
+
+    def read_pressure(self):
+        """random walk around the base pressure"""
+        self.pressure *= 1.0 + self.rng.gauss(0.0, 0.002)
+        return self.pressure
+
+    def relay_status(self, rid):
+        """SET|CLEAR from relay enable, setpoint and direction"""
+        if self.settings[f"EN{rid}"] != "ON":
+            return "CLEAR"
+        below = self.pressure < float(self.settings[f"SP{rid}"])
+        if self.settings[f"SD{rid}"] == "ABOVE":
+            below = not below
+        return "SET" if below else "CLEAR"
+
+    def query(self, name):
+        """answer a query, returns (ack, payload)"""
+        if name in self.settings:
+            return True, self.settings[name]
+        if name == "PR4":
+            return True, f"{self.read_pressure():.2E}"
+        if name == "PR5":
+            prs = self.read_pressure()
+            return True, f"{prs:.2E}" if prs < 1e-2 else "LO<E-10"
+        if name == "TEM":
+            return True, f"{25.0 + self.rng.gauss(0.0, 0.2):.1f}"
+        if name == "T":
+            return True, "O"
+        if name in ("TIM", "TIM2"):
+            return True, f"{int(time.monotonic() - self.t_on) // 3600:d}"
+        if name == "TIM3":
+            return True, "1.00E-3"
+        if name in ("SS1", "SS2", "SS3"):
+            return True, self.relay_status(int(name[2]))
+        return False, NAK_UNKNOWN
+
+    def command(self, name, arg):
+        """execute a set command, returns (ack, payload)"""
+        if name == "FD":
+            if arg not in ("LOCK", "UNLOCK"):
+                return False, NAK_ARGUMENT
+            self.locked = arg == "LOCK"
+            return True, arg
+        if name not in self.settings or name in ("SN", "PN", "MD", "DT", "FV", "HV"):
+            return False, NAK_UNKNOWN
+        if self.locked:
+            return False, NAK_LOCKED
+        if name == "AD":
+            if not arg.isdigit() or not 1 <= int(arg) <= 253:
+                return False, NAK_RANGE
+            arg = f"{int(arg):03d}"
+        elif name == "BR":
+            if not arg.isdigit() or int(arg) not in mks974.BAUDRATES:
+                return False, NAK_RANGE
+        elif name in ("RSD", "ENC") or name[:2] == "EN":
+            if arg not in ("ON", "OFF"):
+                return False, NAK_ARGUMENT
+        elif name[:2] == "SD":
+            if arg not in ("BELOW", "ABOVE"):
+                return False, NAK_ARGUMENT
+        elif name != "UT":
+            try:
+                float(arg)
+            except ValueError:
+                return False, NAK_ARGUMENT
+        self.settings[name] = arg
+        return True, arg
+
+    def handle(self, body):
+        """dispatch a request body (frame without @id and ;FF)"""
+        if body.endswith("?"):
+            return self.query(body[:-1])
+        name, sep, arg = body.partition("!")
+        if not sep:
+            return False, NAK_UNKNOWN
+        return self.command(name, arg)
+
+
+class SimBus:
+    """pty backed RS485 bus with one or more simulated gauges"""
+
+    def __init__(
+        self,
+        ids,
+        baudrate=9600,
+        turnaround=0.005,
+        rsddelay=0.010,
+        echo=False,
+        drop=0.0,
+        truncate=0.0,
+        nak=0.0,
+        seed=None,
+    ):
+        self.rng = random.Random(seed)
+        self.gauges = [SimGauge(gid, baudrate, self.rng) for gid in ids]
+        self.turnaround = turnaround
+        self.rsddelay = rsddelay
+        self.echo = echo
+        self.drop = drop
+        self.truncate = truncate
+        self.nak = nak
+        self.stats = dict.fromkeys(
+            ("requests", "replies", "unanswered", "dropped", "truncated", "nak"), 0
+        )
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def gauge(self, gid):
+        for gauge in self.gauges:
+            if gauge.gid == gid:
+                return gauge
+        return None
+
+    def client_baudrate(self):
+        """baud rate the client configured on the slave side"""
+        return TERMIOS_BAUD.get(termios.tcgetattr(self.master)[4])
+
+    def transmit(self, data, not_before, baudrate):
+        """send data from not_before on, each byte when its 10 bits are on the wire
+
+        Bytes are written in chunks of about PACE_CHUNK so the first byte of
+        a reply arrives one byte time after it starts, as on the bus.
+        """
+        byte_time = 10.0 / baudrate
+        chunk = max(1, int(PACE_CHUNK / byte_time))
+        for pos in range(0, len(data), chunk):
+            part = data[pos : pos + chunk]
+            delay = not_before + (pos + len(part)) * byte_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.master, part)
+        return not_before + len(data) * byte_time
+
+    def respond(self, frame, t_rx):
+        """answer one complete request frame received at t_rx"""
+        self.stats["requests"] += 1
+        baudrate = self.client_baudrate() or 9600
+        # request occupies the wire until t_end (its echo arrives meanwhile)
+        t_end = t_rx + len(frame) * 10.0 / baudrate
+        if self.echo:
+            self.transmit(frame, t_rx, baudrate)
+        if len(frame) < 8 or not frame[1:4].isdigit():
+            self.stats["unanswered"] += 1
+            return
+        gauge = self.gauge(int(frame[1:4]))
+        if gauge is None or gauge.baudrate != baudrate:
+            self.stats["unanswered"] += 1
+            return
+        old_gid = gauge.gid
+        ack, payload = gauge.handle(frame[4:-3].decode("ascii", "replace"))
+        if ack and self.rng.random() < self.nak:
+            ack, payload = False, NAK_UNKNOWN
+            self.stats["nak"] += 1
+        reply = b"@%03d%s%s;FF" % (
+            old_gid,
+            b"ACK" if ack else b"NAK",
+            payload.encode(),
+        )
+        if self.rng.random() < self.drop:
+            self.stats["dropped"] += 1
+            logging.debug("dropped reply %s", reply)
+            return
+        if self.rng.random() < self.truncate:
+            reply = reply[: self.rng.randrange(1, len(reply) - 2)]
+            self.stats["truncated"] += 1
+        delay = self.turnaround + (self.rsddelay if gauge.rsd else 0.0)
+        self.transmit(reply, t_end + delay, baudrate)
+        self.stats["replies"] += 1
+        logging.debug("request %s reply %s", frame, reply)
+
+    def serve(self):
+        """process requests until stop() is called"""
+        buf = bytearray()
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                continue
+            t_rx = time.monotonic()
+            buf += data
+            while True:
+                end = buf.find(mks974.TERM)
+                if end < 0:
+                    break
+                start = buf.rfind(b"@", 0, end)
+                frame = bytes(buf[start if start >= 0 else 0 : end + 3])
+                del buf[: end + 3]
+                self.respond(frame, t_rx)
+            if len(buf) > 256:  # line noise without a terminator
+                buf.clear()
+
+    def start(self):
+        """serve in a daemon thread, returns the slave device path"""
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    init_logging(optlist.debug)
+    bus = SimBus(
+        optlist.ids,
+        baudrate=optlist.baudrate,
+        turnaround=optlist.turnaround,
+        rsddelay=optlist.rsddelay,
+        echo=optlist.echo,
+        drop=optlist.drop,
+        truncate=optlist.truncate,
+        nak=optlist.nak,
+        seed=optlist.seed,
+    )
+    port = bus.port
+    if optlist.link:
+        if os.path.islink(optlist.link):
+            os.unlink(optlist.link)
+        os.symlink(bus.port, optlist.link)
+        port = optlist.link
+    print(f"simulating 974B ids {optlist.ids} on {port}", flush=True)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        bus.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if optlist.link and os.path.islink(optlist.link):
+            os.unlink(optlist.link)
+    print("")
+    for key, val in bus.stats.items():
+        print(f"{key:>12s}: {val}")
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
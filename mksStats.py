@@ -0,0 +1,112 @@
+"""
+Streaming statistics of latency and pressure readings in constant memory
+
+RunningStats keeps the count, mean and variance (Welford's update), the
+exact min and max and a log-bucketed histogram in the manner of HDR
+histograms: a value x > 0 falls in bucket floor(log(x) / log(1 + precision)),
+so every bucket spans the same relative width and the number of buckets
+depends only on the dynamic range of the values, not on their number.
+Percentiles and the median are interpolated between bucket centres like
+numpy's default (linear) method and are within precision / 2 of the exact
+result; mean, std, min and max match numpy to rounding. Zero and negative
+values are kept in mirrored buckets.
+"""
+import math
+
+
+class RunningStats:
+    """count, mean, std, min, max and percentiles of a stream of values"""
+
+    def __init__(self, precision=1e-3):
+        self.precision = precision
+        self.log_base = math.log1p(precision)
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = math.inf
+        self.max = -math.inf
+        self.positive = dict()  # bucket index: count
+        self.negative = dict()  # bucket index of -value: count
+        self.zeros = 0
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value > 0.0:
+            idx = math.floor(math.log(value) / self.log_base)
+            self.positive[idx] = self.positive.get(idx, 0) + 1
+        elif value < 0.0:
+            idx = math.floor(math.log(-value) / self.log_base)
+            self.negative[idx] = self.negative.get(idx, 0) + 1
+        else:
+            self.zeros += 1
+
+    def var(self):
+        """population variance (numpy's default ddof=0)"""
+        return self.m2 / self.count if self.count else math.nan
+
+    def std(self):
+        return math.sqrt(self.var()) if self.count else math.nan
+
+    def _buckets(self):
+        """(centre, count) of all buckets in ascending order of value"""
+        for idx in sorted(self.negative, reverse=True):
+            yield -math.exp((idx + 0.5) * self.log_base), self.negative[idx]
+        if self.zeros:
+            yield 0.0, self.zeros
+        for idx in sorted(self.positive):
+            yield math.exp((idx + 0.5) * self.log_base), self.positive[idx]
+
+    def percentiles(self, qs):
+        """values at percentiles qs (0..100), interpolated like np.percentile"""
+        if not self.count:
+            return [math.nan for _ in qs]
+        # the ranks each percentile interpolates between, in ascending order
+        wanted = []
+        for q in qs:
+            rank = q / 100.0 * (self.count - 1)
+            low = math.floor(rank)
+            wanted.append((rank, low, min(low + 1, self.count - 1)))
+        ranks = sorted({r for rank, low, high in wanted for r in (low, high)})
+        values = dict()
+        seen = 0
+        buckets = self._buckets()
+        centre = None
+        for r in ranks:
+            while seen <= r:
+                centre, count = next(buckets)
+                seen += count
+            values[r] = centre
+        # the extreme samples are known exactly, no value lies outside them
+        values[0] = self.min
+        values[self.count - 1] = self.max
+        result = []
+        for rank, low, high in wanted:
+            vlow = min(max(values[low], self.min), self.max)
+            vhigh = min(max(values[high], self.min), self.max)
+            result.append(vlow + (vhigh - vlow) * (rank - low))
+        return result
+
+    def percentile(self, q):
+        return self.percentiles([q])[0]
+
+    def median(self):
+        return self.percentile(50)
+
+    def summary(self, fmt=".4f"):
+        """one line of the usual statistics, values formatted with fmt"""
+        if not self.count:
+            return "n 0"
+        p50, p90, p99 = self.percentiles([50, 90, 99])
+        return (
+            f"n {self.count} avg {self.mean:{fmt}} std {self.std():{fmt}}"
+            f" min {self.min:{fmt}} p50 {p50:{fmt}} p90 {p90:{fmt}} p99 {p99:{fmt}}"
+            f" max {self.max:{fmt}}"
+        )
@@ -0,0 +1,123 @@
+"""
+Adaptive per-gauge read timeouts learned from observed response latency
+
+Keeps a window of recent successful transaction times per key (usually
+(port, id)) and derives each read deadline from a high quantile of that
+window plus a margin, clamped to [floor, ceiling]. Until enough samples
+are seen the configured --timeout is used. A gauge that has become slower
+than its learned deadline would time out on every read and never add a
+sample, so after `misses` timeouts in a row its deadline is doubled (up to
+ceiling). An isolated drop on a lossy bus changes nothing, and as the
+window is kept the next recomputation brings a widened deadline back down
+unless the slower replies now dominate it.
+"""
+import collections
+import logging
+import math
+
+
+class GaugeLatency:
+    """latency window and timeout decisions of one gauge"""
+
+    def __init__(self, initial, window):
+        self.samples = collections.deque(maxlen=window)
+        self.timeout = initial
+        self.pending = 0  # samples since the timeout was last recomputed
+        self.timeouts = 0  # reads that hit the deadline
+        self.waited = 0.0  # seconds spent waiting on those reads
+        self.updates = 0  # timeout changes
+        self.misses = 0  # timeouts since the last successful read
+
+
+class AdaptiveTimeout:
+    """per key read deadlines from quantile(dt) + margin"""
+
+    def __init__(
+        self,
+        initial=0.1,
+        quantile=0.99,
+        margin=0.01,
+        floor=0.01,
+        ceiling=1.0,
+        window=256,
+        min_samples=16,
+        every=16,
+        misses=3,
+    ):
+        self.initial = initial
+        self.quantile = quantile
+        self.margin = margin
+        self.floor = floor
+        self.ceiling = ceiling
+        self.window = window
+        self.min_samples = min_samples
+        self.every = every
+        self.misses = misses
+        self.gauges = dict()
+
+    def _gauge(self, key):
+        gauge = self.gauges.get(key)
+        if gauge is None:
+            gauge = self.gauges[key] = GaugeLatency(self.initial, self.window)
+        return gauge
+
+    def timeout(self, key):
+        """current read deadline (s) for key"""
+        return self._gauge(key).timeout
+
+    def observe(self, key, dt):
+        """record the latency of a successful read"""
+        gauge = self._gauge(key)
+        gauge.misses = 0
+        gauge.samples.append(dt)
+        gauge.pending += 1
+        if len(gauge.samples) >= self.min_samples and gauge.pending >= self.every:
+            gauge.pending = 0
+            ordered = sorted(gauge.samples)
+            qval = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+            # quantized to ms so the deadline does not follow noise
+            timeout = math.ceil((qval + self.margin) * 1e3) * 1e-3
+            timeout = min(self.ceiling, max(self.floor, timeout))
+            if timeout != gauge.timeout:
+                logging.debug(
+                    "%s timeout %.3f -> %.3f (q%g=%.4f n=%d)",
+                    key,
+                    gauge.timeout,
+                    timeout,
+                    self.quantile * 100,
+                    qval,
+                    len(ordered),
+                )
+                gauge.timeout = timeout
+                gauge.updates += 1
+
+    def expired(self, key, waited):
+        """record a read that timed out after `waited` seconds"""
+        gauge = self._gauge(key)
+        gauge.timeouts += 1
+        gauge.waited += waited
+        gauge.misses += 1
+        logging.debug("%s read timed out at %.3f, retrying", key, gauge.timeout)
+        if gauge.misses < self.misses:
+            return
+        gauge.misses = 0
+        timeout = min(self.ceiling, gauge.timeout * 2)
+        if timeout != gauge.timeout:
+            logging.debug(
+                "%s timeout %.3f -> %.3f after %d timeouts",
+                key,
+                gauge.timeout,
+                timeout,
+                self.misses,
+            )
+            gauge.timeout = timeout
+            gauge.updates += 1
+
+    def report(self, key):
+        """one line summary of the decisions taken for key"""
+        gauge = self._gauge(key)
+        return (
+            f"adaptive timeout: {gauge.timeout:.3f}s"
+            f" (samples: {len(gauge.samples)} updates: {gauge.updates})"
+            f" timeouts: {gauge.timeouts} waited: {gauge.waited:.3f}s"
+        )
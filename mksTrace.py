@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Phase-resolved timing of MKS 974B transactions
+
+mks974.exchange() hands every attempt to a PhaseTrace which keeps one
+32 byte record of monotonic ns timestamps: start, input/output buffer
+reset done, write() returned, flush() done (frame on the wire; equal to
+write with --noflush), first reply byte received and reply frame
+complete, plus the address, retry number and outcome. Records are
+streamed to a compact binary log and summarized as per-phase percentiles
+to tell the serial adapter (reset, write, flush), the gauge (turnaround)
+and the baud rate (transfer) apart. The live summary of a PhaseTrace is
+kept in constant memory (mksStats.RunningStats per phase).
+"""
+import sys
+import struct
+import argparse
+import textwrap
+
+import numpy as np
+
+import mks974
+import mksStats
+
+MAGIC = b"MKSTRACE"
+VERSION = 1
+HEADER = struct.Struct("<8sHH")  # magic, version, record size
+# start ns, addr, retry, status, then ns offsets from start of: reset done,
+# write returned, flush done, first reply byte, frame complete (or timeout)
+RECORD = struct.Struct("<qHBB5I")
+RECORD_DTYPE = np.dtype(
+    [
+        ("start", "<i8"),
+        ("addr", "<u2"),
+        ("retry", "u1"),
+        ("status", "u1"),
+        ("reset", "<u4"),
+        ("write", "<u4"),
+        ("flush", "<u4"),
+        ("first", "<u4"),
+        ("frame", "<u4"),
+    ]
+)
+
+# record status
+ACK = 0
+NAK = 1  # NAK or malformed reply
+TIMEOUT = 2
+ECHO = 3  # half duplex echo mismatch
+STATUS = {ACK: "ack", NAK: "nak", TIMEOUT: "timeout", ECHO: "echo"}
+
+# phase: (from field, to field), "start" is offset 0
+PHASES = (
+    ("reset", ("start", "reset")),
+    ("write", ("reset", "write")),
+    ("flush", ("write", "flush")),
+    ("turnaround", ("flush", "first")),
+    ("transfer", ("first", "frame")),
+    ("total", ("start", "frame")),
+)
+PERCENTILES = (50, 90, 99)
+
+
+def parse_args():
+    """handle command line"""
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent(
+            """\
+           Summarize transaction phase timing logs written with
+           readPressure.py/readAllPressure.py --trace FILE
+                                    """
+        ),
+    )
+    parser.add_argument("files", nargs="+", help="binary trace logs")
+    parser.add_argument(
+        "--bygauge", action="store_true", help="summarize each address separately"
+    )
+    return parser.parse_args()
+
+
+def phase_selected(name, status, first):
+    """True if phase `name` of a record (or numpy mask of records) means something"""
+    if name in ("reset", "write", "flush"):
+        return first >= 0
+    if name == "turnaround":
+        return first > 0
+    # the reply phases only mean something for complete replies
+    return (status <= NAK) & (first > 0)
+
+
+def format_summary(counts, phases):
+    """text lines of status counts and [(phase, percentiles, max, n)] in ms"""
+    total = sum(counts.values())
+    names = " ".join(f"{STATUS[code]}: {count}" for code, count in counts.items())
+    lines = [f"attempts: {total} {names}"]
+    header = " ".join(f"{f'p{pct}':>8s}" for pct in PERCENTILES)
+    lines.append(f"{'phase (ms)':>12s} {header} {'max':>8s} {'n':>6s}")
+    for name, pcts, dtmax, count in phases:
+        pct = " ".join(f"{val:>8.3f}" for val in pcts)
+        lines.append(f"{name:>12s} {pct} {dtmax:>8.3f} {count:>6d}")
+    return lines
+
+
+class PhaseTrace:
+    """streams exchange() phase timestamps to path, keeps running statistics"""
+
+    def __init__(self, path=None):
+        self.counts = {code: 0 for code in STATUS}
+        self.phases = {name: mksStats.RunningStats() for name, span in PHASES}
+        self.fh = None
+        if path is not None:
+            self.fh = open(path, "wb")
+            self.fh.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+
+    def record(self, frame, resp, retry, stamps, echo_error=False):
+        """stamps: monotonic ns of start, reset, write, flush, first byte, end"""
+        start = stamps[0]
+        if echo_error:
+            status = ECHO
+        elif resp is None:
+            status = TIMEOUT
+        elif mks974.frame_ack(resp):
+            status = ACK
+        else:
+            status = NAK
+        offsets = [
+            min(0xFFFFFFFF, stamp - start) if stamp else 0 for stamp in stamps[1:]
+        ]
+        if self.fh is not None:
+            self.fh.write(
+                RECORD.pack(
+                    start,
+                    mks974.frame_addr(frame) or 0,
+                    min(retry, 255),
+                    status,
+                    *offsets,
+                )
+            )
+        self.counts[status] += 1
+        at = dict(zip(RECORD_DTYPE.names[4:], offsets), start=0)
+        for name, (lo, hi) in PHASES:
+            if phase_selected(name, status, at["first"]):
+                self.phases[name].add((at[hi] - at[lo]) * 1e-6)
+
+    def summary(self):
+        """text lines of per-phase percentiles (ms) of the attempts so far"""
+        phases = [
+            (name, stats.percentiles(PERCENTILES), stats.max, stats.count)
+            for name, stats in self.phases.items()
+            if stats.count
+        ]
+        return format_summary(self.counts, phases)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+
+def load(path):
+    """records of a binary trace log as a numpy structured array"""
+    with open(path, "rb") as fh:
+        magic, version, size = HEADER.unpack(fh.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} is not a version {VERSION} mks974 trace")
+        return np.frombuffer(fh.read(), dtype=RECORD_DTYPE)
+
+
+def summary(records):
+    """text lines of per-phase percentiles (ms) of trace records"""
+    counts = {
+        code: int(np.count_nonzero(records["status"] == code)) for code in STATUS
+    }
+    phases = []
+    for name, (lo, hi) in PHASES:
+        sel = records[phase_selected(name, records["status"], records["first"])]
+        if not len(sel):
+            continue
+        start = 0 if lo == "start" else sel[lo].astype(np.int64)
+        dt = (sel[hi].astype(np.int64) - start) * 1e-6
+        phases.append((name, np.percentile(dt, PERCENTILES), np.max(dt), len(sel)))
+    return format_summary(counts, phases)
+
+
+def main():
+    """main logic"""
+    optlist = parse_args()
+    records = np.concatenate([load(path) for path in optlist.files])
+    if optlist.bygauge:
+        for addr in np.unique(records["addr"]):
+            print(f"gauge {addr:03d}")
+            for line in summary(records[records["addr"] == addr]):
+                print(line)
+    else:
+        for line in summary(records):
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit()
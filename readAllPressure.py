@@ -10,15 +10,18 @@ import serial
 import argparse
 import textwrap
 import time
+import math
 import logging
 import warnings
 import re
-import numpy as np
-from astropy import stats
-from astropy.utils.exceptions import AstropyWarning
+import mks974
+import mksCadence
+import mksStats
+import mksRetry
+import mksTimeout
 
 
-def parse_args():
+def parse_args(argv=None):
     """handle command line"""
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -32,27 +35,30 @@ def parse_args():
                                """
         ),
     )
-    parser.add_argument(
-        "--port",
-        nargs="?",
-        default="/dev/ttyS0",
-        const="/dev/ttyS0",
-        help="serial port to open",
-    )
-    parser.add_argument(
-        "--baudrate",
-        nargs="?",
-        type=int,
-        default=9600,
-        const=9600,
-        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
-    )
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_arguments(parser):
+    """options of the tool, also those of its hwutils subcommand"""
+    mks974.add_port_arguments(parser)
     parser.add_argument(
         "--ids",
         nargs="+",
         type=int,
         help="RS485 ids:{1..253}",
     )
+    parser.add_argument(
+        "--bus",
+        nargs="+",
+        metavar="PORT:ID[,ID...]",
+        help="poll each bus in its own worker process (replaces --port/--ids)",
+    )
+    parser.add_argument(
+        "--shmname",
+        nargs="?",
+        help="name of the shared memory gauge table used with --bus",
+    )
     parser.add_argument(
         "--count",
         nargs="?",
@@ -66,29 +72,87 @@ def parse_args():
         type=float,
         default=1.0,
         const=1.0,
-        help="delay between queries",
+        help="sampling period (s), each cycle over all gauges starts on a fixed grid",
+    )
+    parser.add_argument(
+        "--interval",
+        nargs="?",
+        type=float,
+        default=0.0,
+        const=60.0,
+        help="print running dt and pressure statistics every so many seconds [off]",
+    )
+    parser.add_argument(
+        "--retries",
+        nargs="?",
+        type=int,
+        default=5,
+        const=5,
+        help="attempts per read [5]",
     )
     parser.add_argument(
-        "--timeout",
+        "--backoff",
         nargs="?",
         type=float,
-        default=0.1,
-        const=0.1,
-        help="timeout for read()",
+        default=0.0,
+        const=0.01,
+        help="delay before the first retry, doubling for each further retry",
     )
     parser.add_argument(
-        "--loopback", action="store_true", help="connection is RS485 half duplex"
+        "--jitter",
+        nargs="?",
+        type=float,
+        default=0.0,
+        const=0.5,
+        help="random +/- fraction applied to the backoff delay",
     )
     parser.add_argument(
-        "--noflush", action="store_true", help="no flush after write() call"
+        "--breaker",
+        nargs="?",
+        type=int,
+        default=0,
+        const=3,
+        help="stop polling a gauge after this many failed reads in a row [off]",
     )
     parser.add_argument(
-        "--noreset", action="store_true", help="no reset after write() call"
+        "--probe",
+        nargs="?",
+        type=float,
+        default=10.0,
+        const=10.0,
+        help="interval (s) between single-attempt probes of a stopped gauge",
     )
     parser.add_argument(
-        "--debug", action="store_true", help="print additional debugging messages"
+        "--ring",
+        nargs="?",
+        const="mks974.ring",
+        help="also write every sample to this memory-mapped ring file (see mksRing.py)",
+    )
+    parser.add_argument(
+        "--ringsize",
+        nargs="?",
+        type=int,
+        default=1 << 20,
+        const=1 << 20,
+        help="samples kept in the --ring file, 96 bytes each [1048576]",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="learn per-gauge read timeouts from observed latency (--timeout seeds it)",
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const="mks974.trace",
+        help="record phase timing of every attempt (binary log, see mksTrace.py)",
+    )
+    parser.add_argument(
+        "--capture",
+        nargs="?",
+        const="mks974.cap",
+        help="append all serial traffic to this file (replay with mksCapture.py)",
     )
-    return parser.parse_args()
 
 
 def init_logging(debug):
@@ -104,104 +168,165 @@ def init_logging(debug):
 
 def init_warnings():
     """Block warnings from Astropy"""
+    from astropy.utils.exceptions import AstropyWarning
+
     warnings.simplefilter("ignore", category=AstropyWarning)
 
 
-def read_pressure():
+def read_pressure_workers(optlist):
+    """one worker process per bus publishing into a shared memory table"""
+    import mksShm
+
+    buses = [mks974.parse_bus(spec) for spec in optlist.bus]
+    t0 = time.time()
+    table, procs = mksShm.run_workers(buses, optlist, optlist.shmname)
+    try:
+        for proc in procs:
+            proc.join()
+        elapsed = time.time() - t0
+        snap = table.snapshot()
+    finally:
+        table.close()
+    print("")
+    print("===================================================================")
+    print(f"read pressure stats for buses {optlist.bus}")
+    for rec in snap:
+        reads = int(rec["reads"])
+        if reads:
+            print("===================================")
+            print(f"Gauge ID: {rec['port'].decode()}:{rec['gid']:>03d}")
+            print(f"dt stats:  avg: {(rec['dtsum'] / reads):>.4f}")
+            print(f"          last: {rec['dt']:>.4f}")
+            print(f" Pressure last: {rec['pressure']:>.4g}")
+            print(f" nominal count: {reads}")
+            print(f"   retry count: {rec['retries']}")
+            print(f"   error count: {rec['errors']}")
+            print(f" rate: {(reads / elapsed):>.1f} reads/sec")
+    sys.exit()
+
+
+def read_pressure(optlist=None):
     """main logic"""
-    optlist = parse_args()
+    if optlist is None:
+        optlist = parse_args()
     init_logging(optlist.debug)
     # init_warnings()
+    if optlist.retries < 1:
+        logging.error(f"--retries {optlist.retries}: at least one attempt per read")
+        sys.exit(1)
+    if optlist.bus:
+        # each of these writes one file or report, the bus workers have none
+        for name in ("ring", "trace", "capture", "interval"):
+            if getattr(optlist, name):
+                logging.error(f"--{name} cannot be used with --bus")
+                sys.exit(1)
+        read_pressure_workers(optlist)
+
+    ser = mks974.open_port(optlist)
+    capture = None
+    if optlist.capture:
+        import mksCapture
 
-    ser = serial.Serial()
-    ser.port = optlist.port
-    ser.baudrate = optlist.baudrate
-    ser.timeout = float(optlist.timeout)
-    ser.open()
+        capture = mksCapture.Capture(optlist.capture, optlist.loopback)
+        capture.attach(ser, optlist.port)
     ids = optlist.ids
     logging.debug("ids = %s", ids)
     cmd = "PR4"
-    dtlist = dict()
-    prsList = dict()
+    dtstats = dict()
+    prstats = dict()
     errcnt = dict()
     retrycnt = dict()
     sn = dict()
-    max_retries = 5
+    max_retries = optlist.retries
     t0 = time.time()
 
     for gid in ids:
-        query_str = f"@{gid:03d}SN?;FF"
-        query_bts = bytes(query_str, "utf-8")
-        if not optlist.noreset:
-            ser.reset_input_buffer()
-            ser.reset_output_buffer()
-        ser.write(query_bts)
-        if not optlist.noflush:
-            ser.flush()
-        resp = ser.read_until(expected=b";FF", size=None)
-        if re.match(r"@...ACK.*;FF", resp.decode()):
-            snStr = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
+        snStr = mks974.transact(mks974.encode_query(gid, "SN"), optlist, ser).result
+        if snStr is not None:
             logging.debug(f"sn={snStr}")
             sn[gid] = snStr
         else:
             logging.warn("failed to obtain serial number")
             sn[gid] = "unknown"
 
+    timeout = float(optlist.timeout)
+    adaptive = None
+    if optlist.adaptive:
+        adaptive = mksTimeout.AdaptiveTimeout(timeout)
+    trace = None
+    if optlist.trace:
+        import mksTrace
+
+        trace = mksTrace.PhaseTrace(optlist.trace)
+    ring = None
+    if optlist.ring:
+        import mksRing
+
+        ring = mksRing.PressureRing.open(optlist.ring, optlist.ringsize)
+    policy = mksRetry.RetryPolicy(max_retries, optlist.backoff, jitter=optlist.jitter)
+    breaker = None
+    if optlist.breaker:
+        breaker = mksRetry.CircuitBreaker(optlist.breaker, optlist.probe)
     rstats = dict()
+    retrytime = dict()
     for gid in ids:
-        dtlist[gid] = []
-        prsList[gid] = []
+        dtstats[gid] = mksStats.RunningStats()
+        prstats[gid] = mksStats.RunningStats()
         rstats[gid] = dict()
         errcnt[gid] = 0
         retrycnt[gid] = 0
+        retrytime[gid] = 0.0
 
-    for nn in range(int(optlist.count)):
+    interim = time.monotonic() + optlist.interval
+    cadence = mksCadence.Cadence(optlist.delay)
+    cstats = mksCadence.CadenceStats(cadence.period)
+    for nn, due in cadence.slots(int(optlist.count)):
         for gid in ids:
             logging.debug("sn= %s gid= %d", sn[gid], gid)
-            dt0 = 0.0
+            if breaker is not None and not breaker.allow(gid, time.monotonic()):
+                continue
+            attempts = max_retries if breaker is None else breaker.attempts(gid, policy)
+            cstats.record(gid, due)
+            valid = False
+            prVal = math.nan
+            dt = dt0 = 0.0
             retries = 0
-            while retries < max_retries:
-                query_str = f"@{gid:03d}{cmd}?;FF"
-                query_bts = bytes(query_str, "utf-8")
-                if not optlist.noreset:
-                    ser.reset_input_buffer()
-                    ser.reset_output_buffer()
-                start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                ser.write(query_bts)
-                if not optlist.noflush:
-                    ser.flush()
-                resp = ser.read_until(expected=b";FF", size=None)
-                end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                dt = (end_ns - start_ns) * 1e-9
-
-                if optlist.loopback:  # RS485 cmd echo -> read again
-                    if re.match(f"@{gid:03d}{cmd}\?;FF", resp.decode()):
-                        cmd_echo = resp
-                        cmd_dt = dt
-                        ser.timeout = float(optlist.timeout) - cmd_dt
-                        resp = ser.read_until(expected=b";FF", size=None)
-                        end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                        dt = (end_ns - start_ns) * 1e-9
-                        logging.debug(f"cmd echo={cmd_echo} dt={cmd_dt:>.3f}")
-                    else:
-                        logging.warning("half duplex query echo failed")
+            while retries < attempts:
+                if retries:
+                    backoff = policy.delay(retries)
+                    if backoff > 0.0:
+                        time.sleep(backoff)
+                        retrytime[gid] += backoff
+                if adaptive is not None:
+                    timeout = adaptive.timeout(gid)
+                query_bts = mks974.encode_query(gid, cmd)
+                resp, dt = mks974.exchange(
+                    query_bts, optlist, ser, timeout, trace, retries
+                )
 
                 # check the reply is valid
-                if re.match(r"@...ACK.*;FF", resp.decode()):
+                reply = None if resp is None else mks974.parse_reply(resp)
+                if reply is not None and reply.ack:
+                    if adaptive is not None:
+                        adaptive.observe(gid, dt)
                     dt = dt0 + dt
-                    dtlist[gid].append(dt)
-                    prStr = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
+                    dtstats[gid].add(dt)
+                    prStr = reply.payload
                     prVal = float(prStr)
-                    prsList[gid].append(prVal)
+                    prstats[gid].add(prVal)
                     logging.debug(f"prStr={prStr}  prVal={prVal:>.4g} dt={dt:>.3f}")
+                    valid = True
                     break
                 elif (
-                    retries < max_retries and len(resp) == 0 and dt >= ser.timeout
+                    retries < max_retries and resp is None
                 ):  # retry
                     # logging.warning(
                     #     "got 0 byte response and read timeout at trial %d -- retrying", nn
                     # )
                     print(".", end="", flush=True)
+                    if adaptive is not None:
+                        adaptive.expired(gid, dt)
+                    retrytime[gid] += dt
                     dt0 = dt
                     retries += 1
                     retrycnt[gid] += 1
@@ -211,53 +336,78 @@ def read_pressure():
                         "failed at trial %d: cmd=%s  resp=%s, dt=%.3f",
                         nn,
                         cmd,
-                        resp,
+                        bytes(resp),
                         dt,
                     )
                     errcnt[gid] += 1
                     break
 
-                if retries in rstats[gid]:
-                    rstats[gid][retries] += 1
+            if ring is not None:
+                ring.append(time.time(), optlist.port, gid, prVal, dt, retries)
+            if retries in rstats[gid]:
+                rstats[gid][retries] += 1
+            else:
+                rstats[gid][retries] = 1
+            if breaker is not None:
+                if valid:
+                    breaker.success(gid, time.monotonic())
                 else:
-                    rstats[gid][retries] = 1
+                    breaker.failure(gid, time.monotonic())
+        if optlist.interval and time.monotonic() >= interim:
+            interim += optlist.interval
+            stamp = time.time()
+            for gid in ids:
+                label = f"{stamp:.3f} {optlist.port}:{gid:03d}"
+                print(f"{label} dt {dtstats[gid].summary()}")
+                print(f"{label} pressure {prstats[gid].summary('.4g')}")
 
-            if float(optlist.delay) > dt:
-                time.sleep(float(optlist.delay) - dt)
-
-        t1 = time.time()
-        elapsed = t1 - t0
+    elapsed = time.time() - t0
+    for gid in ids:
+        cstats.miss(gid, cadence.missed)
     ser.close()
+    if capture is not None:
+        capture.close()
+    if ring is not None:
+        ring.close()
     print("")
     print("===================================================================")
     print(f"read pressure stats for {optlist.port} gauges {optlist.ids}")
     for gid in optlist.ids:
-        if len(dtlist[gid]):
-            dtarray = np.array(dtlist[gid])
-            dtavg = np.mean(dtarray)
-            dtmed = np.median(dtarray)
-            dtstd = np.std(dtarray)
-            dtmin = np.min(dtarray)
-            dtmax = np.max(dtarray)
-            prsArray = np.array(prsList[gid])
-            prsavg = np.mean(prsArray)
-
+        dts = dtstats[gid]
+        if dts.count:
             print("===================================")
             print(f"Gauge ID: SN:{sn[gid]}  {optlist.port}:{gid:>03d}")
-            print(f"dt stats:  avg: {dtavg:>.4f}")
-            print(f"           med: {dtmed:>.3f}")
-            print(f"           std: {dtstd:>.4f}")
-            print(f"           min: {dtmin:>.4f}")
-            print(f"           max: {dtmax:>.4f}")
-            print(f"  Pressure avg: {prsavg:>.4f}")
-            print(f" nominal count: {len(dtlist[gid])}")
+            print(f"dt stats:  avg: {dts.mean:>.4f}")
+            print(f"           med: {dts.median():>.3f}")
+            print(f"           std: {dts.std():>.4f}")
+            print(f"           min: {dts.min:>.4f}")
+            print(f"           max: {dts.max:>.4f}")
+            print(f"  Pressure avg: {prstats[gid].mean:>.4f}")
+            print(f" nominal count: {dts.count}")
             print(f"   retry count: {retrycnt[gid]}")
             print(f"   error count: {errcnt[gid]}")
-            print(f" rate: {(len(dtlist[gid]) / elapsed):>.1f} reads/sec")
+            print(f" rate: {(dts.count / elapsed):>.1f} reads/sec")
             for rt in rstats[gid]:
                 print(
-                    f"    retry:{rt} -- {rstats[gid][rt]:>5d} {(rstats[gid][rt]/len(dtlist[gid])):>.4f} probability"
+                    f"    retry:{rt} -- {rstats[gid][rt]:>5d} {(rstats[gid][rt]/dts.count):>.4f} probability"
                 )
+        else:
+            print("===================================")
+            print(f"Gauge ID: SN:{sn[gid]}  {optlist.port}:{gid:>03d} no valid reads")
+            print(f"   retry count: {retrycnt[gid]}")
+            print(f"   error count: {errcnt[gid]}")
+        print(f"    retry time: {retrytime[gid]:>.3f} s")
+        print(f" {cstats.report(gid)}")
+        if breaker is not None:
+            print(f" {breaker.report(gid)}")
+        if adaptive is not None:
+            print(f" {adaptive.report(gid)}")
+    if trace is not None:
+        trace.close()
+        print("===================================")
+        print(f"phase timing, log in {optlist.trace}")
+        for line in trace.summary():
+            print(f" {line}")
     sys.exit()
 
 
@@ -13,12 +13,13 @@ import time
 import logging
 import warnings
 import re
-import numpy as np
-from astropy import stats
-from astropy.utils.exceptions import AstropyWarning
+import mks974
+import mksCadence
+import mksStats
+import mksTimeout
 
 
-def parse_args():
+def parse_args(argv=None):
     """handle command line"""
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -32,21 +33,13 @@ def parse_args():
                                """
         ),
     )
-    parser.add_argument(
-        "--port",
-        nargs="?",
-        default="/dev/ttyS0",
-        const="/dev/ttyS0",
-        help="serial port to open",
-    )
-    parser.add_argument(
-        "--baudrate",
-        nargs="?",
-        type=int,
-        default=9600,
-        const=9600,
-        help="4800, [9600], 19200, 38400, 57600, 115200, 230400",
-    )
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_arguments(parser):
+    """options of the tool, also those of its hwutils subcommand"""
+    mks974.add_port_arguments(parser)
     parser.add_argument(
         "--id",
         nargs="?",
@@ -68,29 +61,33 @@ def parse_args():
         type=float,
         default=1.0,
         const=1.0,
-        help="delay between queries",
+        help="sampling period (s), queries start on a fixed grid",
     )
     parser.add_argument(
-        "--timeout",
+        "--interval",
         nargs="?",
         type=float,
-        default=0.1,
-        const=0.1,
-        help="timeout for read()",
-    )
-    parser.add_argument(
-        "--loopback", action="store_true", help="connection is RS485 half duplex"
+        default=0.0,
+        const=60.0,
+        help="print running dt statistics every so many seconds [off]",
     )
     parser.add_argument(
-        "--noflush", action="store_true", help="no flush after write() call"
+        "--adaptive",
+        action="store_true",
+        help="learn per-gauge read timeouts from observed latency (--timeout seeds it)",
     )
     parser.add_argument(
-        "--noreset", action="store_true", help="no reset after write() call"
+        "--trace",
+        nargs="?",
+        const="mks974.trace",
+        help="record phase timing of every attempt (binary log, see mksTrace.py)",
     )
     parser.add_argument(
-        "--debug", action="store_true", help="print additional debugging messages"
+        "--capture",
+        nargs="?",
+        const="mks974.cap",
+        help="append all serial traffic to this file (replay with mksCapture.py)",
     )
-    return parser.parse_args()
 
 
 def init_logging(debug):
@@ -106,74 +103,75 @@ def init_logging(debug):
 
 def init_warnings():
     """Block warnings from Astropy"""
+    from astropy.utils.exceptions import AstropyWarning
+
     warnings.simplefilter("ignore", category=AstropyWarning)
 
 
-def read_pressure():
+def read_pressure(optlist=None):
     """main logic"""
-    optlist = parse_args()
+    if optlist is None:
+        optlist = parse_args()
     init_logging(optlist.debug)
     # init_warnings()
 
-    ser = serial.Serial()
-    # ser = serial.rs485.RS485(optlist.port)
-    ser.port = optlist.port
-    ser.baudrate = optlist.baudrate
-    # ser.rs485_mode = serial.rs485.RS485Settings(...)
-    # ser.rs485_mode.delay_before_rx = 0.02
-    # ser.rs485_mode.loopback = True
-    ser.timeout = float(optlist.timeout)
-    ser.open()
+    ser = mks974.open_port(optlist)
+    capture = None
+    if optlist.capture:
+        import mksCapture
+
+        capture = mksCapture.Capture(optlist.capture, optlist.loopback)
+        capture.attach(ser, optlist.port)
     cmd = "PR4"
-    query_str = f"@{optlist.id:03d}{cmd}?;FF"
-    query_bts = bytes(query_str, "utf-8")
-    dtlist = []
+    query_bts = mks974.encode_query(optlist.id, cmd)
+    dtstats = mksStats.RunningStats()
     errcnt = 0
     retrycnt = 0
     max_retries = 5
+    timeout = float(optlist.timeout)
+    adaptive = None
+    if optlist.adaptive:
+        adaptive = mksTimeout.AdaptiveTimeout(timeout)
+    trace = None
+    if optlist.trace:
+        import mksTrace
+
+        trace = mksTrace.PhaseTrace(optlist.trace)
     t0 = time.time()
+    interim = time.monotonic() + optlist.interval
     rstats = dict()
-    for nn in range(int(optlist.count)):
+    cadence = mksCadence.Cadence(optlist.delay)
+    cstats = mksCadence.CadenceStats(cadence.period)
+    for nn, due in cadence.slots(int(optlist.count)):
+        cstats.record(optlist.id, due)
         dt0 = 0.0
         retries = 0
         while retries < max_retries:
-            if not optlist.noreset:
-                ser.reset_input_buffer()
-                ser.reset_output_buffer()
-            start_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-            ser.write(query_bts)
-            if not optlist.noflush:
-                ser.flush()
-            resp = ser.read_until(expected=b";FF", size=None)
-            end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-            dt = (end_ns - start_ns) * 1e-9
-
-            if optlist.loopback:  # RS485 cmd echo -> read again
-                if re.match(f"@{optlist.id:03d}{cmd}\?;FF", resp.decode()):
-                    cmd_echo = resp
-                    cmd_dt = dt
-                    ser.timeout = float(optlist.timeout) - cmd_dt
-                    resp = ser.read_until(expected=b";FF", size=None)
-                    end_ns = time.clock_gettime_ns(time.CLOCK_REALTIME)
-                    dt = (end_ns - start_ns) * 1e-9
-                    logging.debug(f"cmd echo={cmd_echo} dt={cmd_dt:>.3f}")
-                else:
-                    logging.warning("half duplex query echo failed")
+            if adaptive is not None:
+                timeout = adaptive.timeout(optlist.id)
+            resp, dt = mks974.exchange(
+                query_bts, optlist, ser, timeout, trace, retries
+            )
 
             # check the reply is valid
-            if re.match(r"@...ACK.*;FF", resp.decode()):
+            reply = None if resp is None else mks974.parse_reply(resp)
+            if reply is not None and reply.ack:
+                if adaptive is not None:
+                    adaptive.observe(optlist.id, dt)
                 dt = dt0 + dt
-                dtlist.append(dt)
-                prStr = re.match(r"@...ACK(.*);FF", resp.decode()).groups()[0]
+                dtstats.add(dt)
+                prStr = reply.payload
                 prVal = float(prStr)
                 logging.debug(f"prStr={prStr}  prVal={prVal:>.4g} dt={dt:>.3f}")
                 break
             elif (
-                retries < max_retries and len(resp) == 0 and dt >= ser.timeout):  # retry
+                retries < max_retries and resp is None):  # retry
                 # logging.warning(
                 #     "got 0 byte response and read timeout at trial %d -- retrying", nn
                 # )
                 print(f".", end="")
+                if adaptive is not None:
+                    adaptive.expired(optlist.id, dt)
                 dt0 = dt
                 retries += 1
                 retrycnt += 1
@@ -183,7 +181,7 @@ def read_pressure():
                     "failed at trial %d: cmd=%s  resp=%s, dt=%.3f",
                     nn,
                     cmd,
-                    resp,
+                    bytes(resp),
                     dt,
                 )
                 errcnt += 1
@@ -193,31 +191,39 @@ def read_pressure():
             rstats[retries] += 1
         else:
             rstats[retries] = 1
-        if float(optlist.delay) > dt:
-            time.sleep(float(optlist.delay) - dt)
+        if optlist.interval and time.monotonic() >= interim:
+            interim += optlist.interval
+            print(
+                f"{time.time():.3f} {optlist.port}:{optlist.id:03d}"
+                f" dt {dtstats.summary()}"
+            )
+    cstats.miss(optlist.id, cadence.missed)
     t1 = time.time()
     elapsed = t1 - t0
     ser.close()
+    if capture is not None:
+        capture.close()
     print("")
-    if len(dtlist):
-        dtarray = np.array(dtlist)
-        dtavg = np.mean(dtarray)
-        dtmed = np.median(dtarray)
-        dtstd = np.std(dtarray)
-        dtmin = np.min(dtarray)
-        dtmax = np.max(dtarray)
-
-        print(f"dt stats: avg: {dtavg:>.4f}")
-        print(f"          med: {dtmed:>.3f}")
-        print(f"          std: {dtstd:>.4f}")
-        print(f"          min: {dtmin:>.4f}")
-        print(f"          max: {dtmax:>.4f}")
-        print(f" nominal count: {len(dtlist)}")
+    if dtstats.count:
+        print(f"dt stats: avg: {dtstats.mean:>.4f}")
+        print(f"          med: {dtstats.median():>.3f}")
+        print(f"          std: {dtstats.std():>.4f}")
+        print(f"          min: {dtstats.min:>.4f}")
+        print(f"          max: {dtstats.max:>.4f}")
+        print(f" nominal count: {dtstats.count}")
         print(f"   retry count: {retrycnt}")
         print(f"   error count: {errcnt}")
-        print(f" rate: {(len(dtlist) / elapsed):>.1f} reads/sec")
+        print(f" rate: {(dtstats.count / elapsed):>.1f} reads/sec")
         for rt in rstats:
-            print(f"    retry:{rt} -- {rstats[rt]:>5d} {(rstats[rt]/len(dtlist)):>.4f} probability")
+            print(f"    retry:{rt} -- {rstats[rt]:>5d} {(rstats[rt]/dtstats.count):>.4f} probability")
+        print(f" {cstats.report(optlist.id)}")
+        if adaptive is not None:
+            print(f" {adaptive.report(optlist.id)}")
+    if trace is not None:
+        trace.close()
+        print(f" phase timing, log in {optlist.trace}")
+        for line in trace.summary():
+            print(f" {line}")
     sys.exit()
 
 
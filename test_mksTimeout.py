@@ -0,0 +1,42 @@
+"""
+Adaptive timeout decisions of mksTimeout.AdaptiveTimeout
+"""
+import mksTimeout
+
+
+def learned(dt=0.02, count=32):
+    """AdaptiveTimeout whose gauge 1 has learned from `count` fast replies"""
+    adaptive = mksTimeout.AdaptiveTimeout(initial=0.1)
+    for nn in range(count):
+        adaptive.observe(1, dt)
+    return adaptive
+
+
+def test_isolated_drop_keeps_timeout():
+    adaptive = learned()
+    timeout = adaptive.timeout(1)
+    assert timeout == 0.03
+    for nn in range(64):
+        if nn % 8 == 0:
+            adaptive.expired(1, timeout)
+        adaptive.observe(1, 0.02)
+    assert adaptive.timeout(1) == timeout
+    assert adaptive.gauges[1].timeouts == 8
+
+
+def test_consecutive_misses_widen_then_relearn():
+    adaptive = learned()
+    for nn in range(adaptive.misses):
+        adaptive.expired(1, adaptive.timeout(1))
+    assert adaptive.timeout(1) == 0.06
+    # the gauge was only slow for a moment: the kept window brings it back
+    for nn in range(adaptive.every):
+        adaptive.observe(1, 0.02)
+    assert adaptive.timeout(1) == 0.03
+
+
+def test_widening_stops_at_ceiling():
+    adaptive = learned()
+    for nn in range(10 * adaptive.misses):
+        adaptive.expired(1, adaptive.timeout(1))
+    assert adaptive.timeout(1) == adaptive.ceiling